@@ -0,0 +1,136 @@
+class AsyncMultiNodePipeline(object):
+    def __init__(self, client, transaction=True, timeout=None):
+        """
+            asyncio version of MultiNodePipeline.  Commands are queued
+            synchronously; execute() is a coroutine that runs every node's
+            sub-pipeline at once with asyncio.gather.
+            Args:
+                client - the AsyncMultiNodeRedis that created this pipeline.
+                timeout - seconds to wait on each node.  Defaults to the
+                          client's timeout.
+        """
+        self.client = client
+        self.counter = 0
+        self.transaction = transaction
+        self.timeout = timeout
+        self.pipeline_map = {}
+        self.pipeline_order = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        return
+
+    def __len__(self):
+        return self.counter
+
+    def reset(self):
+        self.counter = 0
+        self.pipeline_map = {}
+        self.pipeline_order = {}
+
+    def is_single_node(self):
+        return len(self.pipeline_map) <= 1
+
+    def _get_pipeline(self, key):
+        node = self.client._get_node(key)
+        if node not in self.pipeline_map:
+            pipeline = node.pipeline(transaction=self.transaction)
+            self.pipeline_map[node] = pipeline
+            self.pipeline_order[pipeline] = []
+        return self.pipeline_map[node]
+
+    def _update_pipeline(self, key):
+        pipeline = self._get_pipeline(key)
+        self.pipeline_order[pipeline].append(self.counter)
+        self.counter += 1
+        return pipeline
+
+    async def execute(self):
+        try:
+            pipelines = list(self.pipeline_map.values())
+            timeout = self.timeout
+            if timeout is None:
+                timeout = self.client.timeout
+            if len(pipelines) == 1 and timeout is None:
+                # no timeout for _gather to enforce
+                return await pipelines[0].execute()
+            results = await self.client._gather(
+                [pipeline.execute() for pipeline in pipelines],
+                timeout=timeout)
+            output = [None] * len(self)
+            for pipeline, values in zip(pipelines, results):
+                order = self.pipeline_order[pipeline]
+                for i, value in enumerate(values):
+                    output[order[i]] = value
+            return output
+        finally:
+            self.reset()
+
+    def delete(self, key):
+        self._update_pipeline(key).delete(key)
+        return self
+
+    def expire(self, key, time):
+        self._update_pipeline(key).expire(key, time)
+        return self
+
+    def get(self, key):
+        self._update_pipeline(key).get(key)
+        return self
+
+    def hget(self, key, field):
+        self._update_pipeline(key).hget(key, field)
+        return self
+
+    def hgetall(self, key):
+        self._update_pipeline(key).hgetall(key)
+        return self
+
+    def hincrby(self, key, field, amount=1):
+        self._update_pipeline(key).hincrby(key, field, amount=amount)
+        return self
+
+    def hmset(self, key, mapping):
+        self._update_pipeline(key).hset(key, mapping=mapping)
+        return self
+
+    def hset(self, key, field, value):
+        self._update_pipeline(key).hset(key, field, value)
+        return self
+
+    def incr(self, key, amount=1):
+        self._update_pipeline(key).incr(key, amount=amount)
+        return self
+
+    def llen(self, key):
+        self._update_pipeline(key).llen(key)
+        return self
+
+    def persist(self, key):
+        self._update_pipeline(key).persist(key)
+        return self
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        self._update_pipeline(key).set(key, value, ex=ex, px=px, nx=nx, xx=xx)
+        return self
+
+    def ttl(self, key):
+        self._update_pipeline(key).ttl(key)
+        return self
+
+    def zadd(self, key, mapping, **kwargs):
+        self._update_pipeline(key).zadd(key, mapping, **kwargs)
+        return self
+
+    def zincrby(self, key, value, amount=1):
+        self._update_pipeline(key).zincrby(key, amount, value)
+        return self
+
+    def zrange(self, key, start, end, desc=False, withscores=False,
+               score_cast_func=float):
+        self._update_pipeline(key).zrange(key, start, end, desc=desc,
+                                          withscores=withscores,
+                                          score_cast_func=score_cast_func)
+        return self
@@ -0,0 +1,224 @@
+import asyncio
+import redis.asyncio
+from asyncmultinodepipeline import AsyncMultiNodePipeline
+from multinodeexceptions import (MultiNodeRedisException,
+                                 MultiNodeTimeoutException)
+from multinodemanager import MultiNodeManager, NODE_NAME
+from multinoderouter import ModuloRouter, node_order
+
+
+class AsyncMultiNodeRedis(object):
+    def __init__(self, master_servers, slave_servers=None, timeout=None,
+                 router=None):
+        """
+            asyncio version of MultiNodeRedis.  Requires Python 3 and
+            redis-py >= 4.2, and keeps one redis.asyncio client per node.
+            Keys are routed exactly as in MultiNodeRedis, including the
+            node order ModuloRouter takes from Python 2's dict order, see
+            multinoderouter.node_order.
+
+            If any entry has no node name, await initialize() (or use
+            ``async with``) before issuing commands, so the names can be read
+            from the nodes.
+            Args:
+                master_servers - e.g. [node1|127.0.0.1:6379,
+                                       node2|127.0.0.1:6370]
+                slave_servers - same as master_hosts
+                timeout - seconds to wait on any one node during a fan-out.
+                router - node routing scheme, see MultiNodeManager.
+        """
+        self.timeout = timeout
+        self._router_factory = router or ModuloRouter
+        self._master_entries = [self._parse_config(entry)
+                                for entry in master_servers]
+        self._slave_entries = [self._parse_config(entry)
+                               for entry in slave_servers or []]
+        self.node_map = None
+        self.router = None
+        self._masters = None
+        entries = self._master_entries + self._slave_entries
+        if all(node_name for node_name, _ in entries):
+            self._compile()
+
+    async def __aenter__(self):
+        return await self.initialize()
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    @classmethod
+    def _parse_config(cls, entry):
+        node_name, host, port = MultiNodeManager._parse_entry(entry)
+        node = redis.asyncio.StrictRedis(host=host,
+                                         port=port,
+                                         db=0,
+                                         decode_responses=True)
+        return node_name, node
+
+    def _compile(self):
+        self.node_map = {}
+        for node_name, node in self._master_entries:
+            self.node_map[node_name] = [node]
+        for node_name, node in self._slave_entries:
+            if node_name not in self.node_map:
+                raise MultiNodeRedisException("slave with node_name: " +
+                    "%s has no corresponding master." % node_name)
+            self.node_map[node_name].append(node)
+        self.router = self._router_factory(
+            node_order(node_name for node_name, _ in self._master_entries))
+        self._masters = tuple(self.node_map[node_name][0]
+                              for node_name in self.router.node_names)
+
+    def _get_node(self, key):
+        if self._masters is None:
+            raise MultiNodeRedisException("node names are not known yet, " +
+                "await initialize() first.")
+        return self._masters[self.router.get_node_index(key)]
+
+    def _get_all_nodes(self):
+        return list(self._masters)
+
+    async def _gather(self, coroutines, timeout=None):
+        """
+            Await one coroutine per node concurrently, returning their results
+            in order.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is not None:
+            coroutines = [asyncio.wait_for(coroutine, timeout)
+                          for coroutine in coroutines]
+        try:
+            return await asyncio.gather(*coroutines)
+        except asyncio.TimeoutError:
+            raise MultiNodeTimeoutException("node did not respond within " +
+                "%ss." % timeout)
+
+    async def _scatter_gather(self, keys, func, timeout=None):
+        """
+            Await func(node, node_keys) for every node owning one of keys,
+            concurrently.  Returns a list of (positions, result) pairs, one per
+            node, where positions are the indexes into keys sent to that node.
+        """
+        groups = {}
+        for position, index in enumerate(self.router.get_node_indexes(keys)):
+            if index not in groups:
+                groups[index] = []
+            groups[index].append(position)
+        groups = list(groups.items())
+        results = await self._gather(
+            [func(self._masters[index],
+                  [keys[position] for position in positions])
+             for index, positions in groups],
+            timeout=timeout)
+        return [(positions, result)
+                for (_, positions), result in zip(groups, results)]
+
+    async def initialize(self):
+        """
+            Read node names from any nodes configured without one, then build
+            the routing table.  Safe to call more than once.
+        """
+        if self._masters is None:
+            for entries in (self._master_entries, self._slave_entries):
+                names = await asyncio.gather(*[node.get(NODE_NAME)
+                                               for _, node in entries])
+                for i, (node_name, node) in enumerate(entries):
+                    node_name = node_name or names[i]
+                    if not node_name:
+                        raise MultiNodeRedisException("key: 'node_name' " +
+                            "not set in node %r" % node)
+                    entries[i] = (node_name, node)
+            self._compile()
+        return self
+
+    async def close(self):
+        for _, node in self._master_entries + self._slave_entries:
+            await node.connection_pool.disconnect()
+
+    async def delete(self, *names):
+        results = await self._scatter_gather(
+            names, lambda node, node_keys: node.delete(*node_keys))
+        return sum(result for _, result in results)
+
+    async def expire(self, key, time):
+        return await self._get_node(key).expire(key, time)
+
+    async def flushall(self):
+        await self._gather([node.flushall() for node in self._get_all_nodes()])
+
+    async def get(self, key):
+        return await self._get_node(key).get(key)
+
+    async def hget(self, key, field):
+        return await self._get_node(key).hget(key, field)
+
+    async def hgetall(self, key):
+        return await self._get_node(key).hgetall(key)
+
+    async def hincrby(self, key, field, amount=1):
+        return await self._get_node(key).hincrby(key, field, amount=amount)
+
+    async def hmset(self, key, mapping):
+        return await self._get_node(key).hset(key, mapping=mapping)
+
+    async def hset(self, key, field, value):
+        return await self._get_node(key).hset(key, field, value)
+
+    async def incr(self, key, amount=1):
+        return await self._get_node(key).incr(key, amount=amount)
+
+    async def llen(self, key):
+        return await self._get_node(key).llen(key)
+
+    async def mget(self, keys, *args):
+        if isinstance(keys, (str, bytes)):
+            keys = [keys]
+        keys = list(keys) + list(args)
+        output = [None] * len(keys)
+        results = await self._scatter_gather(
+            keys, lambda node, node_keys: node.mget(node_keys))
+        for positions, values in results:
+            for position, value in zip(positions, values):
+                output[position] = value
+        return output
+
+    async def mset(self, *args, **kwargs):
+        if args:
+            if len(args) != 1 or not isinstance(args[0], dict):
+                raise MultiNodeRedisException('MSET requires **kwargs or a ' +
+                    'single dict arg')
+            kwargs.update(args[0])
+        mapping = kwargs
+        results = await self._scatter_gather(
+            list(mapping),
+            lambda node, node_keys: node.mset(dict((key, mapping[key])
+                                                   for key in node_keys)))
+        return all(result for _, result in results)
+
+    async def persist(self, key):
+        return await self._get_node(key).persist(key)
+
+    def pipeline(self, transaction=True, timeout=None):
+        return AsyncMultiNodePipeline(self,
+                                      transaction=transaction,
+                                      timeout=timeout)
+
+    async def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        return await self._get_node(key).set(key, value, ex=ex, px=px, nx=nx,
+                                             xx=xx)
+
+    async def ttl(self, key):
+        return await self._get_node(key).ttl(key)
+
+    async def zadd(self, key, mapping, **kwargs):
+        return await self._get_node(key).zadd(key, mapping, **kwargs)
+
+    async def zincrby(self, key, value, amount=1):
+        return await self._get_node(key).zincrby(key, amount, value)
+
+    async def zrange(self, key, start, end, desc=False, withscores=False,
+                     score_cast_func=float):
+        return await self._get_node(key).zrange(
+            key, start, end, desc=desc, withscores=withscores,
+            score_cast_func=score_cast_func)
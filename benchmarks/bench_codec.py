@@ -0,0 +1,61 @@
+"""
+    Bytes on the wire against CPU for MultiNodeCodec, on JSON blobs of a few
+    sizes.  No redis server is needed.
+
+    Usage: python benchmarks/bench_codec.py [iterations]
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from multinodecodec import MultiNodeCodec
+
+
+def make_blob(size):
+    random.seed(size)
+    items = []
+    blob = ''
+    while len(blob) < size:
+        items.append({'id': len(items),
+                      'name': 'user%d' % random.randint(0, 100000),
+                      'score': random.random(),
+                      'tags': random.sample(['a', 'b', 'c', 'd', 'e'], 2)})
+        blob = json.dumps(items)
+    return blob
+
+
+def timed(func, iterations):
+    start = time.time()
+    for _ in xrange(iterations):
+        func()
+    return (time.time() - start) / iterations * 1000000
+
+
+def main(iterations=2000):
+    codecs = [('none', None),
+              ('threshold 1k level 1', MultiNodeCodec()),
+              ('threshold 1k level 6', MultiNodeCodec(compress_level=6)),
+              ('threshold 16k level 1',
+               MultiNodeCodec(compress_threshold=16384))]
+    print '%-8s %-22s %10s %8s %12s %12s' % (
+        'size', 'codec', 'bytes', 'ratio', 'encode us', 'decode us')
+    for size in [100, 1000, 10000, 100000]:
+        blob = make_blob(size)
+        count = max(10, iterations * 1000 // size)
+        for label, codec in codecs:
+            if codec is None:
+                encoded, encode_us, decode_us = blob, 0.0, 0.0
+            else:
+                encoded = codec.encode(blob)
+                encode_us = timed(lambda: codec.encode(blob), count)
+                decode_us = timed(lambda: codec.decode(encoded), count)
+            print '%-8d %-22s %10d %7.2fx %12.1f %12.1f' % (
+                len(blob), label, len(encoded),
+                len(blob) / float(len(encoded)), encode_us, decode_us)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
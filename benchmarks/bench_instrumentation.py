@@ -0,0 +1,60 @@
+"""
+    Measures what instrumentation costs per command.  Compares a node's own
+    client, MultiNodeRedis with instrumentation off, and with it on.  Needs
+    running redis servers.
+
+    Usage: python benchmarks/bench_instrumentation.py [ops] [host:port ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from multinodeinstrumentation import MultiNodeInstrumentation
+from multinoderedis import MultiNodeRedis
+
+
+def timed(label, func, ops, baseline=None):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    line = '%-28s %8.3fs %10.0f ops/s %8.2fus/op' % (
+        label, elapsed, ops / elapsed, elapsed / ops * 1000000)
+    if baseline is not None:
+        line += '  %+6.1f%%' % ((elapsed / baseline - 1) * 100)
+    print line
+    return elapsed
+
+
+def main(ops=20000, *servers):
+    servers = servers or ('127.0.0.1:6379', '127.0.0.1:6370')
+    master_servers = ['node%d|%s' % (i, server)
+                      for i, server in enumerate(servers)]
+    plain = MultiNodeRedis(master_servers)
+    instrumented = MultiNodeRedis(master_servers,
+                                  instrumentation=MultiNodeInstrumentation())
+    keys = ['bench:%d' % (i % 1000) for i in range(ops)]
+    plain.mset(dict((key, 'x' * 32) for key in set(keys)))
+    node = plain._get_node(keys[0])
+    same_node = [key for key in keys if plain._get_node(key) is node]
+
+    def get_all(client, keys):
+        get = client.get
+        for key in keys:
+            get(key)
+
+    # Warm up connections before timing anything.
+    get_all(plain, keys[:100])
+    get_all(instrumented, keys[:100])
+    baseline = timed('node client get', lambda: get_all(node, same_node),
+                     len(same_node))
+    baseline = baseline / len(same_node) * ops
+    timed('instrumentation off get', lambda: get_all(plain, keys), ops,
+          baseline)
+    timed('instrumentation on get', lambda: get_all(instrumented, keys), ops,
+          baseline)
+    plain.delete(*set(keys))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) if arg.isdigit() else arg for arg in sys.argv[1:]])
@@ -0,0 +1,50 @@
+"""
+    Microbenchmark for key routing.  No redis server is needed, since naming
+    every node in the config means the manager never connects.
+
+    Usage: python benchmarks/bench_routing.py [key_count] [node_count]
+"""
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from multinodemanager import MultiNodeManager
+from multinoderouter import KetamaRouter
+
+
+def legacy_get_node(manager, key):
+    # The routing path before the routing table was compiled.
+    crc = zlib.crc32(key.encode('utf-8'))
+    node_pos = crc % len(manager.node_map)
+    node_name = manager.node_map.keys()[node_pos]
+    return manager.node_map[node_name][0]
+
+
+def timed(label, func, key_count):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '%-32s %8.3fs %12.0f keys/s' % (label, elapsed, key_count / elapsed)
+
+
+def main(key_count=200000, node_count=8):
+    servers = ['node%d|127.0.0.1:%d' % (i, 7000 + i)
+               for i in range(node_count)]
+    keys = ['user:%d:profile' % i for i in range(key_count)]
+    modulo = MultiNodeManager(servers)
+    ketama = MultiNodeManager(servers, router=KetamaRouter)
+
+    timed('legacy _get_node', lambda: [legacy_get_node(modulo, key)
+                                       for key in keys], key_count)
+    timed('modulo _get_node', lambda: [modulo._get_node(key)
+                                       for key in keys], key_count)
+    timed('modulo route_many', lambda: modulo.route_many(keys), key_count)
+    timed('ketama _get_node', lambda: [ketama._get_node(key)
+                                       for key in keys], key_count)
+    timed('ketama route_many', lambda: ketama.route_many(keys), key_count)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
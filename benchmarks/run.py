@@ -0,0 +1,202 @@
+"""
+    Benchmark suite for the hot paths: routing, single-key commands, mget/mset
+    fan-out and pipelines.  Starts its own redis-server processes on ephemeral
+    ports and writes machine-readable JSON results.
+
+    Usage:
+        python benchmarks/run.py [--shards 1,2,4,8] [--quick]
+                                 [--output results.json]
+                                 [--compare baseline.json] [--tolerance 0.1]
+
+    With --compare, exits non-zero if any benchmark's ops/sec dropped by more
+    than --tolerance relative to the baseline file.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from benchmarks.servers import LocalRedisServers
+from multinodeinstrumentation import MultiNodeHistogram
+from multinodemanager import MultiNodeManager
+from multinoderedis import MultiNodeRedis
+from multinoderouter import KetamaRouter
+
+VALUE = 'x' * 64
+
+
+def measure(name, params, operation, iterations, ops_per_iteration=1):
+    """
+        Time iterations calls of operation.  Latency percentiles are per call;
+        throughput counts ops_per_iteration ops per call.
+    """
+    histogram = MultiNodeHistogram()
+    start = time.time()
+    for _ in xrange(iterations):
+        call_start = time.time()
+        operation()
+        histogram.record((time.time() - call_start) * 1000000)
+    elapsed = time.time() - start
+    latency = histogram.snapshot()
+    result = {'name': name,
+              'params': params,
+              'iterations': iterations,
+              'ops': iterations * ops_per_iteration,
+              'seconds': elapsed,
+              'ops_per_sec': iterations * ops_per_iteration / elapsed,
+              'p50_us': latency['p50'],
+              'p99_us': latency['p99'],
+              'max_us': latency['max']}
+    print >> sys.stderr, '%-24s %-40s %12.0f ops/s  p50 %7dus  p99 %7dus' % (
+        name, json.dumps(params, sort_keys=True), result['ops_per_sec'],
+        result['p50_us'], result['p99_us'])
+    return result
+
+
+def bench_routing(results, shard_counts, scale):
+    keys = ['user:%d:profile' % i for i in range(int(100000 * scale))]
+    for shards in shard_counts:
+        servers = ['node%d|127.0.0.1:%d' % (i, 7000 + i)
+                   for i in range(shards)]
+        for router_name, router in [('modulo', None),
+                                    ('ketama', KetamaRouter)]:
+            manager = MultiNodeManager(servers, router=router)
+            params = {'shards': shards, 'router': router_name,
+                      'keys': len(keys)}
+            iterator = itertools.cycle(keys)
+            results.append(measure(
+                '_get_node_name', params,
+                lambda: manager._get_node_name(next(iterator)), len(keys)))
+            results.append(measure(
+                'route_many', params,
+                lambda: manager.route_many(keys), 1, len(keys)))
+
+
+def bench_cluster(results, shards, scale):
+    with LocalRedisServers(shards) as servers:
+        rc = MultiNodeRedis(servers.master_servers)
+        keys = ['key:%d' % i for i in range(10000)]
+        rc.mset(dict((key, VALUE) for key in keys))
+        params = {'shards': shards}
+
+        iterator = itertools.cycle(keys)
+        results.append(measure('get', params,
+                               lambda: rc.get(next(iterator)),
+                               int(5000 * scale)))
+        iterator = itertools.cycle(keys)
+        results.append(measure('set', params,
+                               lambda: rc.set(next(iterator), VALUE),
+                               int(5000 * scale)))
+
+        for batch in [10, 100, 1000]:
+            batch_keys = keys[:batch]
+            mapping = dict((key, VALUE) for key in batch_keys)
+            batch_params = dict(params, batch=batch)
+            iterations = max(10, int(20000 * scale) // batch)
+            results.append(measure('mget', batch_params,
+                                   lambda: rc.mget(batch_keys),
+                                   iterations, batch))
+            results.append(measure('mset', batch_params,
+                                   lambda: rc.mset(mapping),
+                                   iterations, batch))
+
+        for size in [10, 100, 1000, 10000, 100000]:
+            if size > 100000 * scale:
+                continue
+            def run_pipeline():
+                pipe = rc.pipeline(transaction=False)
+                for i in xrange(size):
+                    pipe.get(keys[i % len(keys)])
+                pipe.execute()
+            iterations = max(3, int(20000 * scale) // size)
+            results.append(measure('pipeline_get', dict(params, size=size),
+                                   run_pipeline, iterations, size))
+
+        records = [('load:%d' % i, VALUE)
+                   for i in xrange(int(100000 * scale))]
+        loader = rc.bulk_loader()
+        results.append(measure('bulk_load', params,
+                               lambda: loader.load(records), 1,
+                               len(records)))
+
+        boards = ['board:%d' % i for i in range(8)]
+        for i, board in enumerate(boards):
+            members = []
+            for j in xrange(10000):
+                members.extend([(j * 7919 + i) % 100003, 'player:%d' % j])
+            rc.zadd(board, *members)
+        results.append(measure('zrange_many_top100', params,
+                               lambda: rc.zrange_many(boards, 0, 99,
+                                                      desc=True),
+                               max(10, int(500 * scale))))
+        rc.flushall()
+
+
+def compare(results, baseline_path, tolerance):
+    """
+        Returns the benchmarks whose ops/sec fell by more than tolerance.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = dict((_result_key(result), result)
+                    for result in baseline['results'])
+    regressions = []
+    for result in results:
+        old = previous.get(_result_key(result))
+        if old and result['ops_per_sec'] < old['ops_per_sec'] * (1 - tolerance):
+            regressions.append({'name': result['name'],
+                                'params': result['params'],
+                                'baseline_ops_per_sec': old['ops_per_sec'],
+                                'ops_per_sec': result['ops_per_sec']})
+    return regressions
+
+
+def _result_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--shards', default='1,2,4,8',
+                        help='comma separated shard counts to run')
+    parser.add_argument('--quick', action='store_true',
+                        help='run a tenth of the iterations')
+    parser.add_argument('--output', help='write JSON results here')
+    parser.add_argument('--compare', help='baseline JSON to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--skip-servers', action='store_true',
+                        help='only run benchmarks that need no redis')
+    args = parser.parse_args()
+    shard_counts = [int(shards) for shards in args.shards.split(',')]
+    scale = 0.1 if args.quick else 1.0
+
+    results = []
+    bench_routing(results, shard_counts, scale)
+    if not args.skip_servers:
+        for shards in shard_counts:
+            bench_cluster(results, shards, scale)
+
+    report = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.time(),
+              'results': results}
+    if args.compare:
+        report['regressions'] = compare(results, args.compare, args.tolerance)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print output
+    if report.get('regressions'):
+        for regression in report['regressions']:
+            print >> sys.stderr, 'REGRESSION %s' % json.dumps(regression)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+    Start throwaway redis-server processes on ephemeral ports for benchmarks.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import redis
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class LocalRedisServers(object):
+    def __init__(self, count, redis_server='redis-server'):
+        """
+            Context manager running count redis-server processes with
+            persistence off, each in its own temp directory.  master_servers
+            is the config list to hand to MultiNodeRedis.
+        """
+        self.count = count
+        self.redis_server = os.environ.get('REDIS_SERVER', redis_server)
+        self.processes = []
+        self.ports = []
+        self.directory = None
+
+    @property
+    def master_servers(self):
+        return ['node%d|127.0.0.1:%d' % (i, port)
+                for i, port in enumerate(self.ports)]
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='multinode-bench-')
+        try:
+            for _ in range(self.count):
+                self._start()
+        except:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, type, value, traceback):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _start(self):
+        port = _free_port()
+        devnull = open(os.devnull, 'w')
+        try:
+            process = subprocess.Popen(
+                [self.redis_server, '--port', str(port),
+                 '--bind', '127.0.0.1', '--save', '', '--appendonly', 'no',
+                 '--dir', self.directory],
+                stdout=devnull, stderr=devnull)
+        except OSError:
+            raise RuntimeError("could not run %r, install redis or set "
+                               "REDIS_SERVER." % self.redis_server)
+        self.processes.append(process)
+        self.ports.append(port)
+        client = redis.StrictRedis(port=port)
+        deadline = time.time() + 10
+        while True:
+            try:
+                client.ping()
+                return
+            except redis.ConnectionError:
+                if process.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("redis-server on port %d did not "
+                                       "start." % port)
+                time.sleep(0.05)
@@ -0,0 +1,118 @@
+import threading
+import time
+
+
+class _AutoPipelineFuture(object):
+    def __init__(self, args, options):
+        self.args = args
+        self.options = options
+        self.value = None
+        self.error = None
+        # Set when the reply is in, or when this caller is handed the job of
+        # sending the next batch.
+        self.event = threading.Event()
+        self.lead = False
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class MultiNodeAutoPipeline(object):
+    def __init__(self, window=0, max_batch=100):
+        """
+            Coalesce single commands issued concurrently to the same node
+            into one pipeline round trip.  Pass one to
+            MultiNodeRedis(auto_pipeline=...) and every node's execute_command
+            queues its command and blocks on a future for the reply.  While a
+            batch is on the wire, commands from other threads queue behind it
+            and go out together in the next one, so a lone caller pays no
+            extra latency.
+            Args:
+                window - seconds to wait for more commands before sending a
+                         batch.  0 only batches what queued up meanwhile.
+                max_batch - most commands sent in one pipeline.
+        """
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.commands = 0
+        self._lock = threading.Lock()
+
+    def attach(self, node):
+        """
+            Route node.execute_command through a per-node batcher.
+        """
+        batcher = _NodeBatcher(self, node)
+        node.execute_command = batcher.execute_command
+        return batcher
+
+    def record_batch(self, commands):
+        with self._lock:
+            self.batches += 1
+            self.commands += commands
+
+    def stats(self):
+        return {'batches': self.batches,
+                'commands': self.commands,
+                'mean_batch': (self.commands / float(self.batches)
+                               if self.batches else 0)}
+
+
+class _NodeBatcher(object):
+    def __init__(self, auto_pipeline, node):
+        self.auto_pipeline = auto_pipeline
+        self.node = node
+        self._queue = []
+        # True while some caller is responsible for sending the queue.  Only
+        # False when the queue is empty.
+        self._sending = False
+        self._lock = threading.Lock()
+
+    def execute_command(self, *args, **options):
+        future = _AutoPipelineFuture(args, options)
+        with self._lock:
+            self._queue.append(future)
+            lead = not self._sending
+            self._sending = True
+        if not lead:
+            future.event.wait()
+            lead = future.lead
+        if lead:
+            self._send_batch()
+        return future.result()
+
+    def _send_batch(self):
+        auto_pipeline = self.auto_pipeline
+        if (auto_pipeline.window and
+                len(self._queue) < auto_pipeline.max_batch):
+            time.sleep(auto_pipeline.window)
+        with self._lock:
+            batch = self._queue[:auto_pipeline.max_batch]
+            del self._queue[:auto_pipeline.max_batch]
+        try:
+            pipeline = self.node.pipeline(transaction=False)
+            for future in batch:
+                pipeline.execute_command(*future.args, **future.options)
+            values = pipeline.execute(raise_on_error=False)
+        except Exception as e:
+            for future in batch:
+                future.error = e
+        else:
+            for future, value in zip(batch, values):
+                if isinstance(value, Exception):
+                    future.error = value
+                else:
+                    future.value = value
+        auto_pipeline.record_batch(len(batch))
+        with self._lock:
+            if self._queue:
+                # Hand off to a caller still waiting, so we can return.
+                successor = self._queue[0]
+                successor.lead = True
+                successor.event.set()
+            else:
+                self._sending = False
+        for future in batch:
+            future.event.set()
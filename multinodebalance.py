@@ -0,0 +1,325 @@
+"""
+    Predict how keys spread over nodes, and how many would move under a new
+    node list, without touching the nodes.
+
+    Usage: python multinodebalance.py KEY_FILE --nodes node1,node2
+               [--router ketama] [--new-nodes node1,node2,node3]
+               [--new-router ketama] [--top-tags 10]
+
+    KEY_FILE holds one key per line, optionally followed by a tab and the
+    key's size in bytes; - reads stdin.  Nodes are given as node names or
+    as the named master config entries the client uses, e.g.
+    node1|127.0.0.1:6379.
+"""
+import argparse
+import collections
+import itertools
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from multinodemanager import MultiNodeManager
+from multinoderouter import (KetamaRouter, ModuloRouter, _find_hash_tag,
+                             node_order)
+
+ROUTERS = {'modulo': ModuloRouter, 'ketama': KetamaRouter}
+
+
+def _skew(counts):
+    """
+        Biggest count over the mean count; 1.0 is perfectly even.
+    """
+    total = sum(counts)
+    if not total:
+        return 1.0
+    return max(counts) * len(counts) / float(total)
+
+
+class MultiNodeBalanceAnalyzer(object):
+    def __init__(self, router, new_router=None, top_tags=10,
+                 tag_capacity=1000):
+        """
+            Feed keys in batches with add() (or add_file(), add_scan()),
+            then read report().  Keys are routed a batch at a time through
+            the routers' get_node_indexes, which KetamaRouter vectorizes
+            with numpy for big batches while ModuloRouter hashes key by key,
+            and tallied with numpy when it is installed.  Memory stays
+            constant however many keys are fed:
+            only per-node counters and a bounded summary of hash tags are
+            kept.  Hash tags are only counted if router honours them, as
+            otherwise they don't decide where keys go.
+            Args:
+                router - the current routing, e.g. a MultiNodeManager's
+                         router, or ModuloRouter(['node1', 'node2']).
+                new_router - optional proposed routing to count moves
+                             under.  Nodes are matched by name.
+                top_tags - hash tags listed in the report.
+                tag_capacity - tags tracked at once.  Tag counts are lower
+                               bounds, off by at most tagged keys /
+                               tag_capacity.
+        """
+        self.router = router
+        self.new_router = new_router
+        self.hash_tags = getattr(router, 'hash_tags', False)
+        self.top_tags = top_tags
+        self.tag_capacity = tag_capacity
+        self.keys = 0
+        self.tagged_keys = 0
+        node_count = len(router.node_names)
+        self._key_counts = _counters(node_count)
+        self._byte_counts = _counters(node_count)
+        if new_router is not None:
+            # indexed by old node index * new node count + new node index
+            self._move_counts = _counters(
+                node_count * len(new_router.node_names))
+        # tag -> count, a Misra-Gries summary of the most common tags
+        self._tags = {}
+
+    def add(self, keys, sizes=None):
+        """
+            Count a batch of keys.  sizes are their sizes in bytes, and
+            default to the keys' own lengths.
+        """
+        if not keys:
+            return
+        if sizes is None:
+            sizes = [len(key) for key in keys]
+        indexes = self.router.get_node_indexes(keys)
+        new_count = 0
+        if self.new_router is not None:
+            new_indexes = self.new_router.get_node_indexes(keys)
+            new_count = len(self.new_router.node_names)
+        if numpy is not None:
+            indexes = numpy.asarray(indexes)
+            node_count = len(self._key_counts)
+            self._key_counts += numpy.bincount(indexes, minlength=node_count)
+            self._byte_counts += numpy.bincount(
+                indexes, weights=sizes, minlength=node_count).astype(
+                    numpy.int64)
+            if new_count:
+                self._move_counts += numpy.bincount(
+                    indexes * new_count + numpy.asarray(new_indexes),
+                    minlength=len(self._move_counts))
+        else:
+            for index, size in itertools.izip(indexes, sizes):
+                self._key_counts[index] += 1
+                self._byte_counts[index] += size
+            if new_count:
+                for index, new_index in itertools.izip(indexes, new_indexes):
+                    self._move_counts[index * new_count + new_index] += 1
+        self.keys += len(keys)
+        if not self.hash_tags:
+            return
+        # the substring test is cheap and rules out most keys
+        tags = collections.Counter(
+            tag for tag in map(_find_hash_tag,
+                               [key for key in keys if '{' in key])
+            if tag is not None)
+        self.tagged_keys += sum(tags.itervalues())
+        self._merge_tags(tags)
+
+    def add_lines(self, lines, batch_size=10000):
+        """
+            Count keys from an iterable of "key" or "key<TAB>size" lines.
+        """
+        lines = iter(lines)
+        while True:
+            batch = list(itertools.islice(lines, batch_size))
+            if not batch:
+                return
+            keys = []
+            sizes = []
+            for line in batch:
+                line = line.rstrip('\r\n')
+                if '\t' in line:
+                    key, _, size = line.rpartition('\t')
+                    size = int(size)
+                else:
+                    key = line
+                    size = len(key)
+                keys.append(key)
+                sizes.append(size)
+            self.add(keys, sizes)
+
+    def add_file(self, path, batch_size=10000):
+        """
+            Count keys from a file of lines, see add_lines.  - is stdin.
+        """
+        if path == '-':
+            return self.add_lines(sys.stdin, batch_size=batch_size)
+        with open(path, 'rb') as f:
+            self.add_lines(f, batch_size=batch_size)
+
+    def add_scan(self, client, match=None, count=1000, memory_usage=False,
+                 batch_size=10000):
+        """
+            Count the keys of every master of client, a MultiNodeRedis or
+            MultiNodeManager, by SCANning them one after another.  With
+            memory_usage, each key's size is its MEMORY USAGE (redis >= 4),
+            fetched in pipelines of batch_size keys.
+        """
+        for node in client._get_all_nodes():
+            keys = node.scan_iter(match=match, count=count)
+            while True:
+                batch = list(itertools.islice(keys, batch_size))
+                if not batch:
+                    break
+                sizes = None
+                if memory_usage:
+                    pipe = node.pipeline(transaction=False)
+                    for key in batch:
+                        pipe.execute_command('MEMORY', 'USAGE', key)
+                    # a key that expired since the SCAN reports None
+                    sizes = [size or 0 for size in pipe.execute()]
+                self.add(batch, sizes)
+
+    def report(self):
+        """
+            Returns {'keys', 'bytes', 'nodes': {node_name: {'keys', 'bytes',
+            'key_share', 'byte_share'}}, 'key_skew', 'byte_skew',
+            'tagged_keys', 'hot_tags': [(tag, keys)], 'hot_tag_share'}, plus
+            with a new_router {'moved_keys', 'moved_fraction', 'moves':
+            {(old node_name, new node_name): keys}, 'new_nodes': {node_name:
+            keys}, 'new_key_skew'}.
+        """
+        key_counts = [int(count) for count in self._key_counts]
+        byte_counts = [int(count) for count in self._byte_counts]
+        keys = sum(key_counts)
+        total_bytes = sum(byte_counts)
+        nodes = {}
+        for node_name, node_keys, node_bytes in zip(
+                self.router.node_names, key_counts, byte_counts):
+            nodes[node_name] = {
+                'keys': node_keys,
+                'bytes': node_bytes,
+                'key_share': node_keys / float(keys) if keys else 0.0,
+                'byte_share': (node_bytes / float(total_bytes)
+                               if total_bytes else 0.0)}
+        hot_tags = sorted(self._tags.iteritems(), key=lambda item: -item[1])
+        hot_tags = hot_tags[:self.top_tags]
+        report = {'keys': keys,
+                  'bytes': total_bytes,
+                  'nodes': nodes,
+                  'key_skew': _skew(key_counts),
+                  'byte_skew': _skew(byte_counts),
+                  'tagged_keys': self.tagged_keys,
+                  'hot_tags': hot_tags,
+                  'hot_tag_share': (sum(count for _, count in hot_tags) /
+                                    float(keys) if keys else 0.0)}
+        if self.new_router is not None:
+            report.update(self._move_report(keys))
+        return report
+
+    ## Start private functions
+
+    def _move_report(self, keys):
+        old_names = self.router.node_names
+        new_names = self.new_router.node_names
+        moves = {}
+        new_nodes = dict((node_name, 0) for node_name in new_names)
+        for position, count in enumerate(self._move_counts):
+            count = int(count)
+            if not count:
+                continue
+            old_name = old_names[position // len(new_names)]
+            new_name = new_names[position % len(new_names)]
+            new_nodes[new_name] += count
+            if old_name != new_name:
+                moves[(old_name, new_name)] = count
+        moved = sum(moves.itervalues())
+        return {'moved_keys': moved,
+                'moved_fraction': moved / float(keys) if keys else 0.0,
+                'moves': moves,
+                'new_nodes': new_nodes,
+                'new_key_skew': _skew(new_nodes.values())}
+
+    def _merge_tags(self, counts):
+        """
+            Add a batch's tag counts to the summary.  Past tag_capacity
+            tags, every count drops by the first one that doesn't fit and
+            tags reaching zero are forgotten, so the summary stays bounded.
+        """
+        tags = self._tags
+        for tag, count in counts.iteritems():
+            tags[tag] = tags.get(tag, 0) + count
+        if len(tags) > self.tag_capacity:
+            cut = sorted(tags.itervalues(), reverse=True)[self.tag_capacity]
+            self._tags = dict((tag, count - cut)
+                              for tag, count in tags.iteritems()
+                              if count > cut)
+
+
+def _counters(size):
+    if numpy is not None:
+        return numpy.zeros(size, dtype=numpy.int64)
+    return [0] * size
+
+
+def _format_report(report):
+    lines = ['%d keys, %d bytes' % (report['keys'], report['bytes']),
+             'key skew %.3f, byte skew %.3f' % (report['key_skew'],
+                                               report['byte_skew'])]
+    for node_name, node in sorted(report['nodes'].iteritems()):
+        lines.append('  %-20s %12d keys %6.2f%% %14d bytes %6.2f%%' % (
+            node_name, node['keys'], node['key_share'] * 100,
+            node['bytes'], node['byte_share'] * 100))
+    lines.append('%d keys with hash tags, top tags hold %.2f%% of keys' % (
+        report['tagged_keys'], report['hot_tag_share'] * 100))
+    for tag, count in report['hot_tags']:
+        lines.append('  %-20s %12d keys' % (tag, count))
+    if 'moves' in report:
+        lines.append('%d keys (%.2f%%) move, new key skew %.3f' % (
+            report['moved_keys'], report['moved_fraction'] * 100,
+            report['new_key_skew']))
+        for (old_name, new_name), count in sorted(
+                report['moves'].iteritems()):
+            lines.append('  %-20s -> %-20s %12d keys' % (old_name, new_name,
+                                                          count))
+    return '\n'.join(lines)
+
+
+def _node_names(parser, nodes):
+    """
+        The node names in a comma separated list of names or named config
+        entries, in the order MultiNodeManager gives its router.
+    """
+    node_names = []
+    for entry in nodes.split(','):
+        if ':' in entry:
+            entry = MultiNodeManager._parse_entry(entry)[0]
+            if entry is None:
+                parser.error("config entries need a node name, e.g. "
+                             "node1|127.0.0.1:6379.")
+        node_names.append(entry)
+    return node_order(node_names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Report how keys spread over nodes.')
+    parser.add_argument('key_file')
+    parser.add_argument('--nodes', required=True,
+                        help='comma separated node names or named master '
+                             'config entries')
+    parser.add_argument('--router', choices=sorted(ROUTERS),
+                        default='modulo')
+    parser.add_argument('--new-nodes')
+    parser.add_argument('--new-router', choices=sorted(ROUTERS))
+    parser.add_argument('--top-tags', type=int, default=10)
+    args = parser.parse_args(argv)
+    router = ROUTERS[args.router](_node_names(parser, args.nodes))
+    new_router = None
+    if args.new_nodes or args.new_router:
+        new_router = ROUTERS[args.new_router or args.router](
+            _node_names(parser, args.new_nodes or args.nodes))
+    analyzer = MultiNodeBalanceAnalyzer(router, new_router=new_router,
+                                        top_tags=args.top_tags)
+    analyzer.add_file(args.key_file)
+    print _format_report(analyzer.report())
+
+
+if __name__ == '__main__':
+    main()
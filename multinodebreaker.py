@@ -0,0 +1,126 @@
+import threading
+import time
+import redis
+from multinodeexceptions import (MultiNodeCircuitOpenException,
+                                 MultiNodeTimeoutException)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _NodeCircuit(object):
+    def __init__(self, node_name, address):
+        self.node_name = node_name
+        self.address = address
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probes = 0
+        self.rejected = 0
+
+
+class MultiNodeCircuitBreaker(object):
+    def __init__(self, failure_threshold=5, reset_timeout=10,
+                 half_open_probes=1):
+        """
+            Per-node circuit breakers.  Pass one to
+            MultiNodeRedis(circuit_breaker=...) and every command and
+            pipeline sent to a node goes through that node's circuit.  After
+            failure_threshold consecutive connection errors or timeouts the
+            circuit opens and calls fail at once with
+            MultiNodeCircuitOpenException (a redis.ConnectionError) instead of
+            waiting on the node.  After reset_timeout seconds the circuit is
+            half open: up to half_open_probes calls go through, and the first
+            to succeed closes it again while a failure reopens it.
+            Args:
+                failure_threshold - consecutive failures that open a circuit.
+                reset_timeout - seconds a circuit stays open before probing.
+                half_open_probes - calls let through at once while probing.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        # node -> _NodeCircuit
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def attach(self, node, node_name):
+        """
+            Route node.execute_command through node's circuit.
+        """
+        kwargs = node.connection_pool.connection_kwargs
+        self._circuits[node] = _NodeCircuit(
+            node_name, '%s:%s' % (kwargs.get('host'), kwargs.get('port')))
+        node.execute_command = self.guard(node, node.execute_command)
+
+    def guard(self, node, call):
+        """
+            Wrap call, e.g. a sub-pipeline's execute, with node's circuit.
+        """
+        def guarded(*args, **kwargs):
+            self.before_call(node)
+            try:
+                result = call(*args, **kwargs)
+            except (redis.ConnectionError, redis.TimeoutError,
+                    MultiNodeTimeoutException):
+                self.record_failure(node)
+                raise
+            except Exception:
+                # e.g. a ResponseError: the node answered
+                self.record_success(node)
+                raise
+            self.record_success(node)
+            return result
+        return guarded
+
+    def state(self, node):
+        return self._circuits[node].state
+
+    def before_call(self, node):
+        circuit = self._circuits[node]
+        if circuit.state == CLOSED:
+            return
+        with self._lock:
+            if circuit.state == OPEN:
+                if time.time() - circuit.opened_at < self.reset_timeout:
+                    circuit.rejected += 1
+                    raise MultiNodeCircuitOpenException("circuit for " +
+                        "node %s is open." % circuit.address)
+                circuit.state = HALF_OPEN
+                circuit.probes = 0
+            if circuit.state == HALF_OPEN:
+                if circuit.probes >= self.half_open_probes:
+                    circuit.rejected += 1
+                    raise MultiNodeCircuitOpenException("circuit for " +
+                        "node %s is half open." % circuit.address)
+                circuit.probes += 1
+
+    def record_success(self, node):
+        circuit = self._circuits[node]
+        if circuit.state == CLOSED and not circuit.failures:
+            return
+        with self._lock:
+            circuit.failures = 0
+            circuit.state = CLOSED
+
+    def record_failure(self, node):
+        circuit = self._circuits[node]
+        with self._lock:
+            circuit.failures += 1
+            if (circuit.state == HALF_OPEN or
+                    circuit.failures >= self.failure_threshold):
+                circuit.state = OPEN
+                circuit.opened_at = time.time()
+
+    def stats(self):
+        """
+            Circuit state per node address, as masters and replicas share a
+            node name.
+        """
+        with self._lock:
+            return dict((circuit.address, {'node_name': circuit.node_name,
+                                           'state': circuit.state,
+                                           'failures': circuit.failures,
+                                           'rejected': circuit.rejected})
+                        for circuit in self._circuits.itervalues())
@@ -0,0 +1,244 @@
+import threading
+import time
+from collections import OrderedDict
+import redis
+from redis._compat import nativestr
+
+INVALIDATE_CHANNEL = '__redis__:invalidate'
+
+
+def _sizeof(value):
+    """
+        Rough size in bytes of a cached reply: the length of the strings it
+        holds.  Good enough to bound memory without walking object headers.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, dict):
+        return sum(_sizeof(k) + _sizeof(v) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(item) for item in value)
+    if isinstance(value, basestring):
+        return len(value)
+    return 8
+
+
+class MultiNodeNearCache(object):
+    def __init__(self, max_entries=10000, max_bytes=None, ttl=None):
+        """
+            In-process cache for read replies, kept in LRU order and bounded
+            both by entry count and by (approximate) bytes.  Entries are keyed
+            by the command and its arguments, and indexed by redis key so that
+            a write to a key drops every cached reply for it.
+            Args:
+                max_entries - most replies to keep.
+                max_bytes - most bytes of reply data to keep, or None.
+                ttl - seconds an entry stays valid, or None for no expiry.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes = 0
+        # (command, key, args) -> (value, expires_at, size)
+        self._entries = OrderedDict()
+        # key -> set of entry ids for that key
+        self._keys = {}
+        # bumped on every invalidation, see token()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def token(self):
+        """
+            Take before reading from redis and pass to set().  If the key was
+            written in between, set() drops the (possibly stale) reply.
+        """
+        return self._generation
+
+    def get(self, command, key, *args):
+        """
+            Returns (found, value).  A cached None is a hit, so missing keys
+            are cached too.
+        """
+        entry_id = (command, key, args)
+        with self._lock:
+            entry = self._entries.pop(entry_id, None)
+            if entry is not None:
+                value, expires_at, size = entry
+                if expires_at is None or expires_at > time.time():
+                    self._entries[entry_id] = entry
+                    self.hits += 1
+                    return True, value
+                self._remove(entry_id, entry)
+            self.misses += 1
+            return False, None
+
+    def set(self, token, value, command, key, *args):
+        size = _sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        entry_id = (command, key, args)
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            if token != self._generation:
+                return
+            old = self._entries.pop(entry_id, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[entry_id] = (value, expires_at, size)
+            self._keys.setdefault(key, set()).add(entry_id)
+            self.bytes += size
+            while (len(self._entries) > self.max_entries or
+                   (self.max_bytes is not None and
+                    self.bytes > self.max_bytes)):
+                oldest_id, oldest = self._entries.popitem(last=False)
+                self._unindex(oldest_id)
+                self.bytes -= oldest[2]
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            for entry_id in self._keys.pop(key, ()):
+                entry = self._entries.pop(entry_id, None)
+                if entry is not None:
+                    self.bytes -= entry[2]
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self.bytes}
+
+    def _remove(self, entry_id, entry):
+        self._unindex(entry_id)
+        self.bytes -= entry[2]
+
+    def _unindex(self, entry_id):
+        key = entry_id[1]
+        entry_ids = self._keys.get(key)
+        if entry_ids is not None:
+            entry_ids.discard(entry_id)
+            if not entry_ids:
+                del self._keys[key]
+
+
+class MultiNodeTrackingListener(object):
+    def __init__(self, node, near_cache):
+        """
+            Server-assisted invalidation (CLIENT TRACKING, redis >= 6) for one
+            node.  A dedicated connection subscribes to the invalidation
+            channel, and every connection in the node's pool turns tracking on
+            with REDIRECT to it, so redis tells us when a key we read changes
+            no matter which client wrote it.
+        """
+        self.node = node
+        self.near_cache = near_cache
+        self.client_id = None
+        self._connection = None
+        self._ready = threading.Event()
+        self._stopped = False
+        kwargs = node.connection_pool.connection_kwargs
+        self._connection_kwargs = dict((name, kwargs[name])
+                                       for name in ('host', 'port', 'password',
+                                                    'socket_connect_timeout')
+                                       if name in kwargs)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._subscribe()
+        # Switch the node over to connections that redirect to us.  Any
+        # connection opened before this point isn't tracked, so drop them.
+        old_pool = self.node.connection_pool
+        kwargs = dict(old_pool.connection_kwargs,
+                      **getattr(old_pool, 'pool_kwargs', {}))
+        self.node.connection_pool = old_pool.__class__(
+            connection_class=MultiNodeTrackingConnection,
+            tracking_listener=self,
+            max_connections=old_pool.max_connections,
+            **kwargs)
+        old_pool.disconnect()
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._connection is not None:
+            self._connection.disconnect()
+
+    def wait_client_id(self, timeout=5):
+        if not self._ready.wait(timeout):
+            raise redis.ConnectionError("invalidation listener for " +
+                "%r is not connected." % self.node)
+        return self.client_id
+
+    def _subscribe(self):
+        self._ready.clear()
+        connection = redis.Connection(decode_responses=True,
+                                      **self._connection_kwargs)
+        connection.send_command('CLIENT', 'ID')
+        self.client_id = connection.read_response()
+        connection.send_command('SUBSCRIBE', INVALIDATE_CHANNEL)
+        connection.read_response()
+        self._connection = connection
+        self._ready.set()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                response = self._connection.read_response()
+            except redis.RedisError:
+                if self._stopped:
+                    return
+                self._reconnect()
+                continue
+            if response[0] != 'message':
+                continue
+            keys = response[2]
+            if keys is None:
+                # FLUSHALL/FLUSHDB
+                self.near_cache.clear()
+            else:
+                for key in keys:
+                    self.near_cache.invalidate(key)
+
+    def _reconnect(self):
+        # Tracked connections still redirect to the old client id, so every
+        # invalidation from here on would be lost.  Start over.
+        self.near_cache.clear()
+        while not self._stopped:
+            try:
+                self._subscribe()
+                break
+            except redis.RedisError:
+                time.sleep(1)
+        self.node.connection_pool.disconnect()
+
+
+class MultiNodeTrackingConnection(redis.Connection):
+    def __init__(self, tracking_listener=None, **kwargs):
+        super(MultiNodeTrackingConnection, self).__init__(**kwargs)
+        self.tracking_listener = tracking_listener
+
+    def on_connect(self):
+        super(MultiNodeTrackingConnection, self).on_connect()
+        client_id = self.tracking_listener.wait_client_id()
+        self.send_command('CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id)
+        if nativestr(self.read_response()) != 'OK':
+            raise redis.ConnectionError('CLIENT TRACKING failed')
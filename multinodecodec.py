@@ -0,0 +1,134 @@
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Encoded values start with MAGIC, then a format byte and a compression
+# byte.  Anything else is a legacy (or small, plain string) value and is
+# returned as stored.
+MAGIC = b'\x00\xc3'
+HEADER_SIZE = len(MAGIC) + 2
+
+STRING = b's'
+JSON = b'j'
+MSGPACK = b'm'
+
+NONE = b'n'
+ZLIB = b'z'
+
+
+class MultiNodeCodec(object):
+    def __init__(self, compress_threshold=1024, compress_level=1,
+                 serializer='json', encoding='utf-8'):
+        """
+            Value codec applied by MultiNodeRedis and MultiNodePipeline on
+            writes (set, mset, hset, hmset, zadd and zincrby members) and
+            reversed on reads (get, mget, hget, hgetall, zrange).  Strings
+            under compress_threshold bytes are stored unchanged, so older
+            clients can still read them; bigger ones are zlib compressed
+            when that makes them smaller.  Other values (dicts, lists, ...)
+            are serialized.  Numbers pass through, so incr still works.
+            Args:
+                compress_threshold - smallest encoded value, in bytes, that
+                                     is compressed.  None never compresses.
+                compress_level - zlib level, 1 is fastest.
+                serializer - 'json', or 'msgpack' (needs msgpack installed)
+                             for a more compact binary form.
+                encoding - for text values, and for decoding replies.
+        """
+        if serializer == 'msgpack' and msgpack is None:
+            raise ImportError("serializer='msgpack' needs msgpack " +
+                              "installed.")
+        if serializer not in ('json', 'msgpack'):
+            raise ValueError("unknown serializer %r." % serializer)
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.serializer = serializer
+        self.encoding = encoding
+
+    def encode(self, value):
+        if isinstance(value, bytes):
+            kind, payload = STRING, value
+        elif isinstance(value, unicode):
+            kind, payload = STRING, value.encode(self.encoding)
+        elif isinstance(value, (int, long, float)):
+            return value
+        elif self.serializer == 'msgpack':
+            kind, payload = MSGPACK, msgpack.packb(value, use_bin_type=True)
+        else:
+            kind, payload = JSON, json.dumps(value, separators=(',', ':'))
+        threshold = self.compress_threshold
+        if threshold is not None and len(payload) >= threshold:
+            compressed = zlib.compress(payload, self.compress_level)
+            if len(compressed) + HEADER_SIZE < len(payload):
+                return MAGIC + kind + ZLIB + compressed
+        if kind == STRING and not payload.startswith(MAGIC):
+            return payload
+        return MAGIC + kind + NONE + payload
+
+    def decode(self, value):
+        if value is None or not value.startswith(MAGIC):
+            return self.decode_text(value)
+        kind = value[2:3]
+        payload = value[HEADER_SIZE:]
+        if value[3:4] == ZLIB:
+            payload = zlib.decompress(payload)
+        if kind == STRING:
+            return self.decode_text(payload)
+        if kind == JSON:
+            return json.loads(payload)
+        if kind == MSGPACK:
+            if msgpack is None:
+                raise ImportError("value was encoded with msgpack, which " +
+                                  "is not installed.")
+            return msgpack.unpackb(payload, raw=False)
+        raise ValueError("unknown value format %r." % kind)
+
+    def decode_text(self, value):
+        """
+            Text for value, like decode_responses=True gives, or the raw
+            bytes if they aren't valid text.
+        """
+        if not isinstance(value, bytes):
+            return value
+        try:
+            return value.decode(self.encoding)
+        except UnicodeDecodeError:
+            return value
+
+    def decode_values(self, values):
+        return [self.decode(value) for value in values]
+
+    def decode_mapping(self, mapping):
+        decode_text = self.decode_text
+        decode = self.decode
+        return dict((decode_text(field), decode(value))
+                    for field, value in mapping.iteritems())
+
+    def decode_members(self, members):
+        """
+            Decode a zrange reply, with or without scores.
+        """
+        decode = self.decode
+        return [(decode(member[0]), member[1])
+                if isinstance(member, tuple) else decode(member)
+                for member in members]
+
+    def encode_mapping(self, mapping):
+        encode = self.encode
+        return dict((field, encode(value))
+                    for field, value in mapping.iteritems())
+
+    def encode_zadd(self, args, kwargs):
+        """
+            Encode the members of zadd's score1, name1, score2, name2, ...
+            args and name1=score1, ... kwargs.
+        """
+        encode = self.encode
+        args = [encode(arg) if i % 2 else arg for i, arg in enumerate(args)]
+        kwargs = dict((encode(name), score)
+                      for name, score in kwargs.iteritems())
+        return args, kwargs
@@ -1,6 +1,15 @@
+import redis
+
+
 class MultiNodePipelineException(Exception):
     pass
 
 class MultiNodeRedisException(Exception):
     pass
 
+class MultiNodeTimeoutException(MultiNodeRedisException):
+    pass
+
+class MultiNodeCircuitOpenException(MultiNodeRedisException,
+                                    redis.ConnectionError):
+    pass
@@ -0,0 +1,278 @@
+import atexit
+import functools
+import heapq
+import itertools
+import os
+import threading
+import time
+from multinodeexceptions import MultiNodeTimeoutException
+
+# The asyncio client imports this module on Python 3.
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+def _run_indexed(index, call):
+    try:
+        return index, True, call()
+    except Exception as e:
+        return index, False, e
+
+
+class _Task(object):
+    """
+        A call queued on the pool.  Its flags are only changed under the
+        executor's lock.
+    """
+    __slots__ = ('call', 'callback', 'started', 'finished', 'abandoned')
+
+    def __init__(self, call, callback):
+        self.call = call
+        self.callback = callback
+        self.started = False
+        self.finished = False
+        self.abandoned = False
+
+
+class _Deadlines(object):
+    def __init__(self):
+        """
+            One long-lived thread putting None on a queue once its deadline
+            passes.  Waiting on the queue untimed then needs neither a timed
+            wait, which polls on Python 2, nor a timer thread per fan-out.
+        """
+        self._heap = []
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._pid = None
+        self._thread = None
+        self._stopped = False
+
+    def add(self, timeout, queue):
+        """
+            Put None on queue in timeout seconds, unless cancelled.
+        """
+        entry = [time.time() + timeout, next(self._sequence), queue]
+        with self._condition:
+            if self._pid != os.getpid():
+                # threads don't survive a fork
+                self._heap = []
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = os.getpid()
+                # a daemon thread still waiting while Python 2 tears its
+                # modules down prints errors, so stop it first
+                atexit.register(self.stop)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        # left in the heap until due, but no longer holds on to the queue
+        entry[2] = None
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(1)
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    queue = heapq.heappop(self._heap)[2]
+                    if queue is not None:
+                        queue.put(None)
+                if self._heap:
+                    self._condition.wait(self._heap[0][0] - now)
+                else:
+                    self._condition.wait()
+
+
+# shared by every executor, so a process has one deadline thread
+_deadlines = _Deadlines()
+
+
+class MultiNodeExecutor(object):
+    def __init__(self, max_workers=None, timeout=None):
+        """
+            Run per-node calls concurrently on a shared pool of worker
+            threads.  The workers are started on first use, and again after
+            a fork since threads do not survive into the child process.  A
+            call abandoned at its timeout keeps its worker busy until it
+            returns, so a replacement worker is started for it and the pool
+            shrinks back once it does; one hung node can't starve the rest.
+            Args:
+                max_workers - workers free to take new calls, defaults to 8.
+                timeout - seconds to wait on each node, measured from when the
+                          calls were dispatched.  None waits forever.
+        """
+        self.max_workers = max_workers or 8
+        self.timeout = timeout
+        self._tasks = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_tasks(self):
+        if self._tasks is None or self._pid != os.getpid():
+            with self._lock:
+                if self._tasks is None or self._pid != os.getpid():
+                    self._tasks = Queue.Queue()
+                    for _ in xrange(self.max_workers):
+                        self._start_worker(self._tasks)
+                    self._pid = os.getpid()
+        return self._tasks
+
+    def _start_worker(self, tasks):
+        thread = threading.Thread(target=self._work, args=(tasks,))
+        thread.daemon = True
+        thread.start()
+
+    def _work(self, tasks):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            with self._lock:
+                if task.abandoned:
+                    # timed out before it started, nobody wants the result
+                    continue
+                task.started = True
+            task.callback(task.call())
+            with self._lock:
+                if task.abandoned:
+                    # a replacement took over this worker's place
+                    return
+                task.finished = True
+
+    def _submit(self, call, callback):
+        task = _Task(call, callback)
+        self._get_tasks().put(task)
+        return task
+
+    def abandon(self, tasks):
+        """
+            Give up on calls that timed out, as returned by submit().  Those
+            not started yet are skipped, and each one still running gets a
+            replacement worker.
+        """
+        with self._lock:
+            for task in tasks:
+                if task.finished or task.abandoned:
+                    continue
+                task.abandoned = True
+                if task.started:
+                    self._start_worker(self._tasks)
+
+    def run(self, calls, timeout=None, return_exceptions=False):
+        """
+            Run each zero-argument callable in calls concurrently and return
+            their results in the same order.  Without a timeout the first
+            call runs on the calling thread.  If any call raises, the first
+            exception (in call order) is re-raised once every call has
+            finished or timed out.  With return_exceptions, exceptions are
+            returned in place of results instead, and calls still running at
+            the timeout get a MultiNodeTimeoutException.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not calls or (len(calls) == 1 and timeout is None):
+            if not return_exceptions:
+                return [call() for call in calls]
+            return [_run_indexed(0, call)[2] for call in calls]
+        outcomes = Queue.Queue()
+        # Without a timeout to enforce, the calling thread takes the first
+        # call itself rather than sit idle while a worker does, saving a
+        # thread handoff per fan-out.  With one, every call goes to the
+        # pool since a call on this thread couldn't be abandoned.
+        inline = timeout is None
+        tasks = [self._submit(functools.partial(_run_indexed, index, call),
+                              outcomes.put)
+                 for index, call in enumerate(calls) if index or not inline]
+        if inline:
+            outcomes.put(_run_indexed(0, calls[0]))
+        # Timed waits poll on Python 2, which adds milliseconds to every
+        # fan-out, so wait untimed and have the deadline thread wake us.
+        deadline = None
+        if timeout is not None:
+            deadline = _deadlines.add(timeout, outcomes)
+        results = [None] * len(calls)
+        errors = {}
+        pending = set(xrange(len(calls)))
+        try:
+            while pending:
+                outcome = outcomes.get()
+                if outcome is None:
+                    self.abandon([tasks[index] for index in pending])
+                    error = MultiNodeTimeoutException("node did not " +
+                        "respond within %ss." % timeout)
+                    if not return_exceptions:
+                        raise error
+                    for index in pending:
+                        errors[index] = error
+                    break
+                index, succeeded, value = outcome
+                pending.discard(index)
+                if succeeded:
+                    results[index] = value
+                else:
+                    errors[index] = value
+        finally:
+            if deadline is not None:
+                _deadlines.cancel(deadline)
+        if return_exceptions:
+            for index, error in errors.items():
+                results[index] = error
+        elif errors:
+            raise errors[min(errors)]
+        return results
+
+    def submit(self, call, results):
+        """
+            Run call on the pool without waiting for it.  Its outcome is put
+            on the results queue, to be read back with next_result().
+            Returns a handle to pass to abandon() if it times out.
+        """
+        def run():
+            try:
+                return True, call()
+            except Exception as e:
+                return False, e
+        return self._submit(run, results.put)
+
+    def next_result(self, results, timeout=None):
+        """
+            Wait for the next call submitted to results to finish, in
+            completion order.  Re-raises the call's exception if it failed.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            if timeout is None:
+                succeeded, value = results.get()
+            else:
+                succeeded, value = results.get(timeout=timeout)
+        except Queue.Empty:
+            raise MultiNodeTimeoutException("node did not respond within " +
+                "%ss." % timeout)
+        if not succeeded:
+            raise value
+        return value
+
+    def close(self):
+        if self._tasks is not None and self._pid == os.getpid():
+            for _ in xrange(self.max_workers):
+                self._tasks.put(None)
+        self._tasks = None
@@ -0,0 +1,253 @@
+import threading
+import time
+
+# Each power of two is split into 2 ** SUB_BUCKET_BITS linear sub-buckets,
+# which keeps every bucket within 12.5% of the values it holds.
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Values are clamped into the last bucket: 2 ** 40 microseconds is ~12 days.
+MAX_EXPONENT = 40
+BUCKET_COUNT = (MAX_EXPONENT - SUB_BUCKET_BITS + 2) * SUB_BUCKETS
+
+
+def _bucket_index(value):
+    if value < SUB_BUCKETS:
+        return max(0, value)
+    exponent = min(value.bit_length() - 1, MAX_EXPONENT)
+    sub_bucket = (value >> (exponent - SUB_BUCKET_BITS)) & (SUB_BUCKETS - 1)
+    return (exponent - SUB_BUCKET_BITS + 1) * SUB_BUCKETS + sub_bucket
+
+
+def _bucket_upper_bound(index):
+    if index < SUB_BUCKETS:
+        return index
+    exponent = index // SUB_BUCKETS + SUB_BUCKET_BITS - 1
+    sub_bucket = index % SUB_BUCKETS
+    width = 1 << (exponent - SUB_BUCKET_BITS)
+    return (1 << exponent) + (sub_bucket + 1) * width - 1
+
+
+class MultiNodeHistogram(object):
+    def __init__(self):
+        """
+            HDR-style histogram of non-negative integers in a fixed number of
+            log-linear buckets, so recording is O(1) and memory is constant.
+            Percentiles are reported as the upper bound of their bucket.
+        """
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        value = int(value)
+        self.buckets[_bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        target = self.count * percent / 100.0
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if bucket and seen >= target:
+                return min(_bucket_upper_bound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean': self.total / float(self.count) if self.count else 0,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'p999': self.percentile(99.9),
+                'max': self.max}
+
+
+class MultiNodeCommandStats(object):
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        # microseconds
+        self.latency = MultiNodeHistogram()
+
+    def snapshot(self):
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'bytes': self.bytes,
+                'latency_us': self.latency.snapshot()}
+
+
+def _size(value):
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_size(k) + _size(v) for k, v in value.iteritems())
+    return 0
+
+
+class MultiNodeInstrumentation(object):
+    def __init__(self, hooks=None):
+        """
+            Per-node and per-command counters and latency histograms.  Pass
+            one to MultiNodeRedis(instrumentation=...) and the manager wraps
+            each node's execute_command, its own routing and every
+            sub-pipeline's execute.  Nothing is wrapped when
+            instrumentation is off.
+            Args:
+                hooks - callables invoked after every recorded event with
+                        (event, node_name, command, elapsed, size, error),
+                        where event is 'command' or 'pipeline' and size is
+                        bytes for a command or command count for a pipeline.
+        """
+        self.hooks = list(hooks or [])
+        # (node_name, command) -> MultiNodeCommandStats
+        self.commands = {}
+        # node_name -> MultiNodeCommandStats for pipeline executes
+        self.pipelines = {}
+        # node_name -> MultiNodeHistogram of commands per pipeline
+        self.pipeline_sizes = {}
+        # node_name -> MultiNodeHistogram of bytes sent and received per
+        # pipeline
+        self.pipeline_bytes = {}
+        # node_name -> number of keys routed there
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record_command(self, node_name, command, elapsed, size, error=None):
+        with self._lock:
+            stats = self.commands.get((node_name, command))
+            if stats is None:
+                stats = self.commands[(node_name, command)] = \
+                    MultiNodeCommandStats()
+            stats.calls += 1
+            stats.bytes += size
+            if error is not None:
+                stats.errors += 1
+            stats.latency.record(elapsed * 1000000)
+        for hook in self.hooks:
+            hook('command', node_name, command, elapsed, size, error)
+
+    def record_pipeline(self, node_name, commands, elapsed, size=0,
+                        error=None):
+        with self._lock:
+            stats = self.pipelines.get(node_name)
+            if stats is None:
+                stats = self.pipelines[node_name] = MultiNodeCommandStats()
+                self.pipeline_sizes[node_name] = MultiNodeHistogram()
+                self.pipeline_bytes[node_name] = MultiNodeHistogram()
+            stats.calls += 1
+            stats.bytes += size
+            if error is not None:
+                stats.errors += 1
+            stats.latency.record(elapsed * 1000000)
+            self.pipeline_sizes[node_name].record(commands)
+            self.pipeline_bytes[node_name].record(size)
+        for hook in self.hooks:
+            hook('pipeline', node_name, None, elapsed, commands, error)
+
+    def record_route(self, node_name, keys=1):
+        with self._lock:
+            self.routes[node_name] = self.routes.get(node_name, 0) + keys
+
+    def stats(self):
+        """
+            Snapshot of everything recorded so far, as plain dicts.
+        """
+        with self._lock:
+            nodes = {}
+            for (node_name, command), stats in self.commands.iteritems():
+                node = nodes.setdefault(node_name, {'commands': {}})
+                node['commands'][command] = stats.snapshot()
+            for node_name, stats in self.pipelines.iteritems():
+                node = nodes.setdefault(node_name, {'commands': {}})
+                node['pipelines'] = stats.snapshot()
+                node['pipeline_sizes'] = \
+                    self.pipeline_sizes[node_name].snapshot()
+                node['pipeline_bytes'] = \
+                    self.pipeline_bytes[node_name].snapshot()
+            for node_name, routes in self.routes.iteritems():
+                nodes.setdefault(node_name, {'commands': {}})['routes'] = \
+                    routes
+            return nodes
+
+    def instrument_node(self, node, node_name):
+        """
+            Wrap node.execute_command so every command sent through it is
+            recorded under node_name.
+        """
+        execute_command = node.execute_command
+
+        def instrumented_execute_command(*args, **options):
+            start = time.time()
+            try:
+                result = execute_command(*args, **options)
+            except Exception as e:
+                self.record_command(node_name, args[0], time.time() - start,
+                                    _size(args), error=e)
+                raise
+            self.record_command(node_name, args[0], time.time() - start,
+                                _size(args) + _size(result))
+            return result
+        node.execute_command = instrumented_execute_command
+
+    def instrument_manager(self, manager):
+        """
+            Wrap the manager's routing to count keys routed to each node:
+            _get_node and _get_read_node for single keys, and
+            _group_by_node for batches (route_many, multi-key commands,
+            scripts, the bulk loader).
+        """
+        get_node = manager._get_node
+        get_read_node = manager._get_read_node
+        group_by_node = manager._group_by_node
+
+        def instrumented_get_node(key, use_slave=False):
+            node = get_node(key, use_slave=use_slave)
+            self.record_route(manager._node_names_by_node[node])
+            return node
+
+        def instrumented_get_read_node(key):
+            node = get_read_node(key)
+            self.record_route(manager._node_names_by_node[node])
+            return node
+
+        def instrumented_group_by_node(keys):
+            groups = group_by_node(keys)
+            for node, positions in groups:
+                self.record_route(manager._node_names_by_node[node],
+                                  len(positions))
+            return groups
+        manager._get_node = instrumented_get_node
+        manager._get_read_node = instrumented_get_read_node
+        manager._group_by_node = instrumented_group_by_node
+
+    def timed_pipeline(self, node_name, command_stack, execute):
+        """
+            Wrap a sub-pipeline's execute so it is recorded when it runs,
+            with the bytes of command_stack's arguments and of the replies.
+        """
+        def instrumented_execute():
+            commands = len(command_stack)
+            size = sum(_size(args) for args, _ in command_stack)
+            start = time.time()
+            try:
+                result = execute()
+            except Exception as e:
+                self.record_pipeline(node_name, commands, time.time() - start,
+                                     size, error=e)
+                raise
+            self.record_pipeline(node_name, commands, time.time() - start,
+                                 size + _size(result))
+            return result
+        return instrumented_execute
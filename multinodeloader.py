@@ -0,0 +1,279 @@
+import csv
+import itertools
+import json
+import threading
+import time
+import Queue
+
+# Sent to a node's workers once every batch has been queued.
+_DONE = object()
+
+
+def read_jsonl(path, key='key', value='value', ttl='ttl'):
+    """
+        Yield (key, value, ttl) records from a file of JSON objects, one per
+        line.  ttl is None when the object has no ttl field.
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield record[key], record[value], record.get(ttl)
+
+
+def read_csv(path, key='key', value='value', ttl='ttl'):
+    """
+        Yield (key, value, ttl) records from a CSV file with a header row.
+    """
+    with open(path, 'rb') as f:
+        for record in csv.DictReader(f):
+            record_ttl = record.get(ttl)
+            yield (record[key], record[value],
+                   int(record_ttl) if record_ttl else None)
+
+
+class _NodeStats(object):
+    def __init__(self):
+        self.records = 0
+        self.batches = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+
+class MultiNodeBulkLoader(object):
+    def __init__(self, manager, batch_size=1000, queue_batches=4,
+                 workers_per_node=1, retry_policy=None, raise_on_error=True,
+                 progress=None, progress_interval=5):
+        """
+            Stream records into the nodes.  The calling thread reads the
+            records and routes them a batch at a time; every node has its
+            own worker threads sending its batches as pipelines, and a
+            bounded queue between the two.  A slow node fills its queue and
+            blocks reading until it catches up, so memory is bounded by about
+            nodes * (queue_batches + workers_per_node + 1) * batch_size
+            records, however big the input.  Get one from
+            MultiNodeRedis.bulk_loader().
+            Args:
+                batch_size - records per pipeline.
+                queue_batches - batches queued per node before reading
+                                blocks.
+                workers_per_node - pipelines in flight per node.  With
+                                   more than one, a node's batches may
+                                   land out of order, so a key repeated
+                                   in a later batch may be left with an
+                                   earlier value.
+                retry_policy - optional MultiNodeRetryPolicy for resending
+                               batches whose node failed, see
+                               multinoderetry.
+                raise_on_error - stop at the first failed write and raise
+                                 it.  If False, failures are counted in the
+                                 stats.
+                progress - optional callable, passed stats() every
+                           progress_interval seconds while loading.
+        """
+        self.manager = manager
+        self.batch_size = batch_size
+        self.queue_batches = queue_batches
+        self.workers_per_node = workers_per_node
+        self.retry_policy = retry_policy
+        self.raise_on_error = raise_on_error
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self._nodes = {}
+        self._error = None
+        self._start = None
+        self._end = None
+        self._lock = threading.Lock()
+
+    def load(self, records):
+        """
+            Write records, (key, value) or (key, value, ttl) tuples, and
+            return stats().  A dict value is written with HMSET, anything
+            else with SET, both through the manager's codec if it has one.
+            ttl is in seconds.
+        """
+        manager = self.manager
+        queues = {}
+        threads = []
+        self._nodes = {}
+        self._error = None
+        self._start = time.time()
+        self._end = None
+        next_progress = self._start + self.progress_interval
+        records = iter(records)
+        try:
+            while self._error is None or not self.raise_on_error:
+                chunk = list(itertools.islice(records, self.batch_size))
+                if not chunk:
+                    break
+                groups = manager._group_by_node([record[0]
+                                                 for record in chunk])
+                for node, positions in groups:
+                    if node not in queues:
+                        queues[node] = self._start_workers(node, threads)
+                    queue, buffer = queues[node]
+                    buffer.extend(chunk[position] for position in positions)
+                    if len(buffer) >= self.batch_size:
+                        queue.put(buffer[:self.batch_size])
+                        del buffer[:self.batch_size]
+                if self.progress is not None and time.time() >= next_progress:
+                    next_progress = time.time() + self.progress_interval
+                    self.progress(self.stats())
+            for queue, buffer in queues.itervalues():
+                if buffer:
+                    queue.put(buffer)
+        finally:
+            for queue, buffer in queues.itervalues():
+                for _ in xrange(self.workers_per_node):
+                    queue.put(_DONE)
+            for thread in threads:
+                thread.join()
+            self._end = time.time()
+        if self._error is not None and self.raise_on_error:
+            raise self._error
+        return self.stats()
+
+    def load_jsonl(self, path, **fields):
+        return self.load(read_jsonl(path, **fields))
+
+    def load_csv(self, path, **fields):
+        return self.load(read_csv(path, **fields))
+
+    def stats(self):
+        """
+            Records written, batches, failed writes, seconds elapsed and
+            records per second, in total and per node.  Per node seconds are
+            time spent sending.
+        """
+        end = self._end or time.time()
+        elapsed = end - self._start if self._start is not None else 0.0
+        nodes = {}
+        with self._lock:
+            for node, stats in self._nodes.iteritems():
+                nodes[self.manager._node_names_by_node[node]] = {
+                    'records': stats.records,
+                    'batches': stats.batches,
+                    'errors': stats.errors,
+                    'seconds': stats.seconds}
+        records = sum(stats['records'] for stats in nodes.itervalues())
+        return {'records': records,
+                'batches': sum(stats['batches']
+                               for stats in nodes.itervalues()),
+                'errors': sum(stats['errors']
+                              for stats in nodes.itervalues()),
+                'seconds': elapsed,
+                'records_per_second': records / elapsed if elapsed else 0.0,
+                'nodes': nodes}
+
+    ## Start private functions
+
+    def _start_workers(self, node, threads):
+        queue = Queue.Queue(maxsize=self.queue_batches)
+        with self._lock:
+            self._nodes.setdefault(node, _NodeStats())
+        for _ in xrange(self.workers_per_node):
+            thread = threading.Thread(target=self._work, args=(node, queue))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return queue, []
+
+    def _work(self, node, queue):
+        while True:
+            batch = queue.get()
+            if batch is _DONE:
+                return
+            if self._error is not None and self.raise_on_error:
+                # keep draining so the reader never blocks on a full queue
+                continue
+            start = time.time()
+            try:
+                errors = self._write(node, batch)
+            except Exception as e:
+                # e.g. a value the codec can't encode; the worker has to
+                # live on to drain its queue
+                errors = [e] * len(batch)
+            elapsed = time.time() - start
+            with self._lock:
+                stats = self._nodes[node]
+                stats.records += len(batch) - len(errors)
+                stats.batches += 1
+                stats.errors += len(errors)
+                stats.seconds += elapsed
+                if errors and self._error is None:
+                    self._error = errors[0]
+
+    def _write(self, node, batch):
+        """
+            Send batch to node in one pipeline, plain values without a ttl
+            in a single MSET.  Returns one error per failed record.
+        """
+        pipeline = node.pipeline(transaction=False)
+        codec = self.manager.codec
+        # for each queued command, the positions in batch it writes
+        owners = []
+        plain = {}
+        plain_positions = []
+        for position, record in enumerate(batch):
+            key, value = record[0], record[1]
+            ttl = record[2] if len(record) > 2 else None
+            plain_value = not ttl and not isinstance(value, dict)
+            if not plain_value and key in plain:
+                # keep writes to one key in order
+                pipeline.mset(plain)
+                owners.append(plain_positions)
+                plain = {}
+                plain_positions = []
+            if isinstance(value, dict):
+                if codec is not None:
+                    value = codec.encode_mapping(value)
+                pipeline.hmset(key, value)
+                owners.append([position])
+                if ttl:
+                    pipeline.expire(key, ttl)
+                    owners.append([position])
+                continue
+            if codec is not None:
+                value = codec.encode(value)
+            if ttl:
+                pipeline.set(key, value, ex=ttl)
+                owners.append([position])
+            else:
+                plain[key] = value
+                plain_positions.append(position)
+        if plain:
+            pipeline.mset(plain)
+            owners.append(plain_positions)
+        results = self._execute(node, pipeline)
+        if self.manager.near_cache is not None:
+            for record in batch:
+                self.manager._invalidate(record[0])
+        if isinstance(results, Exception):
+            return [results] * len(batch)
+        failed = {}
+        for positions, result in zip(owners, results):
+            if isinstance(result, Exception):
+                for position in positions:
+                    failed.setdefault(position, result)
+        return failed.values()
+
+    def _execute(self, node, pipeline):
+        """
+            Execute pipeline, resending it as the retry policy allows.
+            Returns the replies, or the error if the node failed as a whole.
+        """
+        command_stack = list(pipeline.command_stack)
+        attempt = 0
+        while True:
+            try:
+                return self.manager._wrap_execute(node, pipeline, False)()
+            except Exception as e:
+                policy = self.retry_policy
+                if (policy is None or
+                        not policy.should_retry(e, attempt, command_stack)):
+                    return e
+                time.sleep(policy.delay(attempt))
+                attempt += 1
+                pipeline = node.pipeline(transaction=False)
+                pipeline.command_stack = list(command_stack)
@@ -1,12 +1,58 @@
-import zlib
-import random
+import functools
+import time
 import redis
-from multinodeexceptions import MultiNodeRedisException
+from multinodeexceptions import (MultiNodeRedisException,
+                                 MultiNodeTimeoutException)
+from multinodeexecutor import MultiNodeExecutor
+from multinodereplica import LeastOutstandingReplicaPolicy
+from multinoderouter import ModuloRouter, node_order
+
+# The asyncio client imports this module on Python 3, so keep it importable
+# there: see also the lazy import of multinodecache in _attach_node.
+try:
+    basestring
+except NameError:
+    basestring = (str, bytes)
+
+try:
+    xrange
+except NameError:
+    xrange = range
 
 NODE_NAME = "node_name"
 
+
+def _arg_bytes(arg):
+    """
+        Approximate bytes arg takes on the wire.
+    """
+    if isinstance(arg, basestring):
+        return len(arg)
+    return len(str(arg))
+
+
+def _open_connections(node, count):
+    pool = node.connection_pool
+    connections = []
+    try:
+        for _ in xrange(count):
+            connection = pool.get_connection('PING')
+            connections.append(connection)
+            connection.connect()
+    finally:
+        for connection in connections:
+            pool.release(connection)
+
+
 class MultiNodeManager(object):
-    def __init__(self, master_servers, slave_servers=None):
+    def __init__(self, master_servers, slave_servers=None, max_workers=None,
+                 timeout=None, router=None, near_cache=None,
+                 client_tracking=False, read_policy=None,
+                 instrumentation=None, max_batch_size=None,
+                 max_batch_bytes=None, auto_pipeline=None,
+                 discovery_timeout=None, warm_up_connections=0,
+                 connection_pool=None, circuit_breaker=None,
+                 replica_fallback=False, codec=None):
         """
             Initialize MultiNodeRedis object.  The master hosts should contain
             the key "node_name".  This key identifies the node, and will be
@@ -15,19 +61,93 @@ class MultiNodeManager(object):
                 master_servers - e.g. [node1|127.0.0.1:6379,
                                        node2|127.0.0.1:6370]
                 slave_servers - same as master_hosts
+                max_workers - number of threads used to talk to nodes
+                              concurrently, defaults to the number of masters.
+                timeout - seconds to wait on any one node during a concurrent
+                          call.  None waits forever.
+                router - callable taking the node names and returning a
+                         router, e.g. KetamaRouter or
+                         functools.partial(KetamaRouter, weights={...}).
+                         Defaults to ModuloRouter.
+                near_cache - optional MultiNodeNearCache for get, hget and
+                             hgetall replies.
+                client_tracking - have each master push invalidations for
+                                  near-cached keys (CLIENT TRACKING, redis
+                                  >= 6), so writes from other clients are
+                                  seen too.
+                read_policy - picks which replica serves a replica read, see
+                              multinodereplica.  Defaults to
+                              LeastOutstandingReplicaPolicy.
+                instrumentation - optional MultiNodeInstrumentation to record
+                                  per-node, per-command stats.
+                max_batch_size - most keys (or pipeline commands) sent to a
+                                 node in one request.  Bigger batches are
+                                 split into a sequence of requests.
+                max_batch_bytes - same, but bounding the approximate size of
+                                  keys and values in bytes.
+                auto_pipeline - optional MultiNodeAutoPipeline that batches
+                                concurrent commands to the same node.
+                discovery_timeout - seconds to wait for nodes listed without
+                                    a name to report their node_name.
+                                    Defaults to timeout.
+                warm_up_connections - connections to open to every node
+                                      before returning, see warm_up().  By
+                                      default none are opened until a node
+                                      is first used.
+                connection_pool - callable taking a node's connection kwargs
+                                  and returning its pool, e.g.
+                                  functools.partial(MultiNodeConnectionPool,
+                                                    max_connections=20).
+                                  Defaults to redis-py's ConnectionPool.
+                circuit_breaker - optional MultiNodeCircuitBreaker, so calls
+                                  to a failing node fail fast.
+                replica_fallback - retry reads on a replica when the master
+                                   can't be reached or its circuit is open.
+                codec - optional MultiNodeCodec applied to values.  Nodes
+                        then return raw bytes and the codec decodes them.
         """
+        self.executor = MultiNodeExecutor(
+            max_workers=max_workers or len(master_servers),
+            timeout=timeout)
+        self.codec = codec
+        self._connection_pool = connection_pool
+        decode_responses = codec is None
+        masters = [self._parse_config(entry, connection_pool,
+                                      decode_responses)
+                   for entry in master_servers]
+        slaves = [self._parse_config(entry, connection_pool, decode_responses)
+                  for entry in slave_servers or []]
+        if discovery_timeout is None:
+            discovery_timeout = timeout
+        masters, slaves = self._discover_node_names([masters, slaves],
+                                                    discovery_timeout)
         self.node_map = {}
-        for entry in master_servers:
-            node_name, node = self._parse_config(entry)
-
+        for node_name, node in masters:
             self.node_map[node_name] = [node]
-        if slave_servers:
-            for entry in slave_servers:
-                node_name, node = self._parse_config(entry)
-                if node_name not in self.node_map:
-                    raise MultiNodeRedisException("slave with node_name: " +
-                        "%s has no corresponding master." % node_name)
-                self.node_map[node_name].append(node)
+        for node_name, node in slaves:
+            if node_name not in self.node_map:
+                raise MultiNodeRedisException("slave with node_name: " +
+                    "%s has no corresponding master." % node_name)
+            self.node_map[node_name].append(node)
+        self._router_class = router or ModuloRouter
+        self._set_nodes(self.node_map, self._router_class(
+            node_order(node_name for node_name, _ in masters)))
+        self.read_policy = read_policy or LeastOutstandingReplicaPolicy()
+        self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.near_cache = near_cache
+        self.client_tracking = client_tracking
+        self._tracking_listeners = []
+        self.auto_pipeline = auto_pipeline
+        self.circuit_breaker = circuit_breaker
+        self.replica_fallback = replica_fallback
+        self.instrumentation = instrumentation
+        for node, node_name in self._node_names_by_node.items():
+            self._attach_node(node, node_name)
+        if instrumentation is not None:
+            instrumentation.instrument_manager(self)
+        if warm_up_connections:
+            self.warm_up(warm_up_connections)
 
     def __setitem__(self, name, value):
         self.set(name, value)
@@ -42,14 +162,35 @@ class MultiNodeManager(object):
             return value
         raise KeyError(name)
 
+    def route_many(self, keys):
+        """
+            Route a batch of keys in one pass.  Returns {node: [keys]}, with
+            each node's keys in their original order.
+        """
+        groups = {}
+        for node, positions in self._group_by_node(keys):
+            groups[node] = [keys[position] for position in positions]
+        return groups
+
+    def warm_up(self, connections_per_node=1, timeout=None):
+        """
+            Open connections_per_node pooled connections to every master and
+            replica, all nodes at once, so first requests don't pay for the
+            connect.  Pre-fork servers should call this in each worker after
+            forking, as pools drop connections inherited from the parent.
+        """
+        self._execute_concurrently(
+            [functools.partial(_open_connections, node, connections_per_node)
+             for node in self._node_names_by_node], timeout=timeout)
+
     ## Start private functions
 
     @classmethod
-    def _parse_config(cls, entry):
+    def _parse_entry(cls, entry):
         """
-            Get node_name, redis client from a config entry.  Config entry is
+            Split a config entry into node_name, host, port.  Config entry is
             either of the form: node1|127.0.0.1:6379 or 127.0.0.1:6379.  In
-            the second case, we grab the node name from the redis node.
+            the second case node_name is None.
         """
         if '|' in entry:
             node_name, server = entry.split('|')
@@ -57,37 +198,306 @@ class MultiNodeManager(object):
             node_name = None
             server = entry
         host, port = server.split(":")
-        node = redis.StrictRedis(host=host,
-                                 port=int(port),
-                                 db=0,
-                                 decode_responses=True)
-        node_name = node_name or node.get(NODE_NAME)
-        if not node_name:
-            raise MultiNodeRedisException("key: 'node_name' not set in " +
-                "node %s:%s", host, port)
+        return node_name, host, int(port)
+
+    @classmethod
+    def _parse_config(cls, entry, connection_pool=None,
+                      decode_responses=True):
+        """
+            Get node_name, redis client from a config entry.  node_name is
+            None if the entry has none; see _discover_node_names.  No
+            connection is made.
+        """
+        node_name, host, port = cls._parse_entry(entry)
+        if connection_pool is None:
+            node = redis.StrictRedis(host=host,
+                                     port=port,
+                                     db=0,
+                                     decode_responses=decode_responses)
+        else:
+            node = redis.StrictRedis(connection_pool=connection_pool(
+                host=host, port=port, db=0,
+                decode_responses=decode_responses))
         return node_name, node
 
+    def _discover_node_names(self, config_lists, timeout=None):
+        """
+            Fill in missing node names by reading the "node_name" key from
+            each node, all nodes at once.  Raises MultiNodeTimeoutException if
+            a node doesn't answer within timeout.
+        """
+        missing = [node for configs in config_lists
+                   for node_name, node in configs if not node_name]
+        names = self._execute_concurrently(
+            [functools.partial(node.get, NODE_NAME) for node in missing],
+            timeout=timeout)
+        discovered = dict(zip(missing, names))
+        named_lists = []
+        for configs in config_lists:
+            named = []
+            for node_name, node in configs:
+                node_name = node_name or discovered[node]
+                if not node_name:
+                    kwargs = node.connection_pool.connection_kwargs
+                    raise MultiNodeRedisException("key: 'node_name' not " +
+                        "set in node %s:%s" % (kwargs['host'],
+                                               kwargs['port']))
+                named.append((node_name, node))
+            named_lists.append(named)
+        return named_lists
+
+    def _set_nodes(self, node_map, router):
+        """
+            Switch to node_map, routed by router, compiling the routing
+            tables once, indexed by the router's node index.
+        """
+        masters = tuple(node_map[node_name][0]
+                        for node_name in router.node_names)
+        self.node_map = node_map
+        self._nodes_by_master = dict((nodes[0], tuple(nodes))
+                                     for nodes in node_map.values())
+        self._node_names_by_node = dict((node, node_name)
+                                        for node_name, nodes
+                                        in node_map.items()
+                                        for node in nodes)
+        # _masters before router, see MultiNodeResharder.finish
+        self._masters = masters
+        self._node_names = tuple(router.node_names)
+        self.router = router
+
+    def _attach_node(self, node, node_name):
+        """
+            Hook a new node up to the near cache's invalidation listener,
+            the auto-pipeline, the circuit breaker, the read policy (for a
+            replica) and the instrumentation.
+        """
+        if (self.near_cache is not None and self.client_tracking and
+                self.node_map[node_name][0] is node):
+            # imported here as it needs redis-py 2's internals, which the
+            # asyncio client on Python 3 doesn't have
+            from multinodecache import MultiNodeTrackingListener
+            listener = MultiNodeTrackingListener(node, self.near_cache)
+            listener.start()
+            self._tracking_listeners.append(listener)
+        if self.auto_pipeline is not None:
+            self.auto_pipeline.attach(node)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.attach(node, node_name)
+        if self.node_map[node_name][0] is not node:
+            # however a replica is reached, its read policy hears about it
+            node.execute_command = self._track_replica(node,
+                                                       node.execute_command)
+        if self.instrumentation is not None:
+            self.instrumentation.instrument_node(node, node_name)
+
     def _get_node_name(self, key):
         """
             Deterministically get the node name associated with the specified
             key.
         """
-        crc = zlib.crc32(key.encode('utf-8'))
-        node_pos = crc % len(self.node_map)
-        return self.node_map.keys()[node_pos]
+        return self._node_names[self.router.get_node_index(key)]
 
     def _get_node(self, key, use_slave=False):
         """
             Get the node associated with the key.
         """
+        if not use_slave:
+            return self._masters[self.router.get_node_index(key)]
         node_name = self._get_node_name(key)
         nodes = self.node_map[node_name]
-        if use_slave:
-            if len(nodes) <= 1:
-                raise MultiNodeRedisException("use_slave=True but no slaves " +
-                    "have been initialized for node_name:%s." % node_name)
-            return random.choice(nodes[1:])
-        return nodes[0]
+        if len(nodes) <= 1:
+            raise MultiNodeRedisException("use_slave=True but no slaves " +
+                "have been initialized for node_name:%s." % node_name)
+        return self.read_policy.select(nodes[1:])
+
+    def _get_read_node(self, key):
+        """
+            Get the node to read key from: a replica chosen by the read
+            policy, or the master if the node has no replicas.
+        """
+        master = self._masters[self.router.get_node_index(key)]
+        nodes = self._nodes_by_master[master]
+        if len(nodes) == 1:
+            return master
+        return self.read_policy.select(nodes[1:])
+
+    def _read(self, master, command, *args, **kwargs):
+        """
+            Run a read command on one of master's replicas, chosen by the read
+            policy.  Falls back to the master if there are no replicas, or if
+            the replica can't be reached.
+        """
+        nodes = self._nodes_by_master[master]
+        if len(nodes) == 1:
+            return getattr(master, command)(*args, **kwargs)
+        replica = self.read_policy.select(nodes[1:])
+        try:
+            return getattr(replica, command)(*args, **kwargs)
+        except (redis.ConnectionError, redis.TimeoutError):
+            return getattr(master, command)(*args, **kwargs)
+
+    def _read_master(self, master, command, *args, **kwargs):
+        """
+            Run a read command on master, falling back to one of its replicas
+            if the master can't be reached.
+        """
+        try:
+            return getattr(master, command)(*args, **kwargs)
+        except (redis.ConnectionError, redis.TimeoutError):
+            replicas = self._nodes_by_master[master][1:]
+            if not replicas:
+                raise
+            return getattr(self.read_policy.select(replicas), command)(
+                *args, **kwargs)
+
+    def _master_of(self, node):
+        """
+            The master of a replica, or node itself if it is a master.
+        """
+        return self.node_map[self._node_names_by_node[node]][0]
+
+    def _track_replica(self, node, call):
+        """
+            Wrap call, e.g. a replica's execute_command or sub-pipeline
+            execute, to tell the read policy when it starts and finishes.
+        """
+        def tracked(*args, **kwargs):
+            policy = self.read_policy
+            policy.started(node)
+            start = time.time()
+            try:
+                result = call(*args, **kwargs)
+            except (redis.ConnectionError, redis.TimeoutError):
+                policy.finished(node, time.time() - start, failed=True)
+                raise
+            except Exception:
+                # e.g. a ResponseError: the replica answered
+                policy.finished(node, time.time() - start)
+                raise
+            policy.finished(node, time.time() - start)
+            return result
+        return tracked
 
     def _get_all_nodes(self):
-        return [nodes[0] for nodes in self.node_map.values()]
\ No newline at end of file
+        return list(self._masters)
+
+    def _invalidate(self, key):
+        """
+            Drop near-cached replies for key after this client wrote to it.
+        """
+        if self.near_cache is not None:
+            self.near_cache.invalidate(key)
+
+    def _execute_concurrently(self, calls, timeout=None,
+                              return_exceptions=False):
+        """
+            Run one zero-argument callable per node concurrently, returning
+            their results in order.
+        """
+        return self.executor.run(calls, timeout=timeout,
+                                 return_exceptions=return_exceptions)
+
+    def _wrap_execute(self, node, pipeline, raise_on_error=True):
+        """
+            node's sub-pipeline's execute, going through node's circuit
+            breaker, the read policy if node is a replica, and
+            instrumentation.
+        """
+        execute = pipeline.execute
+        if not raise_on_error:
+            execute = functools.partial(execute, raise_on_error=False)
+        if self.circuit_breaker is not None:
+            execute = self.circuit_breaker.guard(node, execute)
+        if node not in self._nodes_by_master:
+            execute = self._track_replica(node, execute)
+        if self.instrumentation is not None:
+            execute = self.instrumentation.timed_pipeline(
+                self._node_names_by_node[node], pipeline.command_stack,
+                execute)
+        return execute
+
+    def _chunks(self, keys, item_bytes=_arg_bytes):
+        """
+            Split keys into consecutive chunks holding at most max_batch_size
+            keys and at most max_batch_bytes, as measured by item_bytes.  A
+            single key bigger than max_batch_bytes gets a chunk of its own.
+        """
+        max_size = self.max_batch_size
+        max_bytes = self.max_batch_bytes
+        if ((max_size is None or len(keys) <= max_size) and
+                max_bytes is None):
+            yield keys
+            return
+        chunk = []
+        chunk_bytes = 0
+        for key in keys:
+            size = item_bytes(key) if max_bytes is not None else 0
+            if chunk and ((max_size is not None and len(chunk) >= max_size) or
+                          (max_bytes is not None and
+                           chunk_bytes + size > max_bytes)):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(key)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    def _group_by_node(self, keys):
+        """
+            Group keys by the node that owns them.  Returns a list of
+            (node, positions) pairs, where positions index into keys.
+        """
+        groups = {}
+        indexes = self.router.get_node_indexes(keys)
+        for position, index in enumerate(indexes):
+            if index not in groups:
+                groups[index] = []
+            groups[index].append(position)
+        return [(self._masters[index], positions)
+                for index, positions in groups.items()]
+
+    def _scatter_gather(self, keys, func, timeout=None):
+        """
+            Call func(node, node_keys) for every node owning one of keys,
+            concurrently.  Returns a list of (positions, result) pairs, one per
+            node, where positions are the indexes into keys sent to that node.
+        """
+        groups = self._group_by_node(keys)
+        if len(groups) == 1:
+            # Every key lives on one node (e.g. shared hash tags), so send
+            # keys as given rather than gather a copy of them.  The executor
+            # runs a lone call inline unless there is a timeout to enforce.
+            node, positions = groups[0]
+            calls = [functools.partial(func, node, keys)]
+        else:
+            calls = []
+            for node, positions in groups:
+                node_keys = [keys[position] for position in positions]
+                calls.append(functools.partial(func, node, node_keys))
+        results = self._execute_concurrently(calls, timeout=timeout,
+                                             return_exceptions=True)
+        errors = []
+        for (node, positions), result in zip(groups, results):
+            if isinstance(result, Exception):
+                if (self.circuit_breaker is not None and
+                        isinstance(result, MultiNodeTimeoutException)):
+                    # Don't wait for the socket to give up on a hung node.
+                    self.circuit_breaker.record_failure(node)
+                errors.append(result)
+        if errors:
+            raise errors[0]
+        return [(positions, result)
+                for (node, positions), result in zip(groups, results)]
+
+    def _scatter_gather_ordered(self, keys, func, timeout=None):
+        """
+            Like _scatter_gather, but func returns one value per key and the
+            values are reassembled in the order of keys.
+        """
+        output = [None] * len(keys)
+        for positions, values in self._scatter_gather(keys, func,
+                                                      timeout=timeout):
+            for position, value in zip(positions, values):
+                output[position] = value
+        return output
@@ -1,12 +1,72 @@
+import functools
+import Queue
+import time
+import redis
+from redis.exceptions import NoScriptError
+from multinodeexceptions import MultiNodeTimeoutException
+from multinodemanager import _arg_bytes
+
+
+def _execute_indexed(index, execute):
+    return index, _capture_error(execute)
+
+
+def _capture_error(execute):
+    try:
+        return execute()
+    except Exception as e:
+        return e
+
+
 class MultiNodePipeline(object):
     # TODO(ks) - 5/20/14 - Figure out what do with with shard_hint
-    def __init__(self, multinodemanager, transaction=True, shard_hint=None):
+    def __init__(self, multinodemanager, transaction=True, shard_hint=None,
+                 concurrent=True, timeout=None, read_from_replicas=False,
+                 retry_policy=None):
+        """
+            Args:
+                concurrent - send every node's sub-pipeline at once rather
+                             than one node after another.
+                timeout - seconds to wait on each node when concurrent.
+                          Defaults to the manager's timeout.
+                read_from_replicas - with transaction=False, queue read
+                                     commands on a replica of the key's
+                                     node, picked by the manager's read
+                                     policy.  Reads of keys written earlier
+                                     in the pipeline stay on the master, and
+                                     a replica that can't be reached has its
+                                     reads resent to the master.
+                retry_policy - optional MultiNodeRetryPolicy to resend the
+                               commands of nodes that failed, see
+                               multinoderetry.
+
+            With transaction=False, a node's sub-pipeline that reaches the
+            manager's max_batch_size or max_batch_bytes is sent right away,
+            so no one request or server reply buffer grows unbounded.  The
+            replies are still held in memory until execute(), which returns
+            them all in one list; execute_iter() yields them instead, so
+            they can be released as they are consumed.  Transactions are
+            never split.
+        """
         self.manager = multinodemanager
         self.counter = 0
         self.transaction = transaction
         self.shard_hint = shard_hint
+        self.concurrent = concurrent
+        self.timeout = timeout
+        self.read_from_replicas = read_from_replicas
+        self.retry_policy = retry_policy
         self.pipeline_map = {}
         self.pipeline_order = {}
+        self.written_keys = set()
+        # pipeline -> [commands counted, approximate bytes queued]
+        self.pipeline_bytes = {}
+        # index -> reply, for commands in sub-pipelines sent early
+        self.flushed = {}
+        # index -> codec method decoding that command's reply
+        self.decoders = {}
+        # index -> (script, node, keys, args) for queued scripts
+        self.scripts = {}
 
     def __enter__(self):
         return self
@@ -15,10 +75,33 @@ class MultiNodePipeline(object):
         return
 
     def __len__(self):
-        return sum([len(ordering) for ordering in self.pipeline_order.values()])
+        return self.counter
+
+    def reset(self):
+        self.counter = 0
+        self.pipeline_map = {}
+        self.pipeline_order = {}
+        self.pipeline_bytes = {}
+        self.flushed = {}
+        self.decoders = {}
+        self.scripts = {}
+        self.written_keys = set()
+
+    def is_single_node(self):
+        """
+            True if every queued command lives on one node.  Only then is a
+            transaction=True pipeline actually atomic.
+        """
+        return len(self.pipeline_map) <= 1
 
-    def _get_pipeline(self, key):
-        node = self.manager._get_node(key)
+    def _get_pipeline(self, key, read=False):
+        # A transaction has to stay on the master to be atomic, and a read
+        # of a key written earlier in the pipeline has to see the write.
+        if (read and self.read_from_replicas and not self.transaction and
+                key not in self.written_keys):
+            node = self.manager._get_read_node(key)
+        else:
+            node = self.manager._get_node(key)
         if node not in self.pipeline_map:
             pipeline = node.pipeline(transaction=self.transaction,
                                      shard_hint=self.shard_hint)
@@ -26,104 +109,458 @@ class MultiNodePipeline(object):
             self.pipeline_order[pipeline] = []
         return self.pipeline_map[node]
 
-    def _update_pipeline(self, key):
-        pipeline = self._get_pipeline(key)
+    def _update_pipeline(self, key, write=False, read=False):
+        pipeline = self._get_pipeline(key, read=read)
+        if not self.transaction and self._is_full(pipeline):
+            self._flush(pipeline)
+        if write:
+            self.written_keys.add(key)
         self.pipeline_order[pipeline].append(self.counter)
         self.counter += 1
         return pipeline
 
+    def _decode_later(self, decoder):
+        codec = self.manager.codec
+        if codec is not None:
+            self.decoders[self.counter - 1] = getattr(codec, decoder)
+
+    def _decode(self, output):
+        for index, decode in self.decoders.iteritems():
+            value = output[index]
+            if not isinstance(value, Exception):
+                output[index] = decode(value)
+        return output
+
     def delete(self, key):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.delete(key)
         return self
 
-    def execute(self):
+    def _is_full(self, pipeline):
+        max_size = self.manager.max_batch_size
+        max_bytes = self.manager.max_batch_bytes
+        if max_size is not None and len(pipeline.command_stack) >= max_size:
+            return True
+        if max_bytes is None:
+            return False
+        # Only size commands queued since the last check.
+        counted = self.pipeline_bytes.setdefault(pipeline, [0, 0])
+        command_stack = pipeline.command_stack
+        for args, options in command_stack[counted[0]:]:
+            counted[1] += sum(_arg_bytes(arg) for arg in args)
+        counted[0] = len(command_stack)
+        return counted[1] >= max_bytes
+
+    def _flush(self, pipeline):
+        node = [node for node, node_pipeline in self.pipeline_map.iteritems()
+                if node_pipeline is pipeline][0]
+        # Errors are kept in place and raised (or returned) by execute().
+        order = self.pipeline_order[pipeline]
+        command_stack = list(pipeline.command_stack)
+        values = _capture_error(self._get_executes([node], False)[0])
+        values = self._recover([node], [command_stack], [values], False)[0]
+        if isinstance(values, Exception):
+            values = [values] * len(order)
+        for i, value in enumerate(values):
+            self.flushed[order[i]] = value
+        self.pipeline_order[pipeline] = []
+        self.pipeline_bytes.pop(pipeline, None)
+
+    def execute(self, raise_on_error=True):
+        """
+            Send every queued command and return the replies in queue order.
+            Args:
+                raise_on_error - if False, a command that failed gets its
+                                 exception in its slot instead of raising.
+                                 Every command queued for a node that failed
+                                 as a whole (unreachable, timed out, circuit
+                                 open) gets that node's error, and the other
+                                 nodes' results still come back.
+        """
+        try:
+            if self.scripts:
+                output = self._execute(False)
+                self._settle_scripts(output, self.scripts)
+                if raise_on_error:
+                    for value in output:
+                        if isinstance(value, Exception):
+                            raise value
+            else:
+                output = self._execute(raise_on_error)
+            if self.decoders:
+                return self._decode(output)
+            return output
+        finally:
+            # Invalidate after the writes land, whether or not they all
+            # succeeded.
+            for key in self.written_keys:
+                self.manager._invalidate(key)
+            self.reset()
+
+    def _queue_script(self, script, keys, args):
+        """
+            Queue a MultiNodeScript.  Sends the body with EVAL if the node
+            isn't known to have it yet, EVALSHA otherwise.
+        """
+        node = script._get_node(keys)
+        pipeline = self._update_pipeline(keys[0], write=True)
+        self.written_keys.update(keys[1:])
+        if script.is_loaded(node):
+            pipeline.evalsha(script.sha, len(keys), *(keys + args))
+        else:
+            pipeline.eval(script.script, len(keys), *(keys + args))
+        self.scripts[self.counter - 1] = (script, node, keys, args)
+        return self
+
+    def _settle_scripts(self, output, scripts):
+        """
+            Note which nodes now have each of scripts, and rerun any that hit
+            NOSCRIPT.  A transaction's scripts aren't rerun outside it; the
+            error is returned and the next call reloads the script.
+        """
+        for index, (script, node, keys, args) in sorted(
+                scripts.iteritems()):
+            value = output[index]
+            if isinstance(value, NoScriptError):
+                script.forget(node)
+                if not self.transaction:
+                    output[index] = _capture_error(
+                        functools.partial(script, keys, args))
+            elif not isinstance(value, Exception):
+                script.loaded(node)
+
+    def execute_iter(self, raise_on_error=True):
+        """
+            Like execute(), but yields (index, result) pairs as each node's
+            sub-pipeline finishes instead of returning one list, so fast
+            nodes' results can be used while slow ones are still running.
+            Pairs come in node completion order, and in queue order within a
+            node.  Each node's replies get the same retries, replica
+            fallback and script reloading as in execute(), and the timeout
+            is one deadline for the whole pipeline.  The pipeline is reset
+            as soon as everything is sent.
+            Args:
+                raise_on_error - as for execute(), but the error is raised
+                                 when its node's results are reached.
+        """
+        nodes = self.pipeline_map.keys()
+        pipelines = [self.pipeline_map[node] for node in nodes]
+        orders = [self.pipeline_order[pipeline] for pipeline in pipelines]
+        command_stacks = [list(pipeline.command_stack)
+                          for pipeline in pipelines]
+        executes = self._get_executes(nodes, False)
+        flushed = self.flushed
+        decoders = self.decoders
+        scripts = self.scripts
+        written_keys = self.written_keys
+        executor = self.manager.executor
+        timeout = self.timeout
+        if timeout is None:
+            timeout = executor.timeout
+        results = Queue.Queue()
+        if self.concurrent:
+            deadline = None
+            if timeout is not None:
+                deadline = time.time() + timeout
+            tasks = [executor.submit(functools.partial(_execute_indexed, i,
+                                                       execute), results)
+                     for i, execute in enumerate(executes)]
+        self.reset()
+        try:
+            indexes = sorted(flushed)
+            for pair in self._settled(
+                    indexes, [flushed[index] for index in indexes],
+                    scripts, decoders, raise_on_error):
+                yield pair
+            flushed = None
+            pending = set(xrange(len(nodes)))
+            while pending:
+                if not self.concurrent:
+                    done = [min(pending)]
+                    values = [_capture_error(executes[done[0]])]
+                else:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = max(0, deadline - time.time())
+                    try:
+                        i, node_values = executor.next_result(
+                            results, timeout=remaining)
+                        done, values = [i], [node_values]
+                    except MultiNodeTimeoutException as e:
+                        done = sorted(pending)
+                        executor.abandon([tasks[i] for i in done])
+                        values = [e] * len(done)
+                pending.difference_update(done)
+                values = self._recover([nodes[i] for i in done],
+                                       [command_stacks[i] for i in done],
+                                       values, False)
+                for i, node_values in zip(done, values):
+                    if isinstance(node_values, Exception):
+                        node_values = [node_values] * len(orders[i])
+                    for pair in self._settled(orders[i], node_values,
+                                              scripts, decoders,
+                                              raise_on_error):
+                        yield pair
+        finally:
+            for key in written_keys:
+                self.manager._invalidate(key)
+
+    def _settled(self, indexes, values, scripts, decoders, raise_on_error):
+        """
+            Yield (index, result) for the replies values of the commands at
+            indexes, once their scripts are settled and they are decoded.
+        """
+        output = dict(zip(indexes, values))
+        self._settle_scripts(output, dict((index, scripts[index])
+                                          for index in indexes
+                                          if index in scripts))
+        if raise_on_error:
+            for index in indexes:
+                if isinstance(output[index], Exception):
+                    raise output[index]
+        for index in indexes:
+            value = output[index]
+            if index in decoders and not isinstance(value, Exception):
+                value = decoders[index](value)
+            yield index, value
+
+    def _get_executes(self, nodes, raise_on_error=True):
+        breaker = self.manager.circuit_breaker
+        instrumentation = self.manager.instrumentation
+        if (breaker is None and instrumentation is None and raise_on_error
+                and not self.read_from_replicas):
+            return [self.pipeline_map[node].execute for node in nodes]
+        return [self._wrap_execute(node, self.pipeline_map[node],
+                                   raise_on_error)
+                for node in nodes]
+
+    def _wrap_execute(self, node, pipeline, raise_on_error=True):
+        return self.manager._wrap_execute(node, pipeline, raise_on_error)
+
+    def _retry(self, nodes, command_stacks, results, raise_on_error=True):
+        """
+            Resend the commands of each node whose result is an exception,
+            as the retry policy allows, replacing its entry in results.  A
+            node that timed out may still be running its original
+            sub-pipeline, so resends go through a fresh one.
+        """
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            failed = [i for i, values in enumerate(results)
+                      if isinstance(values, Exception) and
+                      policy.should_retry(values, attempt, command_stacks[i])]
+            if not failed:
+                return results
+            time.sleep(policy.delay(attempt))
+            attempt += 1
+            retried = self._resend([nodes[i] for i in failed],
+                                   [command_stacks[i] for i in failed],
+                                   raise_on_error)
+            for i, values in zip(failed, retried):
+                results[i] = values
+
+    def _recover(self, nodes, command_stacks, results, raise_on_error=True):
+        """
+            Retry and fall back to masters as configured for nodes whose
+            result is an exception, then report the nodes that still timed
+            out to the circuit breaker.  Returns results, updated in place.
+            command_stacks may be None without a retry policy or
+            read_from_replicas.
+        """
+        if self.retry_policy is not None:
+            results = self._retry(nodes, command_stacks, results,
+                                  raise_on_error)
+        if self.read_from_replicas:
+            results = self._fall_back(nodes, command_stacks, results,
+                                      raise_on_error)
+        breaker = self.manager.circuit_breaker
+        if breaker is not None:
+            for node, values in zip(nodes, results):
+                if isinstance(values, MultiNodeTimeoutException):
+                    # Don't wait for the socket to give up on a hung node.
+                    breaker.record_failure(node)
+        return results
+
+    def _fall_back(self, nodes, command_stacks, results,
+                   raise_on_error=True):
+        """
+            Resend to its master the reads of each replica that couldn't be
+            reached or timed out, replacing its entry in results.
+        """
+        masters = self.manager._nodes_by_master
+        failed = [i for i, values in enumerate(results)
+                  if nodes[i] not in masters and
+                  isinstance(values, (redis.ConnectionError,
+                                      redis.TimeoutError,
+                                      MultiNodeTimeoutException))]
+        if failed:
+            retried = self._resend(
+                [self.manager._master_of(nodes[i]) for i in failed],
+                [command_stacks[i] for i in failed], raise_on_error)
+            for i, values in zip(failed, retried):
+                results[i] = values
+        return results
+
+    def _resend(self, nodes, command_stacks, raise_on_error=True):
+        """
+            Send each command stack to its node through a fresh
+            sub-pipeline, as the failed one may still be running.  Returns
+            each node's replies or error.
+        """
+        executes = []
+        for node, command_stack in zip(nodes, command_stacks):
+            pipeline = node.pipeline(transaction=self.transaction,
+                                     shard_hint=self.shard_hint)
+            pipeline.command_stack = list(command_stack)
+            executes.append(self._wrap_execute(node, pipeline,
+                                               raise_on_error))
+        if self.concurrent:
+            return self.manager._execute_concurrently(
+                executes, timeout=self.timeout, return_exceptions=True)
+        return [_capture_error(execute) for execute in executes]
+
+    def _execute(self, raise_on_error=True):
+        nodes = self.pipeline_map.keys()
+        pipelines = [self.pipeline_map[node] for node in nodes]
+        executes = self._get_executes(nodes, raise_on_error)
+        retry_policy = self.retry_policy
+        timeout = self.timeout
+        if timeout is None:
+            timeout = self.manager.executor.timeout
+        if (len(pipelines) == 1 and not self.flushed and raise_on_error and
+                retry_policy is None and
+                (timeout is None or not self.concurrent) and
+                nodes[0] in self.manager._nodes_by_master):
+            # Nothing to merge when the whole batch went to one node, and no
+            # timeout that needs the executor to enforce it.
+            return executes[0]()
         output = [None] * len(self)
-        for pipeline in self.pipeline_map.values():
+        for index, value in self.flushed.iteritems():
+            output[index] = value
+        resend = retry_policy is not None or self.read_from_replicas
+        command_stacks = None
+        if resend:
+            # execute() empties each sub-pipeline, keep what to resend
+            command_stacks = [list(pipeline.command_stack)
+                              for pipeline in pipelines]
+        if self.concurrent:
+            results = self.manager._execute_concurrently(
+                executes, timeout=self.timeout, return_exceptions=True)
+        elif raise_on_error and not resend:
+            results = [execute() for execute in executes]
+        else:
+            results = [_capture_error(execute) for execute in executes]
+        results = self._recover(nodes, command_stacks, results,
+                                raise_on_error)
+        errors = []
+        for pipeline, values in zip(pipelines, results):
             order = self.pipeline_order[pipeline]
-            for i, value in enumerate(pipeline.execute()):
+            if isinstance(values, Exception):
+                errors.append(values)
+                values = [values] * len(order)
+            for i, value in enumerate(values):
                 index = order[i]
                 output[index] = value
+        if raise_on_error:
+            if errors:
+                raise errors[0]
+            if self.flushed:
+                for value in output:
+                    if isinstance(value, Exception):
+                        raise value
         return output
-        #for pipeline in self.pipeline_map.values():
-
 
     def expire(self, key, time):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.expire(key, time)
         return self
 
     def get(self, key):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, read=True)
         pipeline.get(key)
+        self._decode_later('decode')
         return self
 
     def hget(self, key, field):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, read=True)
         pipeline.hget(key, field)
+        self._decode_later('decode')
         return self
 
     def hgetall(self, key):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, read=True)
         pipeline.hgetall(key)
+        self._decode_later('decode_mapping')
         return self
 
     def hincrby(self, key, field, amount=1):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.hincrby(key, field, amount=amount)
         return self
 
     def hmset(self, key, mapping):
-        pipeline = self._update_pipeline(key)
+        if self.manager.codec is not None:
+            mapping = self.manager.codec.encode_mapping(mapping)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.hmset(key, mapping)
         return self
 
     def hset(self, key, field, value):
-        pipeline = self._update_pipeline(key)
+        if self.manager.codec is not None:
+            value = self.manager.codec.encode(value)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.hset(key, field, value)
         return self
 
     def incr(self, key, amount=1):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.incr(key, amount=amount)
         return self
 
     def llen(self, key):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, read=True)
         pipeline.llen(key)
         return self
 
     def persist(self, key):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.persist(key)
         return self
 
     def set(self, key, value, ex=None, px=None, nx=False, xx=False):
-        pipeline = self._update_pipeline(key)
+        if self.manager.codec is not None:
+            value = self.manager.codec.encode(value)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.set(key, value)
         return self
         # TODO(ks) - 5/22/14 - Figure out why ex doesn't work
         #pipeline.set(key, value, ex=ex, px=px, nx=nx, xx=xx)
 
     def ttl(self, key):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, read=True)
         pipeline.ttl(key)
         return self
 
     def zadd(self, key, *args, **kwargs):
-        pipeline = self._update_pipeline(key)
+        if self.manager.codec is not None:
+            args, kwargs = self.manager.codec.encode_zadd(args, kwargs)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.zadd(key, *args, **kwargs)
         return self
 
     def zincrby(self, key, value, amount=1):
-        pipeline = self._update_pipeline(key)
+        if self.manager.codec is not None:
+            value = self.manager.codec.encode(value)
+        pipeline = self._update_pipeline(key, write=True)
         pipeline.zincrby(key, value, amount=amount)
         return self
 
     def zrange(self, key, start, end, desc=False, withscores=False,
                score_cast_func=float):
-        pipeline = self._update_pipeline(key)
+        pipeline = self._update_pipeline(key, read=True)
         pipeline.zrange(key, start, end, desc=desc,
                         withscores=withscores,
                         score_cast_func=score_cast_func)
+        self._decode_later('decode_members')
         return self
\ No newline at end of file
@@ -0,0 +1,122 @@
+import os
+import time
+import redis
+
+
+class MultiNodeConnectionPool(redis.BlockingConnectionPool):
+    def __init__(self, max_connections=50, timeout=20, idle_timeout=None,
+                 health_check_interval=None, **connection_kwargs):
+        """
+            Blocking connection pool for one node.  When every connection is
+            in use, callers wait up to timeout seconds for one to be released
+            instead of opening more, so a burst can't stampede a node with
+            reconnects.  Pass to MultiNodeRedis as e.g.
+            connection_pool=functools.partial(MultiNodeConnectionPool,
+                                              max_connections=20).
+            Args:
+                max_connections - most connections open to the node.
+                timeout - seconds to wait for a free connection before
+                          raising ConnectionError.  None waits forever.
+                idle_timeout - close connections unused for this many
+                               seconds.  Checked when connections are
+                               released; there is no reaper thread.
+                health_check_interval - PING a connection that has been idle
+                                        this long before handing it out, and
+                                        reconnect if it doesn't answer.
+        """
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        # Options to build an equivalent pool with, see
+        # MultiNodeTrackingListener.start.
+        self.pool_kwargs = {'timeout': timeout,
+                            'idle_timeout': idle_timeout,
+                            'health_check_interval': health_check_interval}
+        self.reaped = 0
+        self.health_check_failures = 0
+        super(MultiNodeConnectionPool, self).__init__(
+            max_connections=max_connections, timeout=timeout,
+            **connection_kwargs)
+
+    def reset(self):
+        super(MultiNodeConnectionPool, self).reset()
+        self._next_reap = time.time() + (self.idle_timeout or 0)
+
+    def _checkpid(self):
+        # After a fork the child shares the parent's sockets.  The stock pool
+        # disconnect()s them, and (with the hiredis parser, which doesn't
+        # close the socket first) the shutdown() in there kills the parent's
+        # connections too.  Only close our copy of each file descriptor.
+        if self.pid != os.getpid():
+            with self._check_lock:
+                if self.pid == os.getpid():
+                    return
+                for connection in self._connections:
+                    _close_forked(connection)
+                self.reset()
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super(MultiNodeConnectionPool, self).get_connection(
+            command_name, *keys, **options)
+        if connection._sock is None:
+            return connection
+        idle = time.time() - getattr(connection, 'last_used', 0)
+        if self.idle_timeout is not None and idle > self.idle_timeout:
+            connection.disconnect()
+        elif (self.health_check_interval is not None and
+                idle > self.health_check_interval):
+            try:
+                connection.send_command('PING')
+                connection.read_response()
+            except redis.RedisError:
+                self.health_check_failures += 1
+                # reconnects on the next command
+                connection.disconnect()
+        return connection
+
+    def release(self, connection):
+        now = time.time()
+        connection.last_used = now
+        super(MultiNodeConnectionPool, self).release(connection)
+        if self.idle_timeout is not None and now >= self._next_reap:
+            self._next_reap = now + self.idle_timeout / 2.0
+            self._reap(now)
+
+    def _reap(self, now):
+        """
+            Close idle connections sitting in the pool, replacing them with
+            empty slots so they aren't held open forever at the bottom of the
+            LIFO queue.
+        """
+        idle = []
+        queue = self.pool
+        with queue.mutex:
+            for i, connection in enumerate(queue.queue):
+                if (connection is not None and
+                        now - connection.last_used > self.idle_timeout):
+                    queue.queue[i] = None
+                    idle.append(connection)
+        for connection in idle:
+            try:
+                self._connections.remove(connection)
+            except ValueError:
+                pass
+            connection.disconnect()
+        self.reaped += len(idle)
+
+    def stats(self):
+        return {'connections': len(self._connections),
+                'idle': sum(1 for connection in list(self.pool.queue)
+                            if connection is not None),
+                'reaped': self.reaped,
+                'health_check_failures': self.health_check_failures}
+
+
+def _close_forked(connection):
+    sock = connection._sock
+    connection._parser.on_disconnect()
+    connection._sock = None
+    if sock is not None:
+        try:
+            sock.close()
+        except Exception:
+            pass
@@ -1,9 +1,30 @@
+import functools
+import Queue
 from multinodepipeline import MultiNodePipeline
-from multinodemanager import MultiNodeManager
-from multinodeexceptions import MultiNodeRedisException
+from multinodeloader import MultiNodeBulkLoader
+from multinodemanager import MultiNodeManager, _arg_bytes
+from multinodeexceptions import (MultiNodeRedisException,
+                                 MultiNodeTimeoutException)
+from multinodereshard import MultiNodeResharder
+from multinodescript import MultiNodeScript
+from multinodesnapshot import MultiNodeSnapshot
+from multinodezset import merge_range, union_range
+
+# MultiNodeCodec method that decodes each read command's reply.
+DECODERS = {'get': 'decode',
+            'hget': 'decode',
+            'hgetall': 'decode_mapping',
+            'zrange': 'decode_members'}
 
 class MultiNodeRedis(object):
-    def __init__(self, master_servers, slave_servers=None):
+    def __init__(self, master_servers, slave_servers=None, max_workers=None,
+                 timeout=None, router=None, near_cache=None,
+                 client_tracking=False, read_from_replicas=False,
+                 read_policy=None, instrumentation=None, max_batch_size=None,
+                 max_batch_bytes=None, auto_pipeline=None,
+                 discovery_timeout=None, warm_up_connections=0,
+                 connection_pool=None, circuit_breaker=None,
+                 replica_fallback=False, codec=None):
         """
             Initialize MultiNodeRedis object.  The master hosts should contain
             the key "node_name".  This key identifies the node, and will be
@@ -12,8 +33,61 @@ class MultiNodeRedis(object):
                 master_servers - e.g. [node1|127.0.0.1:6379,
                                        node2|127.0.0.1:6370]
                 slave_servers - same as master_hosts
+                max_workers - threads used for concurrent calls across nodes.
+                timeout - seconds to wait on any one node during a concurrent
+                          call.
+                router - node routing scheme, see MultiNodeManager.
+                near_cache - optional MultiNodeNearCache in front of get,
+                             hget and hgetall.  Writes through this client
+                             invalidate it.
+                client_tracking - also invalidate on writes from other
+                                  clients, see MultiNodeManager.
+                read_from_replicas - default for the use_slave argument of
+                                     read commands.
+                read_policy - picks which replica serves a read, see
+                              multinodereplica.
+                instrumentation - optional MultiNodeInstrumentation, see
+                                  multinodeinstrumentation.
+                max_batch_size - most keys or pipeline commands sent to one
+                                 node per request; larger batches are split.
+                max_batch_bytes - same, bounding approximate bytes.
+                auto_pipeline - optional MultiNodeAutoPipeline, see
+                                multinodeautopipeline.
+                discovery_timeout - seconds to wait for unnamed nodes to
+                                    report their node_name.
+                warm_up_connections - connections to open per node up
+                                      front, see warm_up().
+                connection_pool - callable building each node's pool from
+                                  its connection kwargs, e.g. a partial of
+                                  multinodepool.MultiNodeConnectionPool.
+                circuit_breaker - optional MultiNodeCircuitBreaker, see
+                                  multinodebreaker.
+                replica_fallback - read from a replica when the master can't
+                                   be reached.
+                codec - optional MultiNodeCodec for compressing and
+                        serializing values, see multinodecodec.
         """
-        self.manager = MultiNodeManager(master_servers, slave_servers=slave_servers)
+        self.manager = MultiNodeManager(master_servers,
+                                        slave_servers=slave_servers,
+                                        max_workers=max_workers,
+                                        timeout=timeout,
+                                        router=router,
+                                        near_cache=near_cache,
+                                        client_tracking=client_tracking,
+                                        read_policy=read_policy,
+                                        instrumentation=instrumentation,
+                                        max_batch_size=max_batch_size,
+                                        max_batch_bytes=max_batch_bytes,
+                                        auto_pipeline=auto_pipeline,
+                                        discovery_timeout=discovery_timeout,
+                                        warm_up_connections=
+                                        warm_up_connections,
+                                        connection_pool=connection_pool,
+                                        circuit_breaker=circuit_breaker,
+                                        replica_fallback=replica_fallback,
+                                        codec=codec)
+        self.read_from_replicas = read_from_replicas
+        self.scripts = []
 
     def __setitem__(self, name, value):
         self.set(name, value)
@@ -49,67 +123,156 @@ class MultiNodeRedis(object):
     def _get_all_nodes(self):
         return self.manager._get_all_nodes()
 
-    def delete(self, key):
-        node = self._get_node(key)
-        return node.delete(key)
+    def _use_slave(self, use_slave):
+        if use_slave is None:
+            return self.read_from_replicas
+        return use_slave
+
+    def _replica_read(self, command, key, *args, **kwargs):
+        master = self._get_node(key)
+        return self.manager._read(master, command, key, *args, **kwargs)
+
+    def _master_read(self, command, key, *args, **kwargs):
+        master = self._get_node(key)
+        if self.manager.replica_fallback:
+            return self.manager._read_master(master, command, key, *args,
+                                             **kwargs)
+        return getattr(master, command)(key, *args, **kwargs)
+
+    def _read_value(self, use_slave, command, key, *args, **kwargs):
+        if self._use_slave(use_slave):
+            value = self._replica_read(command, key, *args, **kwargs)
+        else:
+            value = self._master_read(command, key, *args, **kwargs)
+        codec = self.manager.codec
+        if codec is None:
+            return value
+        return getattr(codec, DECODERS[command])(value)
+
+    def _zset_reply(self, members, withscores):
+        if not withscores:
+            members = [member for member, _ in members]
+        codec = self.manager.codec
+        if codec is None:
+            return members
+        return codec.decode_members(members)
+
+    def _cached_read(self, use_slave, command, key, *args):
+        near_cache = self.manager.near_cache
+        found, value = near_cache.get(command, key, *args)
+        if not found:
+            token = near_cache.token()
+            # decoded, so hits don't pay for decoding again
+            value = self._read_value(use_slave, command, key, *args)
+            near_cache.set(token, value, command, key, *args)
+        if isinstance(value, dict):
+            # callers may modify the dict, don't let them modify the cache
+            return dict(value)
+        return value
+
+    def bulk_loader(self, **kwargs):
+        """
+            Returns a MultiNodeBulkLoader writing into this client's nodes,
+            see multinodeloader.
+        """
+        return MultiNodeBulkLoader(self.manager, **kwargs)
+
+    def delete(self, *names):
+        def node_delete(node, node_keys):
+            return sum(node.delete(*chunk)
+                       for chunk in self.manager._chunks(node_keys))
+        try:
+            results = self.manager._scatter_gather(names, node_delete)
+        finally:
+            # a write may have landed even if its reply never did
+            for name in names:
+                self.manager._invalidate(name)
+        return sum(result for _, result in results)
 
     def expire(self, key, time):
         node = self._get_node(key)
-        return node.expire(key, time)
+        try:
+            return node.expire(key, time)
+        finally:
+            self.manager._invalidate(key)
 
     def flushall(self):
         for node in self._get_all_nodes():
             node.flushall()
+        if self.manager.near_cache is not None:
+            self.manager.near_cache.clear()
 
-    def get(self, key):
-        node = self._get_node(key)
-        return node.get(key)
+    def get(self, key, use_slave=None):
+        if self.manager.near_cache is not None:
+            return self._cached_read(use_slave, 'get', key)
+        return self._read_value(use_slave, 'get', key)
 
-    def hget(self, key, field):
-        node = self._get_node(key)
-        return node.hget(key, field)
+    def hget(self, key, field, use_slave=None):
+        if self.manager.near_cache is not None:
+            return self._cached_read(use_slave, 'hget', key, field)
+        return self._read_value(use_slave, 'hget', key, field)
 
-    def hgetall(self, key):
-        node = self._get_node(key)
-        return node.hgetall(key)
+    def hgetall(self, key, use_slave=None):
+        if self.manager.near_cache is not None:
+            return self._cached_read(use_slave, 'hgetall', key)
+        return self._read_value(use_slave, 'hgetall', key)
 
     def hincrby(self, key, field, amount=1):
         node = self._get_node(key)
-        return node.hincrby(key, field, amount=amount)
+        try:
+            return node.hincrby(key, field, amount=amount)
+        finally:
+            self.manager._invalidate(key)
 
     def hmset(self, key, mapping):
+        if self.manager.codec is not None:
+            mapping = self.manager.codec.encode_mapping(mapping)
         node = self._get_node(key)
-        return node.hmset(key, mapping)
+        try:
+            return node.hmset(key, mapping)
+        finally:
+            self.manager._invalidate(key)
 
     def hset(self, key, field, value):
+        if self.manager.codec is not None:
+            value = self.manager.codec.encode(value)
         node = self._get_node(key)
-        return node.hset(key, field, value)
+        try:
+            return node.hset(key, field, value)
+        finally:
+            self.manager._invalidate(key)
 
     def incr(self, key, amount=1):
         node = self._get_node(key)
-        return node.incr(key, amount=amount)
+        try:
+            return node.incr(key, amount=amount)
+        finally:
+            self.manager._invalidate(key)
 
-    def llen(self, key):
-        node = self._get_node(key)
-        return node.llen(key)
+    def llen(self, key, use_slave=None):
+        if self._use_slave(use_slave):
+            return self._replica_read('llen', key)
+        return self._master_read('llen', key)
 
-    def mget(self, keys, *args):
+    def mget(self, keys, *args, **kwargs):
         args = self._list_or_args(keys, args)
-        node_map = {}
-        for key in args:
-            node = self._get_node(key)
-            if node not in node_map:
-                node_map[node] = []
-            node_map[node].append(key)
-        mapping = {}
-        for node, node_keys in node_map.iteritems():
-            node_values = node.mget(node_keys)
-            for i, node_key in enumerate(node_keys):
-                mapping[node_key] = node_values[i]
-        values = []
-        for key in args:
-            values.append(mapping.get(key, None))
-        return values
+        use_slave = self._use_slave(kwargs.get('use_slave'))
+
+        def node_mget(node, node_keys):
+            values = []
+            for chunk in self.manager._chunks(node_keys):
+                if use_slave:
+                    values.extend(self.manager._read(node, 'mget', chunk))
+                elif self.manager.replica_fallback:
+                    values.extend(self.manager._read_master(node, 'mget',
+                                                            chunk))
+                else:
+                    values.extend(node.mget(chunk))
+            return values
+        values = self.manager._scatter_gather_ordered(args, node_mget)
+        if self.manager.codec is None:
+            return values
+        return self.manager.codec.decode_values(values)
 
     def mset(self, *args, **kwargs):
         if args:
@@ -117,48 +280,197 @@ class MultiNodeRedis(object):
                 raise MultiNodeRedisException('MSET requires **kwargs or a ' +
                     'single dict arg')
             kwargs.update(args[0])
-        node_map = {}
-        for key, value in kwargs.iteritems():
-            node = self._get_node(key)
-            if node not in node_map:
-                node_map[node] = {}
-            node_map[node][key] = value
-        success = 0
-        for node, node_kwargs in node_map.iteritems():
-            success = success or node.mset(node_kwargs)
-        return success
+        if self.manager.codec is not None:
+            kwargs = self.manager.codec.encode_mapping(kwargs)
+
+        def item_bytes(key):
+            return _arg_bytes(key) + _arg_bytes(kwargs[key])
+
+        def node_mset(node, node_keys):
+            success = True
+            for chunk in self.manager._chunks(node_keys, item_bytes):
+                success = node.mset(dict((key, kwargs[key])
+                                         for key in chunk)) and success
+            return success
+        try:
+            results = self.manager._scatter_gather(kwargs.keys(), node_mset)
+        finally:
+            for key in kwargs:
+                self.manager._invalidate(key)
+        return all(result for _, result in results)
 
     def persist(self, key):
         node = self._get_node(key)
-        return node.persist(key)
+        try:
+            return node.persist(key)
+        finally:
+            self.manager._invalidate(key)
 
-    def pipeline(self, transaction=True, shard_hint=None):
+    def pipeline(self, transaction=True, shard_hint=None, concurrent=True,
+                 timeout=None, read_from_replicas=None, retry_policy=None):
         # TODO(ks) - 5/22/14 - I'm not actually sure if pipeline should return
         # the same pipeline object or a new one each time.
+        if read_from_replicas is None:
+            read_from_replicas = self.read_from_replicas
         return MultiNodePipeline(self.manager,
                                  transaction=transaction,
-                                 shard_hint=shard_hint)
+                                 shard_hint=shard_hint,
+                                 concurrent=concurrent,
+                                 timeout=timeout,
+                                 read_from_replicas=read_from_replicas,
+                                 retry_policy=retry_policy)
+
+    def preload_scripts(self, timeout=None):
+        """
+            Load every registered script on every master, all at once.
+        """
+        for script in self.scripts:
+            script.preload(timeout=timeout)
+
+    def register_script(self, script, preload=False):
+        """
+            Returns a MultiNodeScript, called as script(keys=[...],
+            args=[...], client=None) and routed by its first key.
+        """
+        script = MultiNodeScript(self.manager, script)
+        self.scripts.append(script)
+        if preload:
+            script.preload()
+        return script
+
+    def reshard(self, master_servers, **kwargs):
+        """
+            Returns a MultiNodeResharder moving keys onto master_servers,
+            see multinodereshard.
+        """
+        return MultiNodeResharder(self.manager, master_servers, **kwargs)
+
+    def scan_iter(self, match=None, count=None, type=None):
+        """
+            Iterate over every key in the cluster.  All masters are SCANned
+            concurrently and keys are yielded as pages arrive.  Each master has
+            at most one page in flight, so memory stays flat however many keys
+            there are.  type needs redis >= 6.
+        """
+        args = []
+        if match is not None:
+            args.extend(['MATCH', match])
+        if count is not None:
+            args.extend(['COUNT', count])
+        if type is not None:
+            args.extend(['TYPE', type])
+
+        def scan(node, cursor):
+            return node, node.execute_command('SCAN', cursor, *args)
+
+        executor = self.manager.executor
+        pages = Queue.Queue()
+        # node -> its page in flight
+        tasks = {}
+        for node in self._get_all_nodes():
+            tasks[node] = executor.submit(functools.partial(scan, node, 0),
+                                          pages)
+        while tasks:
+            try:
+                node, (cursor, keys) = executor.next_result(pages)
+            except MultiNodeTimeoutException:
+                executor.abandon(tasks.values())
+                raise
+            del tasks[node]
+            if cursor:
+                # fetch the next page while the caller works on this one
+                tasks[node] = executor.submit(
+                    functools.partial(scan, node, cursor), pages)
+            for key in keys:
+                yield key
+
+    def hscan_iter(self, key, match=None, count=None):
+        node = self._get_node(key)
+        items = node.hscan_iter(key, match=match, count=count)
+        codec = self.manager.codec
+        if codec is None:
+            return items
+        return ((codec.decode_text(field), codec.decode(value))
+                for field, value in items)
+
+    def zscan_iter(self, key, match=None, count=None,
+                   score_cast_func=float):
+        node = self._get_node(key)
+        members = node.zscan_iter(key, match=match, count=count,
+                                  score_cast_func=score_cast_func)
+        codec = self.manager.codec
+        if codec is None:
+            return members
+        return ((codec.decode(member), score) for member, score in members)
 
     def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        if self.manager.codec is not None:
+            value = self.manager.codec.encode(value)
         node = self._get_node(key)
-        return node.set(key, value)
+        try:
+            return node.set(key, value)
+        finally:
+            self.manager._invalidate(key)
         # TODO(ks) - 5/22/14 - Figure out why ex doesn't work
         # return node.set(key, value, ex=ex, px=px, nx=nx, xx=xx)
 
-    def ttl(self, key):
-        node = self._get_node(key)
-        return node.ttl(key)
+    def ttl(self, key, use_slave=None):
+        if self._use_slave(use_slave):
+            return self._replica_read('ttl', key)
+        return self._master_read('ttl', key)
+
+    def snapshot(self, **kwargs):
+        """
+            Returns a MultiNodeSnapshot exporting and restoring this
+            client's keys, see multinodesnapshot.
+        """
+        return MultiNodeSnapshot(self.manager, **kwargs)
+
+    def warm_up(self, connections_per_node=1, timeout=None):
+        return self.manager.warm_up(connections_per_node, timeout=timeout)
 
     def zadd(self, key, *args, **kwargs):
+        if self.manager.codec is not None:
+            args, kwargs = self.manager.codec.encode_zadd(args, kwargs)
         node = self._get_node(key)
         return node.zadd(key, *args, **kwargs)
 
     def zincrby(self, key, value, amount=1):
+        if self.manager.codec is not None:
+            value = self.manager.codec.encode(value)
         node = self._get_node(key)
         return node.zincrby(key, value, amount=amount)
 
     def zrange(self, key, start, end, desc=False, withscores=False,
-               score_cast_func=float):
-        node = self._get_node(key)
-        return node.zrange(key, start, end, desc=desc, withscores=withscores,
-                           score_cast_func=score_cast_func)
\ No newline at end of file
+               score_cast_func=float, use_slave=None):
+        return self._read_value(use_slave, 'zrange', key, start, end,
+                                desc=desc, withscores=withscores,
+                                score_cast_func=score_cast_func)
+
+    def zrange_many(self, keys, start, end, desc=False, withscores=False,
+                    page_size=100):
+        """
+            zrange over the sorted sets at keys as if they were one, wherever
+            they live: the members of all of them in score order, from rank
+            start to end inclusive.  A member of several sets appears once
+            per set.  Every key is read page_size members at a time, all
+            nodes at once, and merged with a heap, so a top-K query holds at
+            most K members per key.  end -1 reads every set whole; other
+            negative indexes aren't supported.
+        """
+        members = merge_range(self.manager, keys, start, end, desc=desc,
+                              page_size=page_size)
+        return self._zset_reply(members, withscores)
+
+    def zunion_range(self, keys, start, end, desc=False, withscores=False,
+                     aggregate='SUM', page_size=100):
+        """
+            zrange over the union of the sorted sets at keys, each member
+            scored by the aggregate (SUM, MIN or MAX) of its scores, as
+            ZUNIONSTORE would, but across nodes and without storing the
+            union.  Reading stops as soon as the top end + 1 are known, see
+            multinodezset.union_range.
+        """
+        members = union_range(self.manager, keys, start, end, desc=desc,
+                              aggregate=aggregate, page_size=page_size)
+        return self._zset_reply(members, withscores)
\ No newline at end of file
@@ -0,0 +1,77 @@
+import random
+import threading
+
+
+class RandomReplicaPolicy(object):
+    """
+        Pick any replica at random.  This is what use_slave=True always did.
+    """
+    def select(self, replicas):
+        return random.choice(replicas)
+
+    def started(self, node):
+        pass
+
+    def finished(self, node, elapsed, failed=False):
+        pass
+
+
+class LeastOutstandingReplicaPolicy(object):
+    def __init__(self):
+        """
+            Pick the replica with the fewest requests in flight from this
+            client, breaking ties at random.  A slow replica builds up a queue
+            and stops being picked until it drains.
+        """
+        self._outstanding = {}
+        self._lock = threading.Lock()
+
+    def select(self, replicas):
+        outstanding = self._outstanding
+        least = min(outstanding.get(node, 0) for node in replicas)
+        return random.choice([node for node in replicas
+                              if outstanding.get(node, 0) == least])
+
+    def started(self, node):
+        with self._lock:
+            self._outstanding[node] = self._outstanding.get(node, 0) + 1
+
+    def finished(self, node, elapsed, failed=False):
+        with self._lock:
+            self._outstanding[node] = self._outstanding.get(node, 1) - 1
+
+
+class EWMALatencyReplicaPolicy(LeastOutstandingReplicaPolicy):
+    def __init__(self, decay=0.3, failure_penalty=1.0):
+        """
+            Pick the replica with the lowest exponentially weighted moving
+            average latency, scaled by its requests in flight.  Replicas that
+            haven't answered yet score zero, so they get tried.
+            Args:
+                decay - weight given to each new sample.
+                failure_penalty - latency in seconds recorded for a failure.
+        """
+        super(EWMALatencyReplicaPolicy, self).__init__()
+        self.decay = decay
+        self.failure_penalty = failure_penalty
+        self._latency = {}
+
+    def select(self, replicas):
+        outstanding = self._outstanding
+        latency = self._latency
+        return min(replicas,
+                   key=lambda node: (latency.get(node, 0.0) *
+                                     (outstanding.get(node, 0) + 1),
+                                     random.random()))
+
+    def finished(self, node, elapsed, failed=False):
+        if failed:
+            elapsed = self.failure_penalty
+        with self._lock:
+            self._outstanding[node] = self._outstanding.get(node, 1) - 1
+            previous = self._latency.get(node)
+            if previous is None:
+                self._latency[node] = elapsed
+            else:
+                self._latency[node] = (self.decay * elapsed +
+                                       (1 - self.decay) * previous)
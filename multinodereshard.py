@@ -0,0 +1,372 @@
+import json
+import os
+import threading
+import time
+import redis
+from multinodeexceptions import MultiNodeRedisException
+from multinodemanager import NODE_NAME
+from multinoderouter import node_order
+
+
+def _address(node):
+    kwargs = node.connection_pool.connection_kwargs
+    return '%s:%s' % (kwargs.get('host'), kwargs.get('port'))
+
+
+class _MigratingRouter(object):
+    def __init__(self, resharder):
+        """
+            Stands in for the manager's router between begin() and finish().
+            Routes keys by the new router, moving a key off its old node
+            first if that node hasn't been migrated yet, once per key.
+            Writes must not land on the new node while the old one still
+            holds the key, so this is done for reads too rather than reading
+            the new node then the old one.  Indexes are into
+            resharder.combined: the old masters, in their old order, then
+            the added ones.
+        """
+        self.resharder = resharder
+        self.node_names = resharder.combined_names
+
+    def get_node_index(self, key):
+        return self.get_node_indexes([key])[0]
+
+    def get_node_indexes(self, keys):
+        resharder = self.resharder
+        indexes = resharder.router.get_node_indexes(keys)
+        if resharder.manager._masters is not resharder.combined:
+            # finish() has switched the tables over already
+            return indexes
+        if resharder._pending:
+            moving = {}
+            old_masters = resharder.old_masters
+            masters = resharder.masters
+            settled = resharder._settled
+            for key, old_index, index in zip(
+                    keys, resharder.old_router.get_node_indexes(keys),
+                    indexes):
+                if key in settled or key == NODE_NAME:
+                    continue
+                source = old_masters[old_index]
+                target = masters[index]
+                if source is not target and source in resharder._pending:
+                    moving.setdefault((source, target), []).append(key)
+            for (source, target), moving_keys in moving.iteritems():
+                resharder._migrate(source, target, moving_keys)
+                # gone from source now, whether moved or never there
+                settled.update(moving_keys)
+        positions = resharder.positions
+        return [positions[index] for index in indexes]
+
+
+class MultiNodeResharder(object):
+    def __init__(self, manager, master_servers, slave_servers=None,
+                 router=None, batch_size=500, keys_per_second=None,
+                 checkpoint_path=None, migrate_timeout=5000):
+        """
+            Move keys onto a new list of masters, e.g. to add a node, while
+            clients keep serving.  Get one from MultiNodeRedis.reshard(),
+            then call begin() in every client process, run() in one of them,
+            and finish() in every process once run() is done.
+
+            run() SCANs all the old masters at once, a thread each, and
+            MIGRATEs the keys whose owner changes to their new node in
+            batches.  MIGRATE moves a key atomically on the source node, so
+            it is never lost or left on both nodes.  Between begin() and
+            finish() a key whose owner changes is moved the first time it is
+            used, before the command is sent to the new owner, so reads find
+            it and writes never land on a node the migration then
+            overwrites.  Each process remembers the keys it has moved or
+            found missing until finish(), so it asks once per key.  Nodes
+            must reach each other at their configured addresses.
+            Args:
+                manager - the MultiNodeManager to reshard.
+                master_servers - the new master list, as for MultiNodeRedis.
+                                 A node keeping its name must keep its
+                                 address.
+                slave_servers - replicas of the added masters.
+                router - the new routing scheme, defaults to the current
+                         router's class.
+                batch_size - keys per SCAN page, and most keys per MIGRATE.
+                keys_per_second - SCAN rate limit per source node.
+                checkpoint_path - JSON file saving each source's SCAN cursor
+                                  after every batch.  run() resumes from it,
+                                  and finish() in other processes reads it.
+                migrate_timeout - milliseconds MIGRATE waits on the target.
+        """
+        self.manager = manager
+        self.batch_size = batch_size
+        self.keys_per_second = keys_per_second
+        self.checkpoint_path = checkpoint_path
+        self.migrate_timeout = migrate_timeout
+        decode_responses = manager.codec is None
+        masters = [manager._parse_config(entry, manager._connection_pool,
+                                         decode_responses)
+                   for entry in master_servers]
+        slaves = [manager._parse_config(entry, manager._connection_pool,
+                                        decode_responses)
+                  for entry in slave_servers or []]
+        masters, slaves = manager._discover_node_names([masters, slaves])
+        self.node_map = {}
+        for node_name, node in masters:
+            nodes = manager.node_map.get(node_name)
+            if nodes is None:
+                self.node_map[node_name] = [node]
+                continue
+            if _address(nodes[0]) != _address(node):
+                raise MultiNodeRedisException("node %s can't move from " %
+                    node_name + "%s to %s." % (_address(nodes[0]),
+                                               _address(node)))
+            self.node_map[node_name] = list(nodes)
+        for node_name, node in slaves:
+            if node_name in manager.node_map:
+                raise MultiNodeRedisException("slave with node_name: " +
+                    "%s belongs to a node that isn't added." % node_name)
+            if node_name not in self.node_map:
+                raise MultiNodeRedisException("slave with node_name: " +
+                    "%s has no corresponding master." % node_name)
+            self.node_map[node_name].append(node)
+        self.router = (router or manager._router_class)(
+            node_order(node_name for node_name, _ in masters))
+        self.masters = tuple(self.node_map[node_name][0]
+                             for node_name in self.router.node_names)
+        self.old_router = manager.router
+        self.old_masters = manager._masters
+        # Old masters first, in their old order, so the old router's
+        # indexes stay valid while the manager switches tables.
+        self.combined = self.old_masters + tuple(
+            node for node in self.masters if node not in self.old_masters)
+        names = dict(manager._node_names_by_node)
+        names.update((nodes[0], node_name)
+                     for node_name, nodes in self.node_map.iteritems())
+        self.combined_names = tuple(names[node] for node in self.combined)
+        self.positions = tuple(self.combined.index(node)
+                               for node in self.masters)
+        self._sources = dict((manager._node_names_by_node[node], node)
+                             for node in self.old_masters)
+        self._progress = dict((node_name, {'cursor': 0, 'done': False,
+                                           'scanned': 0, 'moved': 0})
+                              for node_name in self._sources)
+        self._load()
+        self._pending = set(node for node_name, node
+                            in self._sources.iteritems()
+                            if not self._progress[node_name]['done'])
+        # keys moved off their old node on use, or found missing there
+        self._settled = set()
+        self._lock = threading.Lock()
+        # node -> [MIGRATEs it is the source of, ... the target of]
+        self._migrating = dict((node, [0, 0]) for node in self.combined)
+        self._migrating_changed = threading.Condition(self._lock)
+        self._added = False
+        self._begun = False
+
+    def moves(self, keys):
+        """
+            The keys that change owner, as {(old node name, new node name):
+            [keys]}.
+        """
+        old_names = self.old_router.node_names
+        new_names = self.router.node_names
+        moves = {}
+        for key, old_index, index in zip(
+                keys, self.old_router.get_node_indexes(keys),
+                self.router.get_node_indexes(keys)):
+            if old_names[old_index] != new_names[index]:
+                moves.setdefault((old_names[old_index], new_names[index]),
+                                 []).append(key)
+        return moves
+
+    def begin(self):
+        """
+            Route every key by the new node list, moving keys that haven't
+            moved yet as they are used.  Safe to call more than once.
+        """
+        if self._begun:
+            return
+        manager = self.manager
+        self._add_nodes()
+        # _masters first: the old router's indexes are still valid in it
+        manager._masters = self.combined
+        manager._node_names = self.combined_names
+        manager.router = _MigratingRouter(self)
+        self._begun = True
+
+    def run(self):
+        """
+            Migrate every old master at once, returning when all are done.
+            Calls begin() first.
+        """
+        self.begin()
+        errors = []
+
+        def run_source(node_name, node):
+            try:
+                self._run_source(node_name, node)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run_source,
+                                    args=(node_name, node))
+                   for node_name, node in self._sources.iteritems()
+                   if node in self._pending]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def finish(self):
+        """
+            Switch the manager over to the new node list for good.  Raises
+            MultiNodeRedisException if some old master hasn't been migrated,
+            according to this process or the checkpoint.
+        """
+        self._load()
+        pending = sorted(node_name for node_name, progress
+                         in self._progress.iteritems()
+                         if not progress['done'])
+        if pending:
+            raise MultiNodeRedisException("nodes %s haven't been " %
+                                          ', '.join(pending) + "migrated.")
+        self._pending = set()
+        self._settled = set()
+        self._add_nodes()
+        self.manager._set_nodes(self.node_map, self.router)
+
+    def stats(self):
+        """
+            Migration progress per old master: SCAN cursor, whether it is
+            done, keys scanned and keys moved off it.
+        """
+        with self._lock:
+            return dict((node_name, dict(progress))
+                        for node_name, progress in self._progress.iteritems())
+
+    ## Start private functions
+
+    def _add_nodes(self):
+        """
+            Make the manager aware of the added nodes, without routing to
+            them yet.
+        """
+        if self._added:
+            return
+        manager = self.manager
+        added = [(node_name, nodes)
+                 for node_name, nodes in self.node_map.iteritems()
+                 if node_name not in manager.node_map]
+        for node_name, nodes in added:
+            manager._nodes_by_master[nodes[0]] = tuple(nodes)
+            for node in nodes:
+                manager._node_names_by_node[node] = node_name
+            manager.node_map[node_name] = nodes
+        for node_name, nodes in added:
+            for node in nodes:
+                manager._attach_node(node, node_name)
+        self._added = True
+
+    def _run_source(self, node_name, source):
+        progress = self._progress[node_name]
+        cursor = progress['cursor']
+        masters = self.masters
+        while True:
+            start = time.time()
+            cursor, keys = source.scan(cursor, count=self.batch_size)
+            moving = {}
+            for key, index in zip(keys, self.router.get_node_indexes(keys)):
+                # every node keeps its own node_name
+                if masters[index] is not source and key != NODE_NAME:
+                    moving.setdefault(masters[index], []).append(key)
+            for target, target_keys in moving.iteritems():
+                self._migrate(source, target, target_keys)
+            with self._lock:
+                progress['cursor'] = cursor
+                progress['scanned'] += len(keys)
+                progress['moved'] += sum(len(target_keys) for target_keys
+                                         in moving.itervalues())
+                progress['done'] = cursor == 0
+                self._save()
+            if cursor == 0:
+                break
+            if self.keys_per_second:
+                wait = (len(keys) / float(self.keys_per_second) -
+                        (time.time() - start))
+                if wait > 0:
+                    time.sleep(wait)
+        self._pending.discard(source)
+
+    def _migrate(self, source, target, keys):
+        """
+            MIGRATE keys from source to target.  A key target already has
+            was written there after the migration began, so the copy left on
+            source is stale and is deleted.
+        """
+        kwargs = target.connection_pool.connection_kwargs
+        args = ['MIGRATE', kwargs['host'], kwargs['port'], '',
+                kwargs.get('db', 0), self.migrate_timeout]
+        if kwargs.get('password'):
+            args.extend(['AUTH', kwargs['password']])
+        self._start_migrate(source, target)
+        try:
+            source.execute_command(*(args + ['KEYS'] + list(keys)))
+            return
+        except redis.ResponseError as e:
+            if 'BUSYKEY' not in str(e):
+                raise
+        finally:
+            self._end_migrate(source, target)
+        if len(keys) == 1:
+            source.delete(keys[0])
+            return
+        # Keys restored before the error are gone from source already; find
+        # out which of the rest were busy one at a time.
+        for key in keys:
+            self._migrate(source, target, [key])
+
+    def _start_migrate(self, source, target):
+        """
+            Wait until neither node is busy the other way round.  MIGRATE
+            blocks the source until the target answers, so two nodes
+            migrating to each other would wait on one another until both
+            time out.
+        """
+        with self._migrating_changed:
+            while (self._migrating[source][1] or
+                   self._migrating[target][0]):
+                self._migrating_changed.wait()
+            self._migrating[source][0] += 1
+            self._migrating[target][1] += 1
+
+    def _end_migrate(self, source, target):
+        with self._migrating_changed:
+            self._migrating[source][0] -= 1
+            self._migrating[target][1] -= 1
+            self._migrating_changed.notify_all()
+
+    def _load(self):
+        if self.checkpoint_path is None or \
+                not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if sorted(checkpoint['node_names']) != sorted(self.node_map):
+            raise MultiNodeRedisException("checkpoint %s is for nodes " %
+                self.checkpoint_path + "%s." %
+                ', '.join(checkpoint['node_names']))
+        for node_name, progress in checkpoint['sources'].iteritems():
+            if node_name in self._progress:
+                self._progress[node_name].update(progress)
+
+    def _save(self):
+        """
+            Write the checkpoint to a temporary file and rename it over the
+            old one, so a crash never leaves a partial checkpoint.
+        """
+        if self.checkpoint_path is None:
+            return
+        path = self.checkpoint_path + '.tmp'
+        with open(path, 'w') as f:
+            json.dump({'node_names': sorted(self.node_map),
+                       'sources': self._progress}, f)
+        os.rename(path, self.checkpoint_path)
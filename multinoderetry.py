@@ -0,0 +1,58 @@
+import random
+import redis
+from multinodeexceptions import (MultiNodeCircuitOpenException,
+                                 MultiNodeTimeoutException)
+
+# Replaying these after a failure that may have happened once the node had
+# already applied them would apply them twice.
+NON_IDEMPOTENT_COMMANDS = frozenset([
+    'APPEND', 'DECR', 'DECRBY', 'EVAL', 'EVALSHA', 'HINCRBY', 'HINCRBYFLOAT',
+    'INCR', 'INCRBY', 'INCRBYFLOAT', 'LINSERT', 'LPOP', 'LPUSH', 'LPUSHX',
+    'RPOP', 'RPOPLPUSH', 'RPUSH', 'RPUSHX', 'SPOP', 'ZINCRBY', 'XADD'])
+
+
+class MultiNodeRetryPolicy(object):
+    def __init__(self, max_retries=3, backoff=0.05, max_backoff=1.0,
+                 non_idempotent_commands=NON_IDEMPOTENT_COMMANDS):
+        """
+            When and how often MultiNodePipeline resends a node's
+            sub-pipeline after it failed as a whole, e.g.
+            pipeline(retry_policy=MultiNodeRetryPolicy()).  Only the failed
+            nodes' commands are resent.  Connection errors and timeouts are
+            retried, but a sub-pipeline holding a non-idempotent command is
+            only resent if it never reached the node (its circuit was open).
+            Args:
+                max_retries - resends per node per execute().
+                backoff - seconds before the first resend, doubling (with
+                          jitter) after each one.
+                max_backoff - cap on the wait between resends.
+                non_idempotent_commands - command names never replayed.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.non_idempotent_commands = frozenset(
+            command.upper() for command in non_idempotent_commands)
+
+    def delay(self, attempt):
+        """
+            Seconds to wait before resend number attempt (from 0).
+        """
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return delay / 2 + random.random() * delay / 2
+
+    def should_retry(self, error, attempt, command_stack):
+        """
+            True if a sub-pipeline of command_stack that failed with error
+            should be resent.
+        """
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, MultiNodeCircuitOpenException):
+            return True
+        if not isinstance(error, (redis.ConnectionError, redis.TimeoutError,
+                                  MultiNodeTimeoutException)):
+            return False
+        non_idempotent = self.non_idempotent_commands
+        return not any(str(args[0]).upper() in non_idempotent
+                       for args, options in command_stack)
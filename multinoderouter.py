@@ -0,0 +1,232 @@
+import array
+import bisect
+import hashlib
+import struct
+import sys
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+# Below this many keys the numpy round trip costs more than it saves.
+VECTORIZE_THRESHOLD = 64
+
+
+def _key_bytes(key):
+    """
+        Get the bytes that are hashed for key.  Byte strings are used as is,
+        text is utf-8 encoded, and anything else is converted to text first,
+        which is what redis-py sends for it.
+    """
+    if isinstance(key, bytes):
+        return key
+    if not isinstance(key, text_type):
+        key = text_type(key)
+    return key.encode('utf-8')
+
+
+if zlib.crc32(b'\xff') < 0:
+    _crc32 = zlib.crc32
+else:
+    def _crc32(data):
+        """
+            crc32 as a signed 32-bit int, which is what Python 2 returns.  The
+            modulo routing depends on the sign, so Python 3 has to match it.
+        """
+        crc = zlib.crc32(data)
+        if crc > 0x7fffffff:
+            crc -= 0x100000000
+        return crc
+
+
+def _python2_hash(data):
+    """
+        hash() of a str on 64-bit Python 2 without hash randomization, its
+        default.
+    """
+    if not data:
+        return 0
+    data = bytearray(data)
+    x = data[0] << 7
+    for byte in data:
+        x = ((1000003 * x) & 0xffffffffffffffff) ^ byte
+    x ^= len(data)
+    if x >= 0x8000000000000000:
+        x -= 0x10000000000000000
+    return -2 if x == -1 else x
+
+
+def _python2_dict_order(keys):
+    """
+        The order a Python 2 dict lists keys in after they were inserted one
+        at a time into an empty dict, replaying its open addressing and
+        resizing.
+    """
+    table = [None] * 8
+    used = 0
+
+    def insert(table, key, key_hash):
+        mask = len(table) - 1
+        i = key_hash & 0xffffffffffffffff
+        perturb = i
+        while table[i & mask] is not None:
+            i = ((i << 2) + i + perturb + 1) & 0xffffffffffffffff
+            perturb >>= 5
+        table[i & mask] = (key, key_hash)
+    for key in keys:
+        if any(entry is not None and entry[0] == key for entry in table):
+            continue
+        insert(table, key, _python2_hash(_key_bytes(key)))
+        used += 1
+        if used * 3 >= len(table) * 2:
+            size = 8
+            while size <= (2 if used > 50000 else 4) * used:
+                size <<= 1
+            entries = [entry for entry in table if entry is not None]
+            table = [None] * size
+            for entry in entries:
+                insert(table, entry[0], entry[1])
+    return [entry[0] for entry in table if entry is not None]
+
+
+def node_order(node_names):
+    """
+        node_names in the order MultiNodeManager gives them to its router:
+        that of its node map, a dict, which on Python 2 follows the names'
+        hashes rather than the config.  ModuloRouter's modulo depends on it,
+        so Python 3 code routing the same keys (the asyncio client, tools)
+        replays Python 2's order here.
+    """
+    if sys.version_info[0] < 3:
+        order = {}
+        for node_name in node_names:
+            order[node_name] = None
+        return order.keys()
+    return _python2_dict_order(node_names)
+
+
+def _hash_tag_bytes(key):
+    """
+        Like _key_bytes, but if the key contains a Redis Cluster style hash
+        tag, e.g. {user1}:profile, only the part between the first { and the
+        next } is hashed.  Keys sharing a tag always land on the same node.
+    """
+    key = _key_bytes(key)
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def _find_hash_tag(key):
+    """
+        The hash tag of key, as bytes, or None if it has none.
+    """
+    key = _key_bytes(key)
+    tag = _hash_tag_bytes(key)
+    # a tag leaves out at least its braces
+    if len(tag) < len(key):
+        return tag
+    return None
+
+
+class ModuloRouter(object):
+    def __init__(self, node_names, hash_tags=False):
+        """
+            The original routing scheme: crc32 of the key modulo the node
+            count.  Adding or removing a node remaps almost every key, so this
+            is kept for data written by earlier versions.
+            Args:
+                node_names - node names, in the order used for the modulo.
+                hash_tags - only hash the {tag} part of keys.  Off by default
+                            so existing keys containing braces don't move.
+        """
+        self.node_names = tuple(node_names)
+        self.hash_tags = hash_tags
+        self._key_bytes = _hash_tag_bytes if hash_tags else _key_bytes
+
+    def get_node_index(self, key):
+        return _crc32(self._key_bytes(key)) % len(self.node_names)
+
+    def get_node_indexes(self, keys):
+        # crc32 has to run per key anyway, so numpy only adds a round trip
+        key_bytes = self._key_bytes
+        count = len(self.node_names)
+        return [_crc32(key_bytes(key)) % count for key in keys]
+
+    def get_node_name(self, key):
+        return self.node_names[self.get_node_index(key)]
+
+
+class KetamaRouter(object):
+    # Each md5 digest yields four 32-bit points on the ring.
+    POINTS_PER_HASH = 4
+
+    def __init__(self, node_names, weights=None, replicas=160,
+                 hash_tags=True):
+        """
+            Ketama-style consistent-hash ring.  Every node is placed on the
+            ring replicas * weight times, and a key belongs to the first point
+            clockwise from its own hash.  Adding a node only moves about 1/N of
+            the keys.  The ring is built once into a sorted array and searched
+            with bisect.
+            Args:
+                node_names - node names; their order does not matter.
+                weights - optional {node_name: weight}, defaults to 1 each.
+                replicas - virtual nodes per unit of weight.
+                hash_tags - only hash the {tag} part of keys.
+        """
+        self.node_names = tuple(sorted(node_names))
+        self.hash_tags = hash_tags
+        self._key_bytes = _hash_tag_bytes if hash_tags else _key_bytes
+        weights = weights or {}
+        points = []
+        for index, node_name in enumerate(self.node_names):
+            weight = weights.get(node_name, 1)
+            hashes = max(1, int(replicas * weight) // self.POINTS_PER_HASH)
+            for i in range(hashes):
+                vnode = ('%s-%d' % (node_name, i)).encode('utf-8')
+                digest = hashlib.md5(vnode).digest()
+                for j in range(self.POINTS_PER_HASH):
+                    point = struct.unpack_from('<I', digest, j * 4)[0]
+                    points.append((point, index))
+        points.sort()
+        self._points = array.array('I', [point for point, _ in points])
+        self._point_indexes = tuple(index for _, index in points)
+        if numpy is not None:
+            self._np_points = numpy.array(self._points, dtype=numpy.uint32)
+            self._np_point_indexes = numpy.array(self._point_indexes + (0,),
+                                                 dtype=numpy.int32)
+            # a hash past the last point wraps around to the first one
+            self._np_point_indexes[-1] = self._point_indexes[0]
+
+    def get_node_index(self, key):
+        digest = hashlib.md5(self._key_bytes(key)).digest()
+        point = struct.unpack_from('<I', digest)[0]
+        index = bisect.bisect(self._points, point)
+        if index == len(self._points):
+            index = 0
+        return self._point_indexes[index]
+
+    def get_node_indexes(self, keys):
+        if numpy is None or len(keys) < VECTORIZE_THRESHOLD:
+            return [self.get_node_index(key) for key in keys]
+        md5 = hashlib.md5
+        key_bytes = self._key_bytes
+        prefixes = b''.join([md5(key_bytes(key)).digest()[:4]
+                             for key in keys])
+        hashes = numpy.frombuffer(prefixes, dtype='<u4')
+        positions = numpy.searchsorted(self._np_points, hashes, side='right')
+        return self._np_point_indexes[positions].tolist()
+
+    def get_node_name(self, key):
+        return self.node_names[self.get_node_index(key)]
@@ -0,0 +1,82 @@
+import functools
+import hashlib
+import threading
+from redis.exceptions import NoScriptError
+from multinodeexceptions import MultiNodeRedisException
+
+
+class MultiNodeScript(object):
+    def __init__(self, manager, script):
+        """
+            A Lua script run on the node that owns its keys.  The first call
+            on a node sends the body with EVAL, which also caches it there;
+            later calls use EVALSHA, and on NOSCRIPT (the node restarted or
+            ran SCRIPT FLUSH) load the script and try again.  Every key must
+            live on the same node, e.g. by sharing a hash tag.  Get one from
+            MultiNodeRedis.register_script().
+        """
+        self.manager = manager
+        self.script = script
+        if isinstance(script, unicode):
+            script = script.encode('utf-8')
+        self.sha = hashlib.sha1(script).hexdigest()
+        # nodes known to have the script cached
+        self._loaded = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, keys=(), args=(), client=None):
+        """
+            Run the script with keys and args.  Pass a MultiNodePipeline as
+            client to queue it there instead.
+        """
+        keys = list(keys)
+        args = list(args)
+        if client is not None:
+            return client._queue_script(self, keys, args)
+        node = self._get_node(keys)
+        if node not in self._loaded:
+            result = node.eval(self.script, len(keys), *(keys + args))
+            self.loaded(node)
+        else:
+            try:
+                result = node.evalsha(self.sha, len(keys), *(keys + args))
+            except NoScriptError:
+                self.forget(node)
+                self.load(node)
+                result = node.evalsha(self.sha, len(keys), *(keys + args))
+        for key in keys:
+            self.manager._invalidate(key)
+        return result
+
+    def is_loaded(self, node):
+        return node in self._loaded
+
+    def load(self, node):
+        node.script_load(self.script)
+        with self._lock:
+            self._loaded.add(node)
+
+    def loaded(self, node):
+        with self._lock:
+            self._loaded.add(node)
+
+    def forget(self, node):
+        with self._lock:
+            self._loaded.discard(node)
+
+    def preload(self, timeout=None):
+        """
+            SCRIPT LOAD on every master at once, so no call pays for it.
+        """
+        self.manager._execute_concurrently(
+            [functools.partial(self.load, node)
+             for node in self.manager._get_all_nodes()], timeout=timeout)
+
+    def _get_node(self, keys):
+        if not keys:
+            raise MultiNodeRedisException("a script needs at least one key " +
+                "to route on.")
+        if len(keys) > 1 and len(self.manager._group_by_node(keys)) > 1:
+            raise MultiNodeRedisException("keys of a script must live on " +
+                "one node, got %r." % (keys,))
+        return self.manager._get_node(keys[0])
@@ -0,0 +1,241 @@
+import itertools
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import redis
+from multinodeexceptions import MultiNodeRedisException
+from multinodemanager import NODE_NAME
+
+# A snapshot file is MAGIC, then one record per key: _RECORD, the key and
+# its DUMP payload, then _TRAILER.
+MAGIC = b'MNSNAP\x00\x01'
+# key length, payload length, expiry in ms since the epoch (0 for none)
+_RECORD = struct.Struct('>IIq')
+# record count
+_TRAILER = struct.Struct('>Q')
+MANIFEST = 'manifest.json'
+# DUMP and PTTL of every key in one call, which is about twice as fast as
+# pipelining both commands per key, as redis-py packs and parses far less.
+_DUMP_SCRIPT = """
+local replies = {}
+for i, key in ipairs(KEYS) do
+    replies[2 * i - 1] = redis.call('DUMP', key)
+    replies[2 * i] = redis.call('PTTL', key)
+end
+return replies
+"""
+
+
+def read_snapshot(path):
+    """
+        Yield (key, payload, expire_at_ms) from one snapshot file, memory
+        mapped rather than read into memory.  Raises
+        MultiNodeRedisException if the file is truncated or not a snapshot.
+    """
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        end = len(data) - _TRAILER.size
+        if end < len(MAGIC) or data[:len(MAGIC)] != MAGIC:
+            raise MultiNodeRedisException("%s is not a snapshot." % path)
+        count, = _TRAILER.unpack_from(data, end)
+        offset = len(MAGIC)
+        unpack_from = _RECORD.unpack_from
+        header_size = _RECORD.size
+        for _ in xrange(count):
+            if offset + header_size > end:
+                break
+            key_length, payload_length, expire_at = unpack_from(data, offset)
+            offset += header_size
+            if offset + key_length + payload_length > end:
+                break
+            key = data[offset:offset + key_length]
+            offset += key_length
+            payload = data[offset:offset + payload_length]
+            offset += payload_length
+            yield key, payload, expire_at
+        if offset != end:
+            raise MultiNodeRedisException("snapshot %s is truncated." %
+                                          path)
+    finally:
+        data.close()
+
+
+def _raw_client(node):
+    """
+        A client for node that returns bytes, as DUMP payloads aren't text.
+    """
+    kwargs = dict(node.connection_pool.connection_kwargs)
+    kwargs.pop('tracking_listener', None)
+    kwargs['decode_responses'] = False
+    return redis.StrictRedis(connection_pool=redis.ConnectionPool(**kwargs))
+
+
+def _run_threads(calls):
+    """
+        Run each call in a thread of its own and return their results, for
+        jobs too long to hold the manager's executor.
+    """
+    results = [None] * len(calls)
+    errors = []
+
+    def run(i, call):
+        try:
+            results[i] = call()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(i, call))
+               for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+class MultiNodeSnapshot(object):
+    def __init__(self, manager, batch_size=1000):
+        """
+            Export every master's keys to a directory of snapshot files, one
+            per master, and restore them into any set of nodes.  Keys are
+            DUMPed with their PTTL batch_size keys at a time, by a Lua
+            script, all masters at once, and written as length-prefixed
+            records.  Restore memory maps the files, routes each batch of
+            keys through the manager's router and RESTOREs them, all files at
+            once, so the target may have a different node count.  Expiries
+            are saved as absolute times; keys that expired in between aren't
+            restored.  The node_name key isn't exported.  Get one from
+            MultiNodeRedis.snapshot().
+        """
+        self.manager = manager
+        self.batch_size = batch_size
+        self._raw_clients = {}
+        self._lock = threading.Lock()
+
+    def export(self, directory, match=None):
+        """
+            Write a snapshot of every master to directory, which is created
+            if needed.  Returns {node_name: {'path', 'keys', 'bytes'}}.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        nodes = self.manager._get_all_nodes()
+        node_names = [self.manager._node_names_by_node[node]
+                      for node in nodes]
+        results = _run_threads(
+            [lambda node=node, node_name=node_name: self._export_node(
+                node, os.path.join(directory, '%s.snap' % node_name), match)
+             for node, node_name in zip(nodes, node_names)])
+        shards = dict((node_name, result)
+                      for node_name, result in zip(node_names, results))
+        manifest = {'created': time.time(),
+                    'shards': dict((node_name, {
+                        'file': os.path.basename(shard['path']),
+                        'keys': shard['keys']})
+                        for node_name, shard in shards.iteritems())}
+        with open(os.path.join(directory, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        return shards
+
+    def restore(self, directory, replace=False):
+        """
+            RESTORE every key of the snapshot in directory into the nodes
+            that own it now.  A key that already exists is skipped unless
+            replace is set.  Returns {'keys', 'skipped', 'expired',
+            'seconds'}.
+        """
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        start = time.time()
+        results = _run_threads(
+            [lambda path=os.path.join(directory, shard['file']):
+             self._restore_file(path, replace)
+             for shard in manifest['shards'].itervalues()])
+        return {'keys': sum(result[0] for result in results),
+                'skipped': sum(result[1] for result in results),
+                'expired': sum(result[2] for result in results),
+                'seconds': time.time() - start}
+
+    ## Start private functions
+
+    def _raw_client(self, node):
+        with self._lock:
+            client = self._raw_clients.get(node)
+            if client is None:
+                client = self._raw_clients[node] = _raw_client(node)
+            return client
+
+    def _export_node(self, node, path, match):
+        client = self._raw_client(node)
+        dump = client.register_script(_DUMP_SCRIPT)
+        keys = client.scan_iter(match=match, count=self.batch_size)
+        count = 0
+        size = 0
+        partial = path + '.tmp'
+        with open(partial, 'wb') as f:
+            f.write(MAGIC)
+            while True:
+                batch = list(itertools.islice(keys, self.batch_size))
+                if not batch:
+                    break
+                batch = [key for key in batch if key != NODE_NAME]
+                if not batch:
+                    continue
+                replies = dump(keys=batch)
+                now = int(time.time() * 1000)
+                for i, key in enumerate(batch):
+                    payload = replies[2 * i]
+                    pttl = replies[2 * i + 1]
+                    # gone since the SCAN
+                    if payload is None or pttl == -2:
+                        continue
+                    expire_at = now + pttl if pttl >= 0 else 0
+                    f.write(_RECORD.pack(len(key), len(payload), expire_at))
+                    f.write(key)
+                    f.write(payload)
+                    count += 1
+                    size += len(payload)
+            f.write(_TRAILER.pack(count))
+        os.rename(partial, path)
+        return {'path': path, 'keys': count, 'bytes': size}
+
+    def _restore_file(self, path, replace):
+        """
+            Returns (keys restored, keys skipped, keys expired).
+        """
+        restored = skipped = expired = 0
+        records = read_snapshot(path)
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if not batch:
+                return restored, skipped, expired
+            now = int(time.time() * 1000)
+            live = []
+            for key, payload, expire_at in batch:
+                if expire_at and expire_at <= now:
+                    expired += 1
+                else:
+                    live.append((key, payload,
+                                 expire_at - now if expire_at else 0))
+            for node, positions in self.manager._group_by_node(
+                    [record[0] for record in live]):
+                pipeline = self._raw_client(node).pipeline(
+                    transaction=False)
+                for position in positions:
+                    key, payload, ttl = live[position]
+                    pipeline.restore(key, ttl, payload, replace=replace)
+                for reply in pipeline.execute(raise_on_error=False):
+                    if not isinstance(reply, Exception):
+                        restored += 1
+                    elif 'BUSYKEY' in str(reply):
+                        skipped += 1
+                    else:
+                        raise reply
+                for position in positions:
+                    self.manager._invalidate(live[position][0])
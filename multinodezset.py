@@ -0,0 +1,262 @@
+"""
+    Sorted-set queries over many keys, whichever nodes they live on.  Each
+    key is read a bounded page at a time, every key's page at once, and the
+    pages are merged with a heap, so only about K members are held for a
+    top-K query however big the sets are.
+"""
+import heapq
+import redis
+from multinodeexceptions import MultiNodeRedisException
+
+_AGGREGATES = {'SUM': sum, 'MIN': min, 'MAX': max}
+
+
+def _bound(aggregate, known, caps, desc):
+    """
+        The best total a member can have, given its scores known so far and
+        a cap on its score in each other set that may hold it (the last
+        score read from that set, which is read best first).  A member
+        missing from a set contributes nothing to its SUM.
+    """
+    best = max if desc else min
+    if aggregate == 'SUM':
+        return sum(known) + sum(best(cap, 0) for cap in caps)
+    if known and aggregate == ('MIN' if desc else 'MAX'):
+        # the worst of its scores is no better than any one of them
+        return (min if desc else max)(known)
+    return best(known + caps)
+
+
+class _Reversed(object):
+    """
+        Orders member the other way round, to break ties in descending
+        order the way ZREVRANGE does.
+    """
+    __slots__ = ('member',)
+
+    def __init__(self, member):
+        self.member = member
+
+    def __lt__(self, other):
+        return other.member < self.member
+
+    def __eq__(self, other):
+        return self.member == other.member
+
+
+def _order(score, member, desc):
+    """
+        Heap order of a member, best first.
+    """
+    if desc:
+        return -score, _Reversed(member)
+    return score, member
+
+
+def _unique(keys):
+    seen = set()
+    return [key for key in keys if not (key in seen or seen.add(key))]
+
+
+def _fetch_pages(manager, keys, offsets, size, desc):
+    """
+        The next page of size members, with scores, of each key from its
+        offset, every node at once.
+    """
+    offsets = dict(zip(keys, offsets))
+
+    def fetch(node, node_keys):
+        pipeline = node.pipeline(transaction=False)
+        for key in node_keys:
+            start = offsets[key]
+            if desc:
+                pipeline.zrevrange(key, start, start + size - 1,
+                                   withscores=True)
+            else:
+                pipeline.zrange(key, start, start + size - 1,
+                                withscores=True)
+        return pipeline.execute()
+    return manager._scatter_gather_ordered(keys, fetch)
+
+
+def _fetch_scores(manager, keys, members):
+    """
+        The score of each of members in each key, None if it's missing, as
+        one list per key.  One ZMSCORE per key, or a ZSCORE per member on
+        servers older than 6.2.
+    """
+    def fetch(node, node_keys):
+        pipeline = node.pipeline(transaction=False)
+        for key in node_keys:
+            pipeline.execute_command('ZMSCORE', key, *members)
+        try:
+            replies = pipeline.execute()
+        except redis.ResponseError as e:
+            if 'unknown command' not in str(e).lower():
+                raise
+            pipeline = node.pipeline(transaction=False)
+            for key in node_keys:
+                for member in members:
+                    pipeline.zscore(key, member)
+            scores = pipeline.execute()
+            count = len(members)
+            return [scores[i * count:(i + 1) * count]
+                    for i in xrange(len(node_keys))]
+        return [[float(score) if score is not None else None
+                 for score in reply] for reply in replies]
+    return manager._scatter_gather_ordered(keys, fetch)
+
+
+def _check_range(start, end):
+    # Counting back from the end needs every set's size, or for a union
+    # reading every set whole, so only end -1 is supported.
+    if start < 0 or end < -1:
+        raise MultiNodeRedisException("start must be 0 or more and end -1 "
+                                      "or more, not %s and %s." % (start, end))
+
+
+def _page_size(page_size, end):
+    if end < 0:
+        return page_size
+    return max(1, min(page_size, end + 1))
+
+
+def merge_range(manager, keys, start, end, desc=False, page_size=100):
+    """
+        Members of all the sorted sets at keys, in one score order, from
+        rank start to end inclusive (end -1 for all, other negative
+        indexes raise MultiNodeRedisException).  A member of several sets
+        appears once per set.  Returns [(member, score)].
+    """
+    _check_range(start, end)
+    keys = _unique(keys)
+    size = _page_size(page_size, end)
+    pages = _fetch_pages(manager, keys, [0] * len(keys), size, desc)
+    offsets = [len(page) for page in pages]
+    positions = [0] * len(keys)
+    heap = [_order(page[0][1], page[0][0], desc) + (i,)
+            for i, page in enumerate(pages) if page]
+    heapq.heapify(heap)
+    output = []
+    rank = 0
+    while heap:
+        i = heapq.heappop(heap)[-1]
+        page = pages[i]
+        if rank >= start:
+            output.append(page[positions[i]])
+        rank += 1
+        if rank == end + 1:
+            break
+        positions[i] += 1
+        if positions[i] == len(page):
+            if len(page) < size:
+                continue
+            # only this key ran dry, so fetch just its next page
+            page = pages[i] = _fetch_pages(manager, [keys[i]], [offsets[i]],
+                                           size, desc)[0]
+            offsets[i] += len(page)
+            positions[i] = 0
+            if not page:
+                continue
+        member, score = page[positions[i]]
+        heapq.heappush(heap, _order(score, member, desc) + (i,))
+    return output
+
+
+def union_range(manager, keys, start, end, desc=False, aggregate='SUM',
+                page_size=100):
+    """
+        Like ZUNIONSTORE with aggregate followed by ZRANGE (or ZREVRANGE if
+        desc) from start to end inclusive, without storing the union.
+        Returns [(member, aggregated score)].
+
+        Uses the threshold algorithm: every key is read best first a page
+        at a time, every key at once, each member read is scored in every
+        key with ZMSCORE, and reading stops once no member not read yet can
+        reach the K-th best total.  Members that can't make the top K on the
+        scores read so far aren't scored.  Only the best end + 1 members
+        are kept.  end -1 reads every set whole; other negative indexes
+        raise MultiNodeRedisException.
+    """
+    _check_range(start, end)
+    aggregate = aggregate.upper()
+    if aggregate not in _AGGREGATES:
+        raise MultiNodeRedisException("aggregate must be SUM, MIN or MAX, "
+                                      "not %s." % aggregate)
+    combine = _AGGREGATES[aggregate]
+    keys = _unique(keys)
+    # the threshold usually needs reading well past the top K of each key,
+    # so pages aren't cut down to K here
+    size = page_size
+    count = end + 1 if end >= 0 else None
+    offsets = [0] * len(keys)
+    last_scores = [None] * len(keys)
+    exhausted = [False] * len(keys)
+    # (worst first order, member, total) of the best count members
+    best = []
+    kept = set()
+
+    def beats(total, other):
+        return total > other if desc else total < other
+    while True:
+        active = [i for i in xrange(len(keys)) if not exhausted[i]]
+        if not active:
+            break
+        pages = _fetch_pages(manager, [keys[i] for i in active],
+                             [offsets[i] for i in active], size, desc)
+        # scores read this round of each member not kept, by key index
+        read = {}
+        for i, page in zip(active, pages):
+            offsets[i] += len(page)
+            if len(page) < size:
+                exhausted[i] = True
+            if page:
+                last_scores[i] = page[-1][1]
+            for member, score in page:
+                if member not in kept:
+                    read.setdefault(member, {})[i] = score
+        new_members = read.keys()
+        if count is not None and len(best) == count:
+            # a member read in an earlier round and not kept is out of the
+            # top K already; otherwise its score in a key it wasn't read
+            # from is at most the last score read there
+            worst = best[0][2]
+            remaining = [i for i in xrange(len(keys)) if not exhausted[i]]
+            new_members = [
+                member for member in new_members if not beats(
+                    worst, _bound(aggregate, read[member].values(),
+                                  [last_scores[i] for i in remaining
+                                   if i not in read[member]], desc))]
+        if new_members:
+            scores = _fetch_scores(manager, keys, new_members)
+            for j, member in enumerate(new_members):
+                member_scores = [key_scores[j] for key_scores in scores
+                                 if key_scores[j] is not None]
+                if not member_scores:
+                    # removed since it was read
+                    continue
+                total = combine(member_scores)
+                # worst first, so the heap's top is the one to drop
+                entry = _order(total, member, not desc) + (total,)
+                if count is None or len(best) < count:
+                    heapq.heappush(best, entry)
+                    kept.add(member)
+                elif best[0] < entry:
+                    kept.discard(_member(heapq.heapreplace(best, entry)))
+                    kept.add(member)
+        if count is not None and len(best) == count:
+            caps = [last_scores[i] for i in xrange(len(keys))
+                    if not exhausted[i]]
+            # a member not read yet whose total ties the K-th best can
+            # still beat it on member order, so stop only when it can't
+            # reach it at all
+            if not caps or beats(best[0][2],
+                                 _bound(aggregate, [], caps, desc)):
+                break
+    ranked = sorted(best, reverse=True)
+    return [(_member(entry), entry[2]) for entry in ranked[start:]]
+
+
+def _member(entry):
+    member = entry[1]
+    return member.member if isinstance(member, _Reversed) else member
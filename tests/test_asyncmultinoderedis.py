@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+from unittest import TestCase
+import pytest
+
+PY3 = sys.version_info[0] >= 3
+
+if PY3:
+    asyncio = pytest.importorskip('asyncio')
+    pytest.importorskip('redis.asyncio')
+    from asyncmultinoderedis import AsyncMultiNodeRedis
+    from multinodeexceptions import (MultiNodeRedisException,
+                                     MultiNodeTimeoutException)
+
+
+@pytest.mark.skipif(PY3, reason='already running under Python 3')
+class TestAsyncUnderPython3(TestCase):
+    def test_python3(self):
+        """
+            Run this file under Python 3, so a Python 2 only change to a
+            module the asyncio client imports fails the Python 2 suite too.
+            Set PYTHON3 to pick the interpreter.
+        """
+        from distutils.spawn import find_executable
+        python3 = os.environ.get('PYTHON3') or find_executable('python3')
+        if python3 is None:
+            pytest.skip('no python3 found, set PYTHON3.')
+        if subprocess.call([python3, '-c', 'import redis.asyncio']) != 0:
+            pytest.skip('%s has no redis.asyncio.' % python3)
+        path = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        process = subprocess.Popen(
+            [python3, '-m', 'pytest', '-q', '-p', 'no:cacheprovider', path],
+            cwd=os.path.dirname(os.path.dirname(path)),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        assert process.returncode == 0, output
+
+
+@pytest.mark.skipif(not PY3, reason='needs Python 3')
+class TestAsyncMultiNodeRedis(TestCase):
+    """
+        These run on Python 3 only, and from the Python 2 suite through
+        TestAsyncUnderPython3.  Coroutines are driven with
+        run_until_complete so this file still imports under Python 2.
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        self.rc = AsyncMultiNodeRedis(master_servers)
+
+    def tearDown(self):
+        self._run(self.rc.flushall())
+        self._run(self.rc.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def _run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_get_and_set(self):
+        assert self._run(self.rc.get('a')) is None
+        assert self._run(self.rc.set('a', 'b'))
+        assert self._run(self.rc.get('a')) == 'b'
+        assert self._run(self.rc.delete('a')) == 1
+
+    def test_hashes_and_sorted_sets(self):
+        assert self._run(self.rc.hmset('h', {'a': 1, 'b': 2}))
+        assert self._run(self.rc.hget('h', 'a')) == '1'
+        assert self._run(self.rc.hincrby('h', 'a', amount=2)) == 3
+        assert self._run(self.rc.hgetall('h')) == {'a': '3', 'b': '2'}
+        self._run(self.rc.zadd('z', {'z1': 1, 'z2': 4}))
+        assert self._run(self.rc.zincrby('z', 'z1')) == 2.0
+        assert self._run(self.rc.zrange('z', 0, 5, withscores=True)) == \
+            [('z1', 2.0), ('z2', 4.0)]
+
+    def test_mget_and_mset(self):
+        mapping = dict(('key%d' % i, str(i)) for i in range(100))
+        assert self._run(self.rc.mset(mapping))
+        keys = ['key%d' % i for i in reversed(range(100))] + ['missing']
+        assert self._run(self.rc.mget(keys)) == \
+            [mapping.get(key) for key in keys]
+
+    def test_pipeline(self):
+        pipe = self.rc.pipeline()
+        pipe.set('a', 'a1').get('a').zadd('z', {'z1': 1}).incr('b')
+        pipe.zrange('z', 0, 5, withscores=True)
+        assert self._run(pipe.execute()) == \
+            [True, 'a1', 1, 1, [('z1', 1.0)]]
+
+    def test_pipeline_reuse(self):
+        pipe = self.rc.pipeline(transaction=False)
+        for i in range(6):
+            pipe.set('key%d' % i, i)
+        assert self._run(pipe.execute()) == [True] * 6
+        assert len(pipe) == 0
+        pipe.get('key1').get('key4')
+        assert self._run(pipe.execute()) == ['1', '4']
+
+    def test_single_node_pipeline_timeout(self):
+        pipe = self.rc.pipeline(timeout=0.05)
+        pipe.get('a')
+        # a node that takes longer than the timeout; no async def, so this
+        # file still imports under Python 2
+        pipeline = list(pipe.pipeline_map.values())[0]
+        pipeline.execute = lambda: asyncio.sleep(0.2)
+        with pytest.raises(MultiNodeTimeoutException):
+            self._run(pipe.execute())
+
+    def test_concurrent_requests(self):
+        count = 500
+        self._run(asyncio.gather(*[self.rc.set('key%d' % i, i)
+                                   for i in range(count)]))
+        values = self._run(asyncio.gather(*[self.rc.get('key%d' % i)
+                                            for i in range(count)]))
+        assert values == [str(i) for i in range(count)]
+
+    def test_node_order_matches_sync_client(self):
+        rc = AsyncMultiNodeRedis(['node%d|127.0.0.1:6379' % i
+                                  for i in range(1, 9)])
+        # MultiNodeRedis' order for these, see test_router.TestNodeOrder
+        assert rc.router.node_names == ('node8', 'node1', 'node3', 'node2',
+                                        'node5', 'node4', 'node7', 'node6')
+        self._run(rc.close())
+
+    def test_unnamed_nodes_need_initialize(self):
+        rc = AsyncMultiNodeRedis(['127.0.0.1:6379'])
+        with pytest.raises(MultiNodeRedisException):
+            rc._get_node('a')
+        self._run(rc.close())
@@ -0,0 +1,48 @@
+import threading
+from unittest import TestCase
+import redis
+from multinodeautopipeline import MultiNodeAutoPipeline
+from multinoderedis import MultiNodeRedis
+from redis._compat import b
+
+
+class TestAutoPipeline(TestCase):
+    def setUp(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        self.auto_pipeline = MultiNodeAutoPipeline(window=0.001)
+        self.rc = MultiNodeRedis(master_servers,
+                                 auto_pipeline=self.auto_pipeline)
+
+    def tearDown(self):
+        self.rc.flushall()
+
+    def test_single_commands(self):
+        assert self.rc.set('a', 'foo')
+        assert self.rc.get('a') == b('foo')
+        assert self.rc.incr('counter') == 1
+        assert self.rc.mget(['a', 'missing']) == [b('foo'), None]
+
+    def test_concurrent_commands_are_batched(self):
+        results = {}
+
+        def worker(i):
+            key = 'key%d' % i
+            for _ in range(10):
+                self.rc.incr(key)
+            results[i] = self.rc.get(key)
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == dict((i, b('10')) for i in range(20))
+        stats = self.auto_pipeline.stats()
+        assert stats['commands'] >= 220
+        assert stats['batches'] < stats['commands']
+
+    def test_errors_go_to_their_caller(self):
+        self.rc.hset('a-hash', 'f', 1)
+        self.assertRaises(redis.ResponseError, self.rc.incr, 'a-hash')
+        assert self.rc.hget('a-hash', 'f') == b('1')
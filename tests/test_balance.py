@@ -0,0 +1,130 @@
+from unittest import TestCase
+import multinodebalance
+from multinodebalance import MultiNodeBalanceAnalyzer
+from multinoderedis import MultiNodeRedis
+from multinoderouter import KetamaRouter, ModuloRouter
+
+NODE_NAMES = ['node1', 'node2']
+
+
+class TestMultiNodeBalanceAnalyzer(TestCase):
+    def setUp(self):
+        self.keys = ['key%d' % i for i in range(1000)]
+
+    def _counts(self, router, keys):
+        counts = dict((node_name, 0) for node_name in router.node_names)
+        for key in keys:
+            counts[router.get_node_name(key)] += 1
+        return counts
+
+    def test_node_counts(self):
+        router = ModuloRouter(NODE_NAMES)
+        analyzer = MultiNodeBalanceAnalyzer(router)
+        analyzer.add(self.keys[:500])
+        analyzer.add(self.keys[500:])
+        report = analyzer.report()
+        assert report['keys'] == 1000
+        assert report['bytes'] == sum(len(key) for key in self.keys)
+        counts = self._counts(router, self.keys)
+        for node_name, node in report['nodes'].items():
+            assert node['keys'] == counts[node_name]
+            assert node['key_share'] == counts[node_name] / 1000.0
+        assert report['key_skew'] == \
+            max(counts.values()) * 2 / 1000.0
+        assert 'moves' not in report
+
+    def test_moves(self):
+        router = KetamaRouter(NODE_NAMES)
+        new_router = KetamaRouter(NODE_NAMES + ['node3'])
+        analyzer = MultiNodeBalanceAnalyzer(router, new_router=new_router)
+        analyzer.add(self.keys)
+        report = analyzer.report()
+        moved = [key for key in self.keys
+                 if router.get_node_name(key) != new_router.get_node_name(key)]
+        assert report['moved_keys'] == len(moved)
+        assert report['moved_fraction'] == len(moved) / 1000.0
+        assert sorted(report['moves']) == [('node1', 'node3'),
+                                           ('node2', 'node3')]
+        assert report['new_nodes'] == self._counts(new_router, self.keys)
+
+    def test_without_numpy(self):
+        numpy = multinodebalance.numpy
+        router = ModuloRouter(NODE_NAMES)
+        new_router = ModuloRouter(NODE_NAMES + ['node3'])
+        analyzer = MultiNodeBalanceAnalyzer(router, new_router=new_router)
+        analyzer.add(self.keys)
+        multinodebalance.numpy = None
+        try:
+            pure = MultiNodeBalanceAnalyzer(router, new_router=new_router)
+            pure.add(self.keys)
+        finally:
+            multinodebalance.numpy = numpy
+        assert pure.report() == analyzer.report()
+
+    def test_sizes(self):
+        analyzer = MultiNodeBalanceAnalyzer(ModuloRouter(NODE_NAMES))
+        analyzer.add_lines(['%s\t100\n' % key for key in self.keys[:10]] +
+                           ['%s\n' % key for key in self.keys[10:20]],
+                           batch_size=7)
+        report = analyzer.report()
+        assert report['keys'] == 20
+        assert report['bytes'] == 1000 + sum(len(key)
+                                             for key in self.keys[10:20])
+
+    def test_hot_tags(self):
+        analyzer = MultiNodeBalanceAnalyzer(KetamaRouter(NODE_NAMES),
+                                            top_tags=2, tag_capacity=10)
+        keys = (['{hot}:%d' % i for i in range(300)] +
+                ['{warm}:%d' % i for i in range(100)] +
+                ['{cold%d}:x' % i for i in range(500)] + self.keys)
+        for start in range(0, len(keys), 100):
+            analyzer.add(keys[start:start + 100])
+        report = analyzer.report()
+        assert report['tagged_keys'] == 900
+        assert [tag for tag, _ in report['hot_tags']] == ['hot', 'warm']
+        # counts are lower bounds, off by at most 900 / 10
+        assert 300 - 90 <= report['hot_tags'][0][1] <= 300
+        assert len(analyzer._tags) <= 10
+
+    def test_tags_ignored_by_router(self):
+        analyzer = MultiNodeBalanceAnalyzer(ModuloRouter(NODE_NAMES))
+        analyzer.add(['{hot}:%d' % i for i in range(10)])
+        report = analyzer.report()
+        assert report['tagged_keys'] == 0
+        assert report['hot_tags'] == []
+
+    def test_main_routes_like_client(self):
+        servers = ['node%d|127.0.0.1:%d' % (i, 7000 + i)
+                   for i in range(1, 9)]
+        routers = []
+        analyzer_class = multinodebalance.MultiNodeBalanceAnalyzer
+
+        def recording_analyzer(router, **kwargs):
+            routers.append(router)
+            return analyzer_class(router, **kwargs)
+        multinodebalance.MultiNodeBalanceAnalyzer = recording_analyzer
+        try:
+            for nodes in [','.join(servers),
+                          ','.join('node%d' % i for i in range(1, 9))]:
+                multinodebalance.main(['/dev/null', '--nodes', nodes])
+        finally:
+            multinodebalance.MultiNodeBalanceAnalyzer = analyzer_class
+        client = MultiNodeRedis(servers)
+        for router in routers:
+            assert router.node_names == client.manager.router.node_names
+
+    def test_add_scan(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'])
+        rc.mset(dict((key, 'x' * 100) for key in self.keys[:50]))
+        try:
+            analyzer = MultiNodeBalanceAnalyzer(rc.manager.router)
+            analyzer.add_scan(rc, match='key*', memory_usage=True,
+                              batch_size=20)
+            report = analyzer.report()
+            assert report['keys'] == 50
+            assert report['bytes'] > 50 * 100
+            counts = self._counts(rc.manager.router, self.keys[:50])
+            for node_name, node in report['nodes'].items():
+                assert node['keys'] == counts[node_name]
+        finally:
+            rc.delete(*self.keys[:50])
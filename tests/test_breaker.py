@@ -0,0 +1,191 @@
+import time
+from unittest import TestCase
+import redis
+from multinodebreaker import (MultiNodeCircuitBreaker, CLOSED, HALF_OPEN,
+                              OPEN)
+from multinodeexceptions import (MultiNodeCircuitOpenException,
+                                 MultiNodeTimeoutException)
+from multinoderedis import MultiNodeRedis
+from redis._compat import b
+
+# nothing listens here, so connects fail at once
+DEAD_SERVER = '127.0.0.1:1'
+
+
+class FakePool(object):
+    connection_kwargs = {'host': 'fake', 'port': 1}
+
+
+class FakeNode(object):
+    def __init__(self):
+        self.connection_pool = FakePool()
+        self.error = None
+
+    def execute_command(self, *args):
+        if self.error is not None:
+            raise self.error
+        return 'OK'
+
+
+class TestCircuitBreaker(TestCase):
+    def test_states(self):
+        breaker = MultiNodeCircuitBreaker(failure_threshold=2,
+                                          reset_timeout=0.05)
+        node = FakeNode()
+        breaker.attach(node, 'node1')
+        node.error = redis.ConnectionError()
+        self.assertRaises(redis.ConnectionError, node.execute_command, 'GET')
+        assert breaker.state(node) == CLOSED
+        self.assertRaises(redis.ConnectionError, node.execute_command, 'GET')
+        assert breaker.state(node) == OPEN
+        self.assertRaises(MultiNodeCircuitOpenException, node.execute_command,
+                          'GET')
+        time.sleep(0.06)
+        # a failed probe reopens the circuit
+        self.assertRaises(redis.ConnectionError, node.execute_command, 'GET')
+        assert breaker.state(node) == OPEN
+        time.sleep(0.06)
+        node.error = None
+        assert node.execute_command('GET') == 'OK'
+        assert breaker.state(node) == CLOSED
+        assert breaker.stats() == {'fake:1': {'node_name': 'node1',
+                                              'state': CLOSED,
+                                              'failures': 0,
+                                              'rejected': 1}}
+
+    def test_half_open_limits_probes(self):
+        breaker = MultiNodeCircuitBreaker(failure_threshold=1,
+                                          reset_timeout=0)
+        node = FakeNode()
+        breaker.attach(node, 'node1')
+        breaker.record_failure(node)
+        breaker.before_call(node)
+        assert breaker.state(node) == HALF_OPEN
+        self.assertRaises(MultiNodeCircuitOpenException, breaker.before_call,
+                          node)
+
+    def test_response_errors_dont_count(self):
+        breaker = MultiNodeCircuitBreaker(failure_threshold=1)
+        node = FakeNode()
+        breaker.attach(node, 'node1')
+        node.error = redis.ResponseError()
+        self.assertRaises(redis.ResponseError, node.execute_command, 'GET')
+        assert breaker.state(node) == CLOSED
+
+
+class TestUnhealthyNode(TestCase):
+    def setUp(self):
+        self.breaker = MultiNodeCircuitBreaker(failure_threshold=1,
+                                               reset_timeout=60)
+        self.rc = MultiNodeRedis(['node1|127.0.0.1:6379',
+                                  'node2|%s' % DEAD_SERVER],
+                                 circuit_breaker=self.breaker)
+        self.keys = {}
+        for i in range(100):
+            key = 'key%d' % i
+            self.keys.setdefault(self.rc.manager._get_node_name(key), key)
+
+    def tearDown(self):
+        self.rc.manager.node_map['node1'][0].flushall()
+
+    def test_fails_fast(self):
+        dead_key = self.keys['node2']
+        self.assertRaises(redis.ConnectionError, self.rc.get, dead_key)
+        self.assertRaises(MultiNodeCircuitOpenException, self.rc.get,
+                          dead_key)
+        assert self.rc.set(self.keys['node1'], 'foo')
+
+    def test_pipeline_partial_results(self):
+        with self.rc.pipeline(transaction=False) as pipe:
+            pipe.set(self.keys['node1'], 'foo').get(self.keys['node2'])
+            pipe.get(self.keys['node1'])
+            results = pipe.execute(raise_on_error=False)
+        assert results[0] is True
+        assert isinstance(results[1], redis.ConnectionError)
+        assert results[2] == b('foo')
+        with self.rc.pipeline(transaction=False) as pipe:
+            pipe.get(self.keys['node1']).get(self.keys['node2'])
+            self.assertRaises(MultiNodeCircuitOpenException, pipe.execute)
+
+
+class TestTimeouts(TestCase):
+    def setUp(self):
+        self.breaker = MultiNodeCircuitBreaker(failure_threshold=1,
+                                               reset_timeout=60)
+        self.rc = MultiNodeRedis(['node1|127.0.0.1:6379',
+                                  'node2|127.0.0.1:6370'],
+                                 timeout=0.05, circuit_breaker=self.breaker)
+
+    def tearDown(self):
+        for port in [6379, 6370]:
+            redis.StrictRedis(port=port).flushall()
+
+    def _slow_down(self, obj, name, delay=0.2):
+        call = getattr(obj, name)
+
+        def slow(*args, **kwargs):
+            time.sleep(delay)
+            return call(*args, **kwargs)
+        setattr(obj, name, slow)
+
+    def test_single_node_mget(self):
+        node = self.rc._get_node('a')
+        self._slow_down(node, 'mget')
+        start = time.time()
+        self.assertRaises(MultiNodeTimeoutException, self.rc.mget, ['a'])
+        assert time.time() - start < 0.15
+        assert self.breaker.state(node) == OPEN
+
+    def test_single_node_pipeline(self):
+        pipe = self.rc.pipeline()
+        pipe.get('a')
+        node, pipeline = pipe.pipeline_map.items()[0]
+        self._slow_down(pipeline, 'execute')
+        start = time.time()
+        self.assertRaises(MultiNodeTimeoutException, pipe.execute)
+        assert time.time() - start < 0.15
+        assert self.breaker.state(node) == OPEN
+
+    def test_execute_iter_single_deadline(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            timeout=0.1, circuit_breaker=self.breaker)
+        pipe = rc.pipeline(transaction=False)
+        for i in range(10):
+            pipe.get('key%d' % i)
+        (fast, fast_pipeline), (slow, slow_pipeline) = \
+            pipe.pipeline_map.items()
+        # each finishes within the timeout of the one before it, but not
+        # of the start
+        self._slow_down(fast_pipeline, 'execute', 0.06)
+        self._slow_down(slow_pipeline, 'execute', 0.16)
+        fast_order = list(pipe.pipeline_order[fast_pipeline])
+        results = dict(pipe.execute_iter(raise_on_error=False))
+        assert sorted(results) == range(10)
+        for index, value in results.items():
+            if index in fast_order:
+                assert value is None
+            else:
+                assert isinstance(value, MultiNodeTimeoutException)
+        assert self.breaker.state(slow) == OPEN
+        assert self.breaker.state(fast) != OPEN
+
+
+class TestReplicaFallback(TestCase):
+    def setUp(self):
+        self.replica = redis.StrictRedis(port=6371)
+        self.replica.set('a', 'replica')
+        self.rc = MultiNodeRedis(['node1|%s' % DEAD_SERVER],
+                                 slave_servers=['node1|127.0.0.1:6371'],
+                                 circuit_breaker=MultiNodeCircuitBreaker(
+                                     failure_threshold=1),
+                                 replica_fallback=True)
+
+    def tearDown(self):
+        self.replica.flushall()
+
+    def test_reads_fall_back_to_replica(self):
+        assert self.rc.get('a') == b('replica')
+        # circuit is open now, still served
+        assert self.rc.get('a') == b('replica')
+        assert self.rc.mget(['a', 'b']) == [b('replica'), None]
+        self.assertRaises(redis.ConnectionError, self.rc.set, 'a', 'foo')
@@ -0,0 +1,136 @@
+import time
+from unittest import TestCase
+import redis
+from multinodecache import MultiNodeNearCache
+from multinoderedis import MultiNodeRedis
+
+
+class TestMultiNodeNearCache(TestCase):
+    def test_lru_by_entries(self):
+        cache = MultiNodeNearCache(max_entries=2)
+        cache.set(cache.token(), '1', 'get', 'a')
+        cache.set(cache.token(), '2', 'get', 'b')
+        assert cache.get('get', 'a') == (True, '1')
+        cache.set(cache.token(), '3', 'get', 'c')
+        # b was least recently used
+        assert cache.get('get', 'b') == (False, None)
+        assert cache.get('get', 'a') == (True, '1')
+        assert cache.stats()['evictions'] == 1
+
+    def test_lru_by_bytes(self):
+        cache = MultiNodeNearCache(max_bytes=10)
+        cache.set(cache.token(), 'x' * 6, 'get', 'a')
+        cache.set(cache.token(), 'y' * 6, 'get', 'b')
+        assert len(cache) == 1
+        assert cache.bytes == 6
+        cache.set(cache.token(), 'z' * 11, 'get', 'c')
+        assert cache.get('get', 'c') == (False, None)
+
+    def test_ttl(self):
+        cache = MultiNodeNearCache(ttl=0.05)
+        cache.set(cache.token(), '1', 'get', 'a')
+        assert cache.get('get', 'a') == (True, '1')
+        time.sleep(0.1)
+        assert cache.get('get', 'a') == (False, None)
+        assert len(cache) == 0
+
+    def test_invalidate_drops_every_reply_for_key(self):
+        cache = MultiNodeNearCache()
+        cache.set(cache.token(), {'f': '1'}, 'hgetall', 'h')
+        cache.set(cache.token(), '1', 'hget', 'h', 'f')
+        cache.set(cache.token(), '1', 'get', 'other')
+        cache.invalidate('h')
+        assert cache.get('hget', 'h', 'f') == (False, None)
+        assert cache.get('hgetall', 'h') == (False, None)
+        assert cache.get('get', 'other') == (True, '1')
+
+    def test_stale_fill_is_dropped(self):
+        cache = MultiNodeNearCache()
+        token = cache.token()
+        cache.invalidate('a')
+        cache.set(token, 'stale', 'get', 'a')
+        assert cache.get('get', 'a') == (False, None)
+
+
+class TestNearCachedClient(TestCase):
+    def setUp(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        self.cache = MultiNodeNearCache()
+        self.rc = MultiNodeRedis(master_servers, near_cache=self.cache)
+        self.other = MultiNodeRedis(master_servers)
+
+    def tearDown(self):
+        self.rc.flushall()
+
+    def test_reads_are_cached(self):
+        self.rc.set('a', '1')
+        assert self.rc.get('a') == '1'
+        self.other.set('a', '2')
+        assert self.rc.get('a') == '1'
+        assert self.cache.stats()['hits'] == 1
+
+    def test_writes_invalidate(self):
+        self.rc.set('a', '1')
+        assert self.rc.get('a') == '1'
+        self.rc.incr('a')
+        assert self.rc.get('a') == '2'
+        self.rc.hmset('h', {'f': '1'})
+        assert self.rc.hgetall('h') == {'f': '1'}
+        self.rc.hset('h', 'f', '2')
+        assert self.rc.hgetall('h') == {'f': '2'}
+        assert self.rc.hget('h', 'f') == '2'
+        self.rc.delete('a', 'h')
+        assert self.rc.get('a') is None
+        assert self.rc.hget('h', 'f') is None
+
+    def test_lost_reply_invalidates(self):
+        self.rc.set('a', '1')
+        self.rc.set('b', '1')
+        assert self.rc.get('a') == '1'
+        assert self.rc.get('b') == '1'
+        node = self.rc._get_node('a')
+        set_ = node.set
+
+        def lost_set(*args, **kwargs):
+            set_(*args, **kwargs)
+            raise redis.TimeoutError('reply lost')
+        node.set = lost_set
+        self.assertRaises(redis.TimeoutError, self.rc.set, 'a', '2')
+        node.set = set_
+        assert self.rc.get('a') == '2'
+        node = self.rc._get_node('b')
+        delete = node.delete
+
+        def lost_delete(*args):
+            delete(*args)
+            raise redis.TimeoutError('reply lost')
+        node.delete = lost_delete
+        self.assertRaises(redis.TimeoutError, self.rc.delete, 'b')
+        node.delete = delete
+        assert self.rc.get('b') is None
+
+    def test_pipeline_writes_invalidate(self):
+        self.rc.set('a', '1')
+        assert self.rc.get('a') == '1'
+        with self.rc.pipeline() as pipe:
+            pipe.set('a', '2').set('b', '3')
+            pipe.execute()
+        assert self.rc.get('a') == '2'
+
+    def test_client_tracking(self):
+        try:
+            rc = MultiNodeRedis(['node1|127.0.0.1:6379',
+                                 'node2|127.0.0.1:6370'],
+                                near_cache=MultiNodeNearCache(),
+                                client_tracking=True)
+        except redis.ResponseError:
+            # redis < 6
+            return
+        rc.set('a', '1')
+        assert rc.get('a') == '1'
+        self.other.set('a', '2')
+        for _ in range(100):
+            if rc.manager.near_cache.get('get', 'a')[0] is False:
+                break
+            time.sleep(0.01)
+        assert rc.get('a') == '2'
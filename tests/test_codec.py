@@ -0,0 +1,98 @@
+import json
+from unittest import TestCase
+from multinodecodec import MAGIC, MultiNodeCodec
+from multinoderedis import MultiNodeRedis
+
+MASTER_SERVERS = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+
+
+class TestMultiNodeCodec(TestCase):
+    def setUp(self):
+        self.codec = MultiNodeCodec(compress_threshold=100)
+
+    def test_small_strings_unchanged(self):
+        assert self.codec.encode('foo') == 'foo'
+        assert self.codec.encode(u'f\xf6\xf6') == u'f\xf6\xf6'.encode('utf-8')
+        assert self.codec.decode('foo') == u'foo'
+        assert self.codec.decode(None) is None
+        assert self.codec.encode(5) == 5
+
+    def test_large_strings_compressed(self):
+        blob = json.dumps({'items': range(200)})
+        encoded = self.codec.encode(blob)
+        assert encoded.startswith(MAGIC)
+        assert len(encoded) < len(blob)
+        assert self.codec.decode(encoded) == blob
+
+    def test_incompressible_kept_plain(self):
+        blob = ''.join(chr(i) for i in range(1, 256))
+        assert self.codec.encode(blob) == blob
+        assert self.codec.decode(blob) == blob
+
+    def test_magic_prefixed_string_is_tagged(self):
+        value = MAGIC + 'x'
+        encoded = self.codec.encode(value)
+        assert encoded != value
+        assert self.codec.decode(encoded) == value
+
+    def test_serialized_values(self):
+        for value in [{'a': [1, 2]}, [u'x', None], {'big': 'y' * 500}]:
+            encoded = self.codec.encode(value)
+            assert encoded.startswith(MAGIC)
+            assert self.codec.decode(encoded) == value
+
+    def test_unknown_serializer(self):
+        self.assertRaises(ValueError, MultiNodeCodec, serializer='pickle')
+
+
+class TestCodecCommands(TestCase):
+    def setUp(self):
+        self.rc = MultiNodeRedis(MASTER_SERVERS, codec=MultiNodeCodec(
+            compress_threshold=64))
+        self.plain = MultiNodeRedis(MASTER_SERVERS)
+        self.blob = json.dumps({'items': range(100)})
+
+    def tearDown(self):
+        self.plain.flushall()
+
+    def test_commands(self):
+        self.rc.set('a', self.blob)
+        assert self.rc.get('a') == self.blob
+        assert len(self.rc._get_node('a').get('a')) < len(self.blob)
+        self.rc.mset({'b': self.blob, 'c': 'small'})
+        assert self.rc.mget(['a', 'b', 'c', 'd']) == \
+            [self.blob, self.blob, 'small', None]
+        self.rc.hset('h', 'f1', self.blob)
+        self.rc.hmset('h', {'f2': {'x': 1}})
+        assert self.rc.hget('h', 'f1') == self.blob
+        assert self.rc.hgetall('h') == {'f1': self.blob, 'f2': {'x': 1}}
+        self.rc.zadd('z', 1, self.blob, small=2)
+        self.rc.zincrby('z', 'small')
+        assert self.rc.zrange('z', 0, -1, withscores=True) == \
+            [(self.blob, 1.0), ('small', 3.0)]
+        assert self.rc.incr('counter') == 1
+
+    def test_scan_iterators(self):
+        self.rc.hmset('h', {'f1': self.blob, 'f2': 'small'})
+        self.rc.zadd('z', 1, self.blob, small=2)
+        assert dict(self.rc.hscan_iter('h')) == {'f1': self.blob,
+                                                 'f2': 'small'}
+        assert dict(self.rc.zscan_iter('z')) == {self.blob: 1.0,
+                                                 'small': 2.0}
+
+    def test_legacy_values(self):
+        self.plain.set('a', self.blob)
+        self.plain.hset('h', 'f', 'plain')
+        assert self.rc.get('a') == self.blob
+        assert self.rc.hgetall('h') == {'f': 'plain'}
+
+    def test_pipeline(self):
+        with self.rc.pipeline(transaction=False) as pipe:
+            pipe.set('a', self.blob).hset('h', 'f', self.blob)
+            pipe.zadd('z', 1, self.blob)
+            pipe.get('a').hget('h', 'f').hgetall('h').zrange('z', 0, -1)
+            pipe.incr('counter')
+            assert pipe.execute() == [True, 1, 1, self.blob, self.blob,
+                                      {'f': self.blob}, [self.blob], 1]
+            pipe.get('a').get('missing')
+            assert dict(pipe.execute_iter()) == {0: self.blob, 1: None}
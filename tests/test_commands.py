@@ -119,4 +119,55 @@ class TestMultiNodeRedis(TestCase):
 
         # custom score function
         assert self.rc.zrange('a', 0, 1, withscores=True, score_cast_func=int) == \
-            [(b('a1'), 1), (b('a2'), 2)]
\ No newline at end of file
+            [(b('a1'), 1), (b('a2'), 2)]
+
+    def test_delete_multiple(self):
+        self.rc.mset({'a': 1, 'b': 2, 'c': 3, 'd': 4})
+        assert self.rc.delete('a', 'b', 'c', 'missing') == 3
+        assert self.rc.mget('a', 'b', 'c', 'd') == [None, None, None, b('4')]
+
+    def test_mget_many_keys(self):
+        mapping = dict(('key%d' % i, str(i)) for i in range(200))
+        assert self.rc.mset(mapping)
+        keys = ['key%d' % i for i in reversed(range(200))] + ['key0']
+        assert self.rc.mget(keys) == [mapping[key] for key in keys]
+
+    def test_batched_mget_mset_delete(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        rc = MultiNodeRedis(master_servers, max_batch_size=7,
+                            max_batch_bytes=100)
+        mapping = dict(('key%d' % i, str(i) * 10) for i in range(200))
+        assert rc.mset(mapping)
+        keys = ['key%d' % i for i in reversed(range(200))]
+        assert rc.mget(keys) == [mapping[key] for key in keys]
+        assert rc.delete(*keys) == 200
+
+    def test_batch_chunks(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        manager = MultiNodeRedis(master_servers, max_batch_size=3,
+                                 max_batch_bytes=5).manager
+        assert list(manager._chunks(['a', 'b', 'c', 'd'])) == \
+            [['a', 'b', 'c'], ['d']]
+        assert list(manager._chunks(['aa', 'bbbb', 'cccccc', 'd'])) == \
+            [['aa'], ['bbbb'], ['cccccc'], ['d']]
+
+    def test_scan_iter(self):
+        keys = set('key%d' % i for i in range(500))
+        self.rc.mset(dict((key, 1) for key in keys))
+        self.rc.hset('a-hash', 'f', 1)
+        assert set(self.rc.scan_iter(count=50)) == keys | set(['a-hash'])
+        assert set(self.rc.scan_iter(match='key1*')) == \
+            set(key for key in keys if key.startswith('key1'))
+
+    def test_scan_iter_stops_early(self):
+        self.rc.mset(dict(('key%d' % i, 1) for i in range(100)))
+        iterator = self.rc.scan_iter(count=10)
+        assert len([next(iterator) for _ in range(5)]) == 5
+
+    def test_hscan_iter_and_zscan_iter(self):
+        self.rc.hmset('a', {'a1': 1, 'a2': 2, 'b': 3})
+        assert dict(self.rc.hscan_iter('a', match='a*')) == \
+            {b('a1'): b('1'), b('a2'): b('2')}
+        self.rc.zadd('z', z1=1, z2=2)
+        assert sorted(self.rc.zscan_iter('z')) == \
+            [(b('z1'), 1.0), (b('z2'), 2.0)]
@@ -0,0 +1,84 @@
+import threading
+import time
+from unittest import TestCase
+from multinodeexceptions import MultiNodeTimeoutException
+from multinodeexecutor import MultiNodeExecutor
+from multinoderedis import MultiNodeRedis
+
+
+class TestMultiNodeExecutor(TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_results_in_order(self):
+        executor = MultiNodeExecutor(max_workers=2, timeout=1)
+        assert executor.run([lambda i=i: i for i in range(5)]) == range(5)
+        results = executor.run([lambda: 1, lambda: 1 / 0],
+                               return_exceptions=True)
+        assert results[0] == 1
+        assert isinstance(results[1], ZeroDivisionError)
+
+    def test_first_call_inline_without_timeout(self):
+        executor = MultiNodeExecutor(max_workers=2)
+        current = threading.current_thread
+        threads = executor.run([current, current, current])
+        assert threads[0] is current()
+        assert current() not in threads[1:]
+        executor.timeout = 1
+        assert current() not in executor.run([current, current])
+
+    def test_timed_out_calls_dont_starve_pool(self):
+        executor = MultiNodeExecutor(max_workers=2, timeout=0.05)
+        for _ in range(3):
+            self.assertRaises(MultiNodeTimeoutException, executor.run,
+                              [self.release.wait, lambda: 1])
+        start = time.time()
+        assert executor.run([lambda: 1, lambda: 2]) == [1, 2]
+        assert time.time() - start < 0.05
+        # the replacements retire once the stuck calls return
+        threads = threading.active_count()
+        self.release.set()
+        time.sleep(0.05)
+        assert threading.active_count() == threads - 3
+
+    def test_no_thread_per_fan_out(self):
+        executor = MultiNodeExecutor(max_workers=2, timeout=1)
+        executor.run([lambda: 1, lambda: 2])
+        threads = threading.active_count()
+        for _ in range(50):
+            executor.run([lambda: 1, lambda: 2])
+        assert threading.active_count() == threads
+
+    def test_unstarted_calls_skipped(self):
+        executor = MultiNodeExecutor(max_workers=1, timeout=0.05)
+        calls = []
+        self.assertRaises(MultiNodeTimeoutException, executor.run,
+                          [self.release.wait, lambda: calls.append(1)])
+        self.release.set()
+        assert executor.run([lambda: 1, lambda: 2]) == [1, 2]
+        assert calls == []
+
+
+class TestHungNode(TestCase):
+    def test_cluster_recovers(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            timeout=0.05)
+        keys = ['key%d' % i for i in range(10)]
+        node = rc._get_node(keys[0])
+        release = threading.Event()
+        mget = node.mget
+
+        def hung_mget(*args, **kwargs):
+            release.wait()
+            return mget(*args, **kwargs)
+        node.mget = hung_mget
+        try:
+            for _ in range(3):
+                self.assertRaises(MultiNodeTimeoutException, rc.mget, keys)
+            node.mget = mget
+            assert rc.mget(keys) == [None] * 10
+        finally:
+            release.set()
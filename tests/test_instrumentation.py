@@ -0,0 +1,100 @@
+from unittest import TestCase
+from multinodeinstrumentation import (MultiNodeHistogram,
+                                      MultiNodeInstrumentation)
+from multinoderedis import MultiNodeRedis
+
+
+class TestMultiNodeHistogram(TestCase):
+    def test_percentiles_within_bucket_error(self):
+        histogram = MultiNodeHistogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+        assert histogram.count == 10000
+        for percent in [50, 90, 99]:
+            expected = 10000 * percent / 100.0
+            assert expected <= histogram.percentile(percent) <= \
+                expected * 1.125
+        assert histogram.percentile(100) == 10000
+
+    def test_small_and_huge_values(self):
+        histogram = MultiNodeHistogram()
+        histogram.record(0)
+        histogram.record(3)
+        histogram.record(10 ** 15)
+        assert histogram.percentile(10) == 0
+        assert histogram.max == 10 ** 15
+
+
+class TestInstrumentedClient(TestCase):
+    def setUp(self):
+        self.events = []
+        self.instrumentation = MultiNodeInstrumentation(
+            hooks=[lambda *event: self.events.append(event)])
+        self.rc = MultiNodeRedis(['node1|127.0.0.1:6379',
+                                  'node2|127.0.0.1:6370'],
+                                 instrumentation=self.instrumentation)
+
+    def tearDown(self):
+        self.rc.flushall()
+
+    def test_commands_recorded_per_node(self):
+        for i in range(20):
+            self.rc.set('key%d' % i, 'value')
+            self.rc.get('key%d' % i)
+        stats = self.instrumentation.stats()
+        assert sorted(stats) == ['node1', 'node2']
+        assert sum(node['commands']['SET']['calls']
+                   for node in stats.values()) == 20
+        assert sum(node['routes'] for node in stats.values()) == 40
+        get_stats = stats['node1']['commands']['GET']
+        assert get_stats['errors'] == 0
+        assert get_stats['bytes'] > 0
+        assert get_stats['latency_us']['p99'] >= \
+            get_stats['latency_us']['p50']
+        assert len([e for e in self.events if e[0] == 'command']) == 40
+
+    def test_errors_recorded(self):
+        self.rc.set('a', 'not a hash')
+        try:
+            self.rc.hget('a', 'f')
+        except Exception:
+            pass
+        node_name = self.rc.manager._get_node_name('a')
+        stats = self.instrumentation.stats()[node_name]['commands']['HGET']
+        assert stats['errors'] == 1
+
+    def test_pipelines_recorded(self):
+        with self.rc.pipeline() as pipe:
+            for i in range(20):
+                pipe.set('key%d' % i, i)
+            pipe.execute()
+        stats = self.instrumentation.stats()
+        assert sum(node['pipeline_sizes']['count']
+                   for node in stats.values() if 'pipelines' in node) == \
+            len([e for e in self.events if e[0] == 'pipeline'])
+        assert sum(event[4] for event in self.events
+                   if event[0] == 'pipeline') == 20
+
+    def test_batch_routes_recorded(self):
+        keys = ['key%d' % i for i in range(30)]
+        self.rc.mget(keys)
+        stats = self.instrumentation.stats()
+        assert sum(node['routes'] for node in stats.values()) == 30
+        self.rc.manager.route_many(keys)
+        with self.rc.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.get(key)
+            pipe.execute()
+        stats = self.instrumentation.stats()
+        assert sum(node['routes'] for node in stats.values()) == 90
+
+    def test_pipeline_bytes_recorded(self):
+        with self.rc.pipeline(transaction=False) as pipe:
+            pipe.set('a', 'x' * 100).get('a')
+            pipe.execute()
+        node_name = self.rc.manager._get_node_name('a')
+        stats = self.instrumentation.stats()[node_name]
+        # SET a <100 bytes>, GET a, and the 100 byte reply
+        assert stats['pipelines']['bytes'] == 3 + 1 + 100 + 3 + 1 + 100
+        assert stats['pipeline_bytes']['max'] == \
+            stats['pipelines']['bytes']
@@ -0,0 +1,158 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+import redis
+from multinodecodec import MultiNodeCodec
+from multinodeloader import read_csv, read_jsonl
+from multinoderedis import MultiNodeRedis
+from multinoderetry import MultiNodeRetryPolicy
+
+
+class TestMultiNodeBulkLoader(TestCase):
+    def setUp(self):
+        self.rc = MultiNodeRedis(['node1|127.0.0.1:6379',
+                                  'node2|127.0.0.1:6370'])
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.rc.flushall()
+        shutil.rmtree(self.tmp)
+
+    def test_load(self):
+        records = (('key%d' % i, 'value%d' % i) for i in xrange(2500))
+        stats = self.rc.bulk_loader(batch_size=100).load(records)
+        assert stats['records'] == 2500
+        assert stats['errors'] == 0
+        assert sorted(stats['nodes']) == ['node1', 'node2']
+        assert sum(node['records']
+                   for node in stats['nodes'].values()) == 2500
+        assert stats['records_per_second'] > 0
+        keys = ['key%d' % i for i in xrange(2500)]
+        assert self.rc.mget(keys) == ['value%d' % i for i in xrange(2500)]
+
+    def test_hashes_and_ttls(self):
+        self.rc.bulk_loader().load([('plain', 'a'),
+                                    ('expiring', 'b', 100),
+                                    ('hash', {'f1': 'v1', 'f2': 'v2'}, 100),
+                                    ('plain', 'c', 50)])
+        assert self.rc.get('plain') == 'c'
+        assert 0 < self.rc._get_node('plain').ttl('plain') <= 50
+        assert self.rc.get('expiring') == 'b'
+        assert 0 < self.rc._get_node('expiring').ttl('expiring') <= 100
+        assert self.rc.hgetall('hash') == {'f1': 'v1', 'f2': 'v2'}
+        assert 0 < self.rc._get_node('hash').ttl('hash') <= 100
+
+    def test_codec(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            codec=MultiNodeCodec(compress_threshold=10))
+        rc.bulk_loader().load([('doc', {'a': 'b'}), ('text', 'x' * 100),
+                               ('listed', [1, 2])])
+        assert rc.get('text') == 'x' * 100
+        assert rc.get('listed') == [1, 2]
+        assert rc.hgetall('doc') == {'a': 'b'}
+
+    def test_jsonl_and_csv(self):
+        path = os.path.join(self.tmp, 'records.jsonl')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'id': 'j1', 'data': 'one'}) + '\n\n')
+            f.write(json.dumps({'id': 'j2', 'data': 'two', 'ttl': 60}) +
+                    '\n')
+        assert list(read_jsonl(path, key='id', value='data')) == [
+            ('j1', 'one', None), ('j2', 'two', 60)]
+        self.rc.bulk_loader().load_jsonl(path, key='id', value='data')
+        assert self.rc.mget(['j1', 'j2']) == ['one', 'two']
+
+        path = os.path.join(self.tmp, 'records.csv')
+        with open(path, 'w') as f:
+            f.write('key,value,ttl\nc1,one,\nc2,two,60\n')
+        assert list(read_csv(path)) == [('c1', 'one', None),
+                                        ('c2', 'two', 60)]
+        self.rc.bulk_loader().load_csv(path)
+        assert self.rc.mget(['c1', 'c2']) == ['one', 'two']
+
+    def test_backpressure(self):
+        # every node's worker is stuck, so reading stops after the queue
+        # and the one batch in hand fill up
+        release = threading.Event()
+        loader = self.rc.bulk_loader(batch_size=10, queue_batches=2,
+                                     workers_per_node=1)
+        write = loader._write
+
+        def blocked_write(node, batch):
+            release.wait()
+            return write(node, batch)
+        loader._write = blocked_write
+        read = []
+
+        def records():
+            for i in xrange(10000):
+                read.append(i)
+                yield 'key%d' % i, 'value'
+        thread = threading.Thread(target=loader.load, args=(records(),))
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        # per node: one batch being written, two queued, one buffered,
+        # plus the chunk being routed
+        assert len(read) <= 2 * (1 + 2 + 1) * 10 + 10
+        release.set()
+        thread.join()
+        assert len(read) == 10000
+
+    def test_errors(self):
+        self.rc.set('wrongtype', 'x')
+        records = [('key%d' % i, 'value') for i in xrange(100)]
+        records.append(('wrongtype', {'f': 'v'}, 10))
+        stats = self.rc.bulk_loader(raise_on_error=False).load(records)
+        assert stats['errors'] == 1
+        assert stats['records'] == 100
+        self.assertRaises(redis.ResponseError,
+                          self.rc.bulk_loader().load, records)
+
+    def test_unencodable_value(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            codec=MultiNodeCodec())
+        records = [('key%d' % i, set([i])) for i in xrange(200)]
+        loader = rc.bulk_loader(batch_size=10, queue_batches=1,
+                                raise_on_error=False)
+        thread = threading.Thread(target=loader.load, args=(records,))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+        stats = loader.stats()
+        assert stats['errors'] == 200
+        assert stats['records'] == 0
+        self.assertRaises(TypeError, rc.bulk_loader(batch_size=10,
+                                                    queue_batches=1).load,
+                          records)
+
+    def test_repeated_key_keeps_last_value(self):
+        records = [('key', 'value%d' % i) for i in xrange(50)]
+        self.rc.bulk_loader(batch_size=1).load(records)
+        assert self.rc.get('key') == 'value49'
+
+    def test_retry(self):
+        loader = self.rc.bulk_loader(
+            retry_policy=MultiNodeRetryPolicy(backoff=0.001))
+        node = self.rc._get_node('key')
+        pipeline = node.pipeline
+        failures = []
+
+        def failing_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            if not failures:
+                failures.append(1)
+
+                def fail(*args, **kwargs):
+                    raise redis.ConnectionError('lost the node')
+                pipe.execute = fail
+            return pipe
+        node.pipeline = failing_pipeline
+        stats = loader.load([('key', 'value')])
+        assert failures
+        assert stats['records'] == 1
+        assert self.rc.get('key') == 'value'
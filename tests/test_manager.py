@@ -0,0 +1,65 @@
+import socket
+from unittest import TestCase
+import redis
+from multinodeexceptions import (MultiNodeRedisException,
+                                 MultiNodeTimeoutException)
+from multinodemanager import MultiNodeManager, NODE_NAME
+from multinoderedis import MultiNodeRedis
+
+
+class TestMultiNodeManager(TestCase):
+    def setUp(self):
+        self.servers = [('node1', '127.0.0.1:6379'),
+                        ('node2', '127.0.0.1:6370')]
+        for node_name, server in self.servers:
+            host, port = server.split(':')
+            redis.StrictRedis(host=host, port=int(port)).set(NODE_NAME,
+                                                             node_name)
+
+    def tearDown(self):
+        for node_name, server in self.servers:
+            host, port = server.split(':')
+            redis.StrictRedis(host=host, port=int(port)).delete(NODE_NAME)
+
+    def test_discover_node_names(self):
+        manager = MultiNodeManager([server for _, server in self.servers],
+                                   discovery_timeout=5)
+        assert sorted(manager.node_map) == ['node1', 'node2']
+        for node_name, server in self.servers:
+            kwargs = manager.node_map[node_name][0].connection_pool \
+                .connection_kwargs
+            assert '%s:%s' % (kwargs['host'], kwargs['port']) == server
+
+    def test_missing_node_name(self):
+        redis.StrictRedis(port=6370).delete(NODE_NAME)
+        self.assertRaises(MultiNodeRedisException, MultiNodeManager,
+                          ['127.0.0.1:6379', '127.0.0.1:6370'])
+
+    def test_discovery_timeout(self):
+        # accepts connections but never replies
+        silent = socket.socket()
+        silent.bind(('127.0.0.1', 0))
+        silent.listen(1)
+        try:
+            self.assertRaises(MultiNodeTimeoutException, MultiNodeManager,
+                              ['127.0.0.1:%d' % silent.getsockname()[1]],
+                              discovery_timeout=0.2)
+        finally:
+            silent.close()
+
+    def test_lazy_connections(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'])
+        for nodes in rc.manager.node_map.values():
+            assert nodes[0].connection_pool._created_connections == 0
+
+    def test_warm_up(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            warm_up_connections=3)
+        for nodes in rc.manager.node_map.values():
+            pool = nodes[0].connection_pool
+            assert len(pool._available_connections) == 3
+            assert all(connection._sock is not None
+                       for connection in pool._available_connections)
+        rc.warm_up(4)
+        for nodes in rc.manager.node_map.values():
+            assert len(nodes[0].connection_pool._available_connections) == 4
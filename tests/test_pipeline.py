@@ -231,4 +231,88 @@ class TestPipeline(TestCase):
                                'error: ') % key
             assert unicode(ex.value).startswith(expected)
 
-        assert self.rc[key] == b('1')
\ No newline at end of file
+        assert self.rc[key] == b('1')
+
+    def test_pipeline_concurrent_matches_serial(self):
+        keys = ['key%d' % i for i in range(50)]
+        with self.rc.pipeline(transaction=False) as pipe:
+            for i, key in enumerate(keys):
+                pipe.set(key, i)
+            assert pipe.execute() == [True] * len(keys)
+        with self.rc.pipeline(concurrent=False) as pipe:
+            for key in keys:
+                pipe.get(key)
+            serial = pipe.execute()
+        with self.rc.pipeline(concurrent=True) as pipe:
+            for key in keys:
+                pipe.get(key)
+            concurrent = pipe.execute()
+        assert serial == concurrent == [b(str(i)) for i in range(len(keys))]
+
+    def test_pipeline_concurrent_timeout(self):
+        from multinodeexceptions import MultiNodeTimeoutException
+        pipe = self.rc.pipeline(timeout=0.05)
+        for key in ['a', 'b', 'c', 'd']:
+            pipe.get(key)
+        assert len(pipe.pipeline_map) > 1
+        slow = pipe.pipeline_map.values()[0]
+        original = slow.execute
+
+        def slow_execute(*args, **kwargs):
+            import time
+            time.sleep(0.2)
+            return original(*args, **kwargs)
+        slow.execute = slow_execute
+        with pytest.raises(MultiNodeTimeoutException):
+            pipe.execute()
+
+    def test_pipeline_hash_tags_single_node(self):
+        from multinoderouter import KetamaRouter
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            router=KetamaRouter)
+        with rc.pipeline() as pipe:
+            for i in range(20):
+                pipe.set('{user1}:%d' % i, i)
+            assert pipe.is_single_node()
+            assert pipe.execute() == [True] * 20
+        assert rc.mget(['{user1}:%d' % i for i in range(20)]) == \
+            [b(str(i)) for i in range(20)]
+
+    def test_pipeline_batches_flushed_early(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        rc = MultiNodeRedis(master_servers, max_batch_size=10)
+        with rc.pipeline(transaction=False) as pipe:
+            for i in range(100):
+                pipe.set('key%d' % i, i).get('key%d' % i)
+            assert len(pipe) == 200
+            assert pipe.flushed
+            assert pipe.execute() == [True, b('0')] + \
+                [value for i in range(1, 100) for value in [True, b(str(i))]]
+            assert len(pipe) == 0
+
+    def test_pipeline_transaction_not_batched(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        rc = MultiNodeRedis(master_servers, max_batch_size=2)
+        with rc.pipeline() as pipe:
+            for i in range(10):
+                pipe.incr('{counter}')
+            assert not pipe.flushed
+            assert pipe.execute() == range(1, 11)
+
+    def test_execute_iter(self):
+        with self.rc.pipeline(transaction=False) as pipe:
+            for i in range(50):
+                pipe.set('key%d' % i, i).get('key%d' % i)
+            results = dict(pipe.execute_iter())
+            assert len(pipe) == 0
+        assert [results[i] for i in range(100)] == \
+            [value for i in range(50) for value in [True, b(str(i))]]
+
+    def test_execute_iter_serial_with_flushed(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        rc = MultiNodeRedis(master_servers, max_batch_size=5)
+        with rc.pipeline(transaction=False, concurrent=False) as pipe:
+            for i in range(30):
+                pipe.incr('counter%d' % (i % 3))
+            assert sorted(index for index, _ in pipe.execute_iter()) == \
+                range(30)
@@ -0,0 +1,85 @@
+import functools
+import os
+import time
+from unittest import TestCase
+import redis
+from multinodepool import MultiNodeConnectionPool
+from multinoderedis import MultiNodeRedis
+from redis._compat import b
+
+MASTER_SERVERS = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+
+
+class TestMultiNodeConnectionPool(TestCase):
+    def make_client(self, **kwargs):
+        return MultiNodeRedis(MASTER_SERVERS,
+                              connection_pool=functools.partial(
+                                  MultiNodeConnectionPool, **kwargs))
+
+    def tearDown(self):
+        MultiNodeRedis(MASTER_SERVERS).flushall()
+
+    def pools(self, rc):
+        return [nodes[0].connection_pool
+                for nodes in rc.manager.node_map.values()]
+
+    def test_commands(self):
+        rc = self.make_client(max_connections=2)
+        assert rc.set('a', 'foo')
+        assert rc.mget(['a', 'b']) == [b('foo'), None]
+        with rc.pipeline() as pipe:
+            assert pipe.get('a').execute() == [b('foo')]
+        for pool in self.pools(rc):
+            assert isinstance(pool, MultiNodeConnectionPool)
+            assert pool.max_connections == 2
+
+    def test_blocks_when_exhausted(self):
+        rc = self.make_client(max_connections=1, timeout=0.05)
+        pool = self.pools(rc)[0]
+        connection = pool.get_connection('GET')
+        self.assertRaises(redis.ConnectionError, pool.get_connection, 'GET')
+        pool.release(connection)
+        pool.release(pool.get_connection('GET'))
+
+    def test_idle_connections_reaped(self):
+        rc = self.make_client(idle_timeout=0.05)
+        rc.warm_up(3)
+        pool = self.pools(rc)[0]
+        assert pool.stats()['connections'] == 3
+        time.sleep(0.1)
+        pool.release(pool.get_connection('GET'))
+        stats = pool.stats()
+        assert stats['reaped'] >= 2
+        assert stats['connections'] <= 1
+
+    def test_health_check_reconnects(self):
+        rc = self.make_client(health_check_interval=0)
+        rc.set('a', 'foo')
+        for pool in self.pools(rc):
+            for connection in pool._connections:
+                # the server forgets this client, the socket stays open
+                redis.StrictRedis(**dict(
+                    (name, pool.connection_kwargs[name])
+                    for name in ('host', 'port'))).client_kill(
+                        '%s:%s' % connection._sock.getsockname())
+        assert rc.get('a') == b('foo')
+        assert sum(pool.health_check_failures
+                   for pool in self.pools(rc)) >= 1
+
+    def test_fork_leaves_parent_connections(self):
+        rc = self.make_client()
+        rc.set('a', 'foo')
+        node = rc._get_node('a')
+        sock = node.connection_pool._connections[0]._sock
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = rc.get('a') == b('foo')
+            except Exception:
+                ok = False
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert status == 0
+        assert rc.get('a') == b('foo')
+        # the child didn't shut down the socket we share with it
+        assert node.connection_pool._connections[0]._sock is sock
@@ -0,0 +1,149 @@
+import time
+from unittest import TestCase
+import redis
+from multinoderedis import MultiNodeRedis
+from multinodereplica import (EWMALatencyReplicaPolicy,
+                              LeastOutstandingReplicaPolicy)
+
+
+class RecordingPolicy(LeastOutstandingReplicaPolicy):
+    def __init__(self):
+        super(RecordingPolicy, self).__init__()
+        self.calls = []
+
+    def started(self, replica):
+        super(RecordingPolicy, self).started(replica)
+        self.calls.append('started')
+
+    def finished(self, replica, elapsed, failed=False):
+        super(RecordingPolicy, self).finished(replica, elapsed, failed)
+        self.calls.append('failed' if failed else 'finished')
+
+
+class TestReplicaPolicies(TestCase):
+    def test_least_outstanding(self):
+        policy = LeastOutstandingReplicaPolicy()
+        policy.started('r1')
+        policy.started('r1')
+        policy.started('r2')
+        assert policy.select(['r1', 'r2', 'r3']) == 'r3'
+        policy.started('r3')
+        policy.started('r3')
+        assert policy.select(['r1', 'r2', 'r3']) == 'r2'
+        policy.finished('r1', 0.001)
+        policy.finished('r1', 0.001)
+        assert policy.select(['r1', 'r2', 'r3']) == 'r1'
+
+    def test_ewma_prefers_fast_replica(self):
+        policy = EWMALatencyReplicaPolicy()
+        for _ in range(5):
+            for replica, latency in [('r1', 0.010), ('r2', 0.001)]:
+                policy.started(replica)
+                policy.finished(replica, latency)
+        assert policy.select(['r1', 'r2']) == 'r2'
+        policy.started('r2')
+        policy.finished('r2', 0, failed=True)
+        assert policy.select(['r1', 'r2']) == 'r1'
+
+
+class TestReplicaReads(TestCase):
+    """
+        Uses 127.0.0.1:6371 and 127.0.0.1:6372 as replicas of the two test
+        masters.
+    """
+    def setUp(self):
+        self.replicas = [redis.StrictRedis(port=6371),
+                         redis.StrictRedis(port=6372)]
+        self.replicas[0].slaveof('127.0.0.1', 6379)
+        self.replicas[1].slaveof('127.0.0.1', 6370)
+        for replica in self.replicas:
+            while replica.info('replication')['master_link_status'] != 'up':
+                time.sleep(0.05)
+        self.rc = MultiNodeRedis(['node1|127.0.0.1:6379',
+                                  'node2|127.0.0.1:6370'],
+                                 slave_servers=['node1|127.0.0.1:6371',
+                                                'node2|127.0.0.1:6372'])
+
+    def tearDown(self):
+        self.rc.flushall()
+        for replica in self.replicas:
+            replica.slaveof()
+            replica.flushall()
+
+    def _wait_for_replicas(self):
+        for node in self.rc._get_all_nodes():
+            node.execute_command('WAIT', 1, 1000)
+
+    def test_reads_from_replicas(self):
+        self.rc.mset({'a': '1', 'b': '2', 'c': '3'})
+        self.rc.zadd('z', z1=1)
+        self._wait_for_replicas()
+        # Writing to a replica directly shows which node served the read.
+        for replica in self.replicas:
+            replica.config_set('slave-read-only', 'no')
+            for key in ['a', 'b', 'c']:
+                replica.set(key, 'replica')
+        assert self.rc.get('a', use_slave=True) == 'replica'
+        assert self.rc.get('a') == '1'
+        assert self.rc.mget(['a', 'b', 'c'], use_slave=True) == \
+            ['replica'] * 3
+        assert self.rc.zrange('z', 0, -1, use_slave=True) == ['z1']
+        with self.rc.pipeline(read_from_replicas=True,
+                              transaction=False) as pipe:
+            pipe.get('a').get('b').set('d', '4')
+            assert pipe.execute() == ['replica', 'replica', True]
+        assert self.rc.get('d') == '4'
+        with self.rc.pipeline(read_from_replicas=True,
+                              transaction=False) as pipe:
+            # a read after a write of the same key has to see it
+            pipe.set('a', '5').get('a').get('b')
+            assert pipe.execute() == [True, '5', 'replica']
+        with self.rc.pipeline(read_from_replicas=True) as pipe:
+            pipe.get('b').get('c')
+            assert pipe.execute() == ['2', '3']
+        for replica in self.replicas:
+            replica.config_set('slave-read-only', 'yes')
+
+    def test_falls_back_to_master(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            slave_servers=['node1|127.0.0.1:1',
+                                           'node2|127.0.0.1:1'],
+                            read_from_replicas=True)
+        rc.set('a', '1')
+        assert rc.get('a') == '1'
+
+        with rc.pipeline(read_from_replicas=True, transaction=False) as pipe:
+            pipe.get('a').get('b')
+            assert pipe.execute() == ['1', None]
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            slave_servers=['node1|127.0.0.1:1',
+                                           'node2|127.0.0.1:1'],
+                            max_batch_size=2)
+        with rc.pipeline(read_from_replicas=True, transaction=False) as pipe:
+            # sub-pipelines sent early fall back too
+            for _ in range(5):
+                pipe.get('a')
+            assert pipe.execute() == ['1'] * 5
+
+    def test_policy_feedback(self):
+        policy = RecordingPolicy()
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            slave_servers=['node1|127.0.0.1:6371',
+                                           'node2|127.0.0.1:6372'],
+                            read_policy=policy)
+        rc.get('a', use_slave=True)
+        assert policy.calls == ['started', 'finished']
+        del policy.calls[:]
+        rc._get_node('a', use_slave=True).get('a')
+        assert policy.calls == ['started', 'finished']
+        del policy.calls[:]
+        with rc.pipeline(read_from_replicas=True, transaction=False) as pipe:
+            pipe.get('a')
+            pipe.execute()
+        assert policy.calls == ['started', 'finished']
+        dead = MultiNodeRedis(['node1|127.0.0.1:6379'],
+                              slave_servers=['node1|127.0.0.1:1'],
+                              read_policy=policy)
+        del policy.calls[:]
+        dead.get('a', use_slave=True)
+        assert policy.calls == ['started', 'failed']
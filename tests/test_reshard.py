@@ -0,0 +1,195 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+import redis
+from multinodeexceptions import MultiNodeRedisException
+from multinoderedis import MultiNodeRedis
+from multinoderouter import KetamaRouter
+
+OLD_SERVERS = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+NEW_SERVERS = OLD_SERVERS + ['node3|127.0.0.1:6371']
+
+
+class TestMultiNodeResharder(TestCase):
+    """
+        Adds 127.0.0.1:6371 as node3 to the two test masters.
+    """
+    def setUp(self):
+        self.nodes = dict((name, redis.StrictRedis(port=port,
+                                                   decode_responses=True))
+                          for name, port in [('node1', 6379),
+                                             ('node2', 6370),
+                                             ('node3', 6371)])
+        for node in self.nodes.values():
+            node.flushall()
+        self.rc = MultiNodeRedis(OLD_SERVERS, router=KetamaRouter)
+        self.keys = ['key%d' % i for i in range(200)]
+        self.rc.mset(dict((key, key.upper()) for key in self.keys))
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for node in self.nodes.values():
+            node.flushall()
+        shutil.rmtree(self.tmp)
+
+    def _owner(self, key):
+        owners = [name for name, node in self.nodes.iteritems()
+                  if node.exists(key)]
+        assert len(owners) == 1, owners
+        return owners[0]
+
+    def test_moves(self):
+        moves = self.rc.reshard(NEW_SERVERS).moves(self.keys)
+        assert moves
+        # a consistent-hash ring only moves keys onto the added node
+        for old_name, new_name in moves:
+            assert new_name == 'node3'
+        moved = sum(len(keys) for keys in moves.values())
+        assert 0 < moved < len(self.keys)
+
+    def test_run(self):
+        resharder = self.rc.reshard(NEW_SERVERS, batch_size=50)
+        moves = resharder.moves(self.keys)
+        resharder.run()
+        resharder.finish()
+        assert sorted(self.rc.manager.node_map) == ['node1', 'node2',
+                                                    'node3']
+        router = self.rc.manager.router
+        for key in self.keys:
+            assert self._owner(key) == router.get_node_name(key)
+            assert self.rc.get(key) == key.upper()
+        assert self.rc.mget(self.keys) == [key.upper() for key in self.keys]
+        stats = resharder.stats()
+        assert all(progress['done'] for progress in stats.values())
+        assert sum(progress['moved'] for progress in stats.values()) == \
+            sum(len(keys) for keys in moves.values())
+
+    def test_modulo_router(self):
+        # most keys move, some of them between the two old nodes
+        rc = MultiNodeRedis(OLD_SERVERS)
+        self.rc.delete(*self.keys)
+        rc.mset(dict((key, 'modulo') for key in self.keys))
+        resharder = rc.reshard(NEW_SERVERS)
+        resharder.run()
+        resharder.finish()
+        for key in self.keys:
+            assert self._owner(key) == rc.manager._get_node_name(key)
+        assert rc.mget(self.keys) == ['modulo'] * len(self.keys)
+
+    def test_keeps_node_names(self):
+        for name, node in self.nodes.items():
+            node.set('node_name', name)
+        resharder = self.rc.reshard(NEW_SERVERS)
+        resharder.run()
+        for name, node in self.nodes.items():
+            assert node.get('node_name') == name
+
+    def test_reads_and_writes_during_migration(self):
+        resharder = self.rc.reshard(NEW_SERVERS)
+        moving = resharder.moves(self.keys).values()[0]
+        resharder.begin()
+        # used before run(): moved on first use
+        assert self.rc.get(moving[0]) == moving[0].upper()
+        assert self._owner(moving[0]) == 'node3'
+        self.rc.set(moving[1], 'new')
+        assert self._owner(moving[1]) == 'node3'
+        assert self.rc.mget(moving[2:4]) == [key.upper()
+                                             for key in moving[2:4]]
+        pipe = self.rc.pipeline(transaction=False)
+        pipe.get(moving[4])
+        assert pipe.execute() == [moving[4].upper()]
+        resharder.run()
+        resharder.finish()
+        assert self.rc.get(moving[1]) == 'new'
+        assert self.rc.mget(self.keys[:50]) == [
+            'new' if key == moving[1] else key.upper()
+            for key in self.keys[:50]]
+
+    def test_newer_value_on_target_wins(self):
+        resharder = self.rc.reshard(NEW_SERVERS)
+        moving = resharder.moves(self.keys).values()[0]
+        self.nodes['node3'].set(moving[0], 'newer')
+        resharder.run()
+        resharder.finish()
+        assert self._owner(moving[0]) == 'node3'
+        assert self.rc.get(moving[0]) == 'newer'
+        assert self.rc.get(moving[1]) == moving[1].upper()
+
+    def test_checkpoint_resume(self):
+        path = os.path.join(self.tmp, 'reshard.json')
+        resharder = self.rc.reshard(NEW_SERVERS, batch_size=10,
+                                    checkpoint_path=path)
+        migrate = resharder._migrate
+        calls = []
+
+        def failing_migrate(source, target, keys):
+            calls.append(keys)
+            if len(calls) > 3:
+                raise redis.ConnectionError('lost the node')
+            return migrate(source, target, keys)
+        resharder._migrate = failing_migrate
+        self.assertRaises(redis.ConnectionError, resharder.run)
+        stats = resharder.stats()
+        assert not all(progress['done'] for progress in stats.values())
+        assert os.path.exists(path)
+
+        rc = MultiNodeRedis(OLD_SERVERS, router=KetamaRouter)
+        resumed = rc.reshard(NEW_SERVERS, batch_size=10,
+                             checkpoint_path=path)
+        assert resumed.stats() == stats
+        resumed.run()
+        resumed.finish()
+        for key in self.keys:
+            assert self._owner(key) == rc.manager._get_node_name(key)
+        # another process picks up the finished checkpoint
+        resharder.finish()
+        assert self.rc.mget(self.keys) == [key.upper() for key in self.keys]
+
+    def test_checkpoint_for_other_nodes(self):
+        path = os.path.join(self.tmp, 'reshard.json')
+        self.rc.reshard(NEW_SERVERS, checkpoint_path=path).run()
+        self.assertRaises(MultiNodeRedisException, self.rc.reshard,
+                          OLD_SERVERS + ['node4|127.0.0.1:6372'],
+                          checkpoint_path=path)
+
+    def test_finish_before_run(self):
+        resharder = self.rc.reshard(NEW_SERVERS)
+        resharder.begin()
+        self.assertRaises(MultiNodeRedisException, resharder.finish)
+
+    def test_node_address_change(self):
+        self.assertRaises(MultiNodeRedisException, self.rc.reshard,
+                          ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6371'])
+
+    def test_rate_limit(self):
+        resharder = self.rc.reshard(NEW_SERVERS, batch_size=20,
+                                    keys_per_second=1000)
+        start = time.time()
+        resharder.run()
+        # about 100 keys per source at 1000 keys/sec
+        assert time.time() - start >= 0.05
+
+    def test_moves_on_use_once(self):
+        # the modulo router moves node_name, which every node keeps
+        rc = MultiNodeRedis(OLD_SERVERS)
+        resharder = rc.reshard(NEW_SERVERS)
+        keys = ['moving%d' % i for i in range(20)]
+        moving = [key for moved in resharder.moves(keys).values()
+                  for key in moved]
+        assert resharder.moves(['node_name'])
+        rc.set(moving[0], 'value')
+        resharder.begin()
+        migrated = []
+        migrate = resharder._migrate
+
+        def counting_migrate(source, target, keys):
+            migrated.extend(keys)
+            return migrate(source, target, keys)
+        resharder._migrate = counting_migrate
+        for _ in range(3):
+            assert rc.get(moving[0]) == 'value'
+            assert rc.get(moving[1]) is None
+            rc.get('node_name')
+        assert migrated == moving[:2]
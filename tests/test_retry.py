@@ -0,0 +1,120 @@
+from unittest import TestCase
+import redis
+from multinodebreaker import MultiNodeCircuitBreaker
+from multinodeexceptions import MultiNodeCircuitOpenException
+from multinoderedis import MultiNodeRedis
+from multinoderetry import MultiNodeRetryPolicy
+from redis._compat import b
+
+
+class TestRetryPolicy(TestCase):
+    def test_should_retry(self):
+        policy = MultiNodeRetryPolicy(max_retries=2)
+        sets = [(('SET', 'a', 1), {})]
+        incrs = [(('SET', 'a', 1), {}), (('INCR', 'b'), {})]
+        assert policy.should_retry(redis.ConnectionError(), 0, sets)
+        assert policy.should_retry(redis.TimeoutError(), 1, sets)
+        assert not policy.should_retry(redis.ConnectionError(), 2, sets)
+        assert not policy.should_retry(redis.ResponseError(), 0, sets)
+        assert not policy.should_retry(redis.ConnectionError(), 0, incrs)
+        # never reached the node, so safe to resend
+        assert policy.should_retry(MultiNodeCircuitOpenException(), 0, incrs)
+
+    def test_delay(self):
+        policy = MultiNodeRetryPolicy(backoff=0.1, max_backoff=0.3)
+        assert 0.05 <= policy.delay(0) <= 0.1
+        assert 0.1 <= policy.delay(1) <= 0.2
+        assert 0.15 <= policy.delay(5) <= 0.3
+
+
+class FlakyPipelines(object):
+    """
+        Makes the next failures sub-pipeline executes on node fail before
+        sending anything.
+    """
+    def __init__(self, node, failures):
+        self.failures = failures
+        self.executes = 0
+        pipeline = node.pipeline
+
+        def flaky_pipeline(*args, **kwargs):
+            sub_pipeline = pipeline(*args, **kwargs)
+            execute = sub_pipeline.execute
+
+            def flaky_execute(*args, **kwargs):
+                self.executes += 1
+                if self.failures:
+                    self.failures -= 1
+                    sub_pipeline.reset()
+                    raise redis.ConnectionError('flaky')
+                return execute(*args, **kwargs)
+            sub_pipeline.execute = flaky_execute
+            return sub_pipeline
+        node.pipeline = flaky_pipeline
+
+
+class TestPipelineRetry(TestCase):
+    def setUp(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        self.rc = MultiNodeRedis(master_servers)
+        self.flaky = FlakyPipelines(self.rc.manager.node_map['node2'][0], 1)
+        self.healthy = FlakyPipelines(self.rc.manager.node_map['node1'][0], 0)
+        self.keys = {}
+        for i in range(100):
+            key = 'key%d' % i
+            self.keys.setdefault(self.rc.manager._get_node_name(key), key)
+
+    def tearDown(self):
+        self.rc.flushall()
+
+    def test_resends_only_failed_node(self):
+        policy = MultiNodeRetryPolicy(backoff=0.001)
+        with self.rc.pipeline(transaction=False,
+                              retry_policy=policy) as pipe:
+            pipe.set(self.keys['node1'], 'one').set(self.keys['node2'], 'two')
+            pipe.get(self.keys['node2'])
+            assert pipe.execute() == [True, True, b('two')]
+        assert self.flaky.executes == 2
+        assert self.healthy.executes == 1
+
+    def test_execute_iter_retries(self):
+        policy = MultiNodeRetryPolicy(backoff=0.001)
+        with self.rc.pipeline(transaction=False,
+                              retry_policy=policy) as pipe:
+            pipe.set(self.keys['node1'], 'one').set(self.keys['node2'], 'two')
+            pipe.get(self.keys['node2'])
+            assert dict(pipe.execute_iter()) == {0: True, 1: True,
+                                                 2: b('two')}
+        assert self.flaky.executes == 2
+        assert self.healthy.executes == 1
+
+    def test_non_idempotent_not_replayed(self):
+        policy = MultiNodeRetryPolicy(backoff=0.001)
+        with self.rc.pipeline(transaction=False,
+                              retry_policy=policy) as pipe:
+            pipe.set(self.keys['node1'], 'one').incr(self.keys['node2'])
+            results = pipe.execute(raise_on_error=False)
+        assert results[0] is True
+        assert isinstance(results[1], redis.ConnectionError)
+        assert self.flaky.executes == 1
+
+    def test_gives_up(self):
+        self.flaky.failures = 10
+        policy = MultiNodeRetryPolicy(max_retries=2, backoff=0.001)
+        with self.rc.pipeline(transaction=False,
+                              retry_policy=policy) as pipe:
+            pipe.set(self.keys['node2'], 'two')
+            self.assertRaises(redis.ConnectionError, pipe.execute)
+        assert self.flaky.executes == 3
+
+    def test_open_circuit_retried(self):
+        breaker = MultiNodeCircuitBreaker(failure_threshold=1,
+                                          reset_timeout=0.005)
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379'],
+                            circuit_breaker=breaker)
+        node = rc.manager.node_map['node1'][0]
+        breaker.record_failure(node)
+        with rc.pipeline(retry_policy=MultiNodeRetryPolicy(
+                backoff=0.02)) as pipe:
+            assert pipe.incr('counter').execute() == [1]
+        assert breaker.stats()['127.0.0.1:6379']['rejected'] == 1
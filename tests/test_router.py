@@ -0,0 +1,147 @@
+import random
+import zlib
+from unittest import TestCase
+import multinoderouter
+from multinodemanager import MultiNodeManager
+from multinoderouter import ModuloRouter, KetamaRouter
+
+
+class TestModuloRouter(TestCase):
+    def test_matches_original_scheme(self):
+        node_names = {'node1': None, 'node2': None, 'node3': None}.keys()
+        router = ModuloRouter(node_names)
+        for i in range(1000):
+            key = 'key%d' % i
+            crc = zlib.crc32(key.encode('utf-8'))
+            assert router.get_node_name(key) == \
+                node_names[crc % len(node_names)]
+
+    def test_bytes_and_unicode_keys_agree(self):
+        router = ModuloRouter(['node1', 'node2', 'node3'])
+        key = u'caf\xe9'
+        assert router.get_node_name(key) == \
+            router.get_node_name(key.encode('utf-8'))
+
+
+class TestKetamaRouter(TestCase):
+    def setUp(self):
+        self.keys = ['key%d' % i for i in range(20000)]
+
+    def _counts(self, router):
+        counts = {}
+        for key in self.keys:
+            node_name = router.get_node_name(key)
+            counts[node_name] = counts.get(node_name, 0) + 1
+        return counts
+
+    def test_order_independent(self):
+        a = KetamaRouter(['node1', 'node2', 'node3'])
+        b = KetamaRouter(['node3', 'node1', 'node2'])
+        for key in self.keys[:1000]:
+            assert a.get_node_name(key) == b.get_node_name(key)
+
+    def test_balanced(self):
+        counts = self._counts(KetamaRouter(['node1', 'node2', 'node3',
+                                            'node4']))
+        expected = len(self.keys) / 4.0
+        for count in counts.values():
+            assert abs(count - expected) < expected * 0.2
+
+    def test_adding_node_moves_few_keys(self):
+        before = KetamaRouter(['node1', 'node2', 'node3', 'node4'])
+        after = KetamaRouter(['node1', 'node2', 'node3', 'node4', 'node5'])
+        moved = 0
+        for key in self.keys:
+            old, new = before.get_node_name(key), after.get_node_name(key)
+            if old != new:
+                # keys only ever move onto the new node
+                assert new == 'node5'
+                moved += 1
+        assert moved < len(self.keys) * 0.3
+
+    def test_weights(self):
+        router = KetamaRouter(['node1', 'node2'], weights={'node1': 3})
+        counts = self._counts(router)
+        assert counts['node1'] > counts['node2'] * 2
+
+
+class TestBatchRouting(TestCase):
+    def setUp(self):
+        self.keys = ['key%d' % i for i in range(500)] + [u'\u0d80abcd', 7]
+        self.numpy = multinoderouter.numpy
+
+    def tearDown(self):
+        multinoderouter.numpy = self.numpy
+
+    def _check(self, router):
+        expected = [router.get_node_index(key) for key in self.keys]
+        assert router.get_node_indexes(self.keys) == expected
+        multinoderouter.numpy = None
+        assert router.get_node_indexes(self.keys) == expected
+
+    def test_modulo_get_node_indexes(self):
+        self._check(ModuloRouter(['node1', 'node2', 'node3']))
+
+    def test_ketama_get_node_indexes(self):
+        self._check(KetamaRouter(['node1', 'node2', 'node3']))
+
+    def test_route_many(self):
+        manager = MultiNodeManager(['node1|127.0.0.1:6379',
+                                    'node2|127.0.0.1:6370'],
+                                   router=KetamaRouter)
+        groups = manager.route_many(self.keys)
+        assert sorted(sum(groups.values(), [])) == sorted(self.keys)
+        for node, node_keys in groups.iteritems():
+            for key in node_keys:
+                assert manager._get_node(key) is node
+
+
+class TestHashTags(TestCase):
+    def test_tagged_keys_colocate(self):
+        for router in [KetamaRouter(['node1', 'node2', 'node3']),
+                       ModuloRouter(['node1', 'node2', 'node3'],
+                                    hash_tags=True)]:
+            node_name = router.get_node_name('user1000')
+            for key in ['{user1000}', '{user1000}:profile',
+                        'session:{user1000}', 'a{user1000}b{other}']:
+                assert router.get_node_name(key) == node_name
+
+    def test_empty_or_unclosed_tag_hashes_whole_key(self):
+        router = KetamaRouter(['node1', 'node2', 'node3'])
+        for key in ['{}user', 'user{', 'user}{']:
+            assert router.get_node_name(key) == \
+                KetamaRouter(['node1', 'node2', 'node3'],
+                             hash_tags=False).get_node_name(key)
+
+    def test_find_hash_tag(self):
+        for key, tag in [('{user1}:profile', b'user1'), ('a{b}c{d}', b'b'),
+                         ('{}user', None), ('user{', None), ('plain', None),
+                         (u'{caf\xe9}', u'caf\xe9'.encode('utf-8'))]:
+            assert multinoderouter._find_hash_tag(key) == tag
+
+    def test_modulo_ignores_tags_by_default(self):
+        router = ModuloRouter(['node1', 'node2', 'node3'])
+        crc = zlib.crc32('{user1}:profile')
+        assert router.get_node_index('{user1}:profile') == crc % 3
+
+
+class TestNodeOrder(TestCase):
+    def test_matches_python2_dict_order(self):
+        rng = random.Random(7)
+        for count in range(1, 40):
+            node_names = ['node%d' % i for i in range(1, count + 1)]
+            node_names += ['%x' % rng.getrandbits(32) for _ in range(count)]
+            rng.shuffle(node_names)
+            order = {}
+            for node_name in node_names:
+                order[node_name] = None
+            assert multinoderouter._python2_dict_order(node_names) == \
+                order.keys()
+            assert multinoderouter.node_order(node_names) == order.keys()
+
+    def test_manager_uses_node_order(self):
+        master_servers = ['node%d|127.0.0.1:6379' % i for i in range(1, 9)]
+        manager = MultiNodeManager(master_servers)
+        assert manager.router.node_names == (
+            'node8', 'node1', 'node3', 'node2', 'node5', 'node4', 'node7',
+            'node6')
@@ -0,0 +1,74 @@
+from unittest import TestCase
+from multinodeexceptions import MultiNodeRedisException
+from multinoderedis import MultiNodeRedis
+from multinoderouter import KetamaRouter
+from redis._compat import b
+
+INCR_BY = """
+local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+redis.call('SET', KEYS[2], value)
+return value
+"""
+
+
+class TestScripts(TestCase):
+    def setUp(self):
+        master_servers = ['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370']
+        self.rc = MultiNodeRedis(master_servers, router=KetamaRouter)
+        self.script = self.rc.register_script(INCR_BY)
+        for node in self.rc._get_all_nodes():
+            node.script_flush()
+
+    def tearDown(self):
+        self.rc.flushall()
+
+    def test_call(self):
+        assert self.script(keys=['{a}:n', '{a}:copy'], args=[5]) == 5
+        node = self.rc._get_node('{a}:n')
+        assert self.script.is_loaded(node)
+        assert self.script(keys=['{a}:n', '{a}:copy'], args=[2]) == 7
+        assert self.rc.get('{a}:copy') == b('7')
+
+    def test_noscript_fallback(self):
+        self.script(keys=['{a}:n', '{a}:copy'], args=[1])
+        self.rc._get_node('{a}:n').script_flush()
+        assert self.script(keys=['{a}:n', '{a}:copy'], args=[1]) == 2
+
+    def test_keys_on_one_node(self):
+        keys = ['key%d' % i for i in range(20)]
+        self.assertRaises(MultiNodeRedisException, self.script, keys=keys,
+                          args=[1])
+        self.assertRaises(MultiNodeRedisException, self.script, keys=[],
+                          args=[1])
+
+    def test_preload(self):
+        self.rc.preload_scripts()
+        for node in self.rc._get_all_nodes():
+            assert self.script.is_loaded(node)
+            assert node.script_exists(self.script.sha) == [True]
+
+    def test_pipeline(self):
+        for transaction in [False, True]:
+            with self.rc.pipeline(transaction=transaction) as pipe:
+                self.script(keys=['{a}:n', '{a}:copy'], args=[1], client=pipe)
+                pipe.get('{a}:copy')
+                assert pipe.execute() == [1, b('1')]
+            self.rc.delete('{a}:n')
+        assert self.script.is_loaded(self.rc._get_node('{a}:n'))
+
+    def test_pipeline_noscript_rerun(self):
+        self.rc.preload_scripts()
+        self.rc._get_node('{a}:n').script_flush()
+        with self.rc.pipeline(transaction=False) as pipe:
+            self.script(keys=['{a}:n', '{a}:copy'], args=[3], client=pipe)
+            pipe.get('other')
+            assert pipe.execute() == [3, None]
+        with self.rc.pipeline(transaction=False) as pipe:
+            self.script(keys=['{a}:n', '{a}:copy'], args=[3], client=pipe)
+            assert pipe.execute() == [6]
+        with self.rc.pipeline(transaction=False) as pipe:
+            self.rc._get_node('{a}:n').script_flush()
+            self.script(keys=['{a}:n', '{a}:copy'], args=[3], client=pipe)
+            pipe.get('other')
+            assert dict(pipe.execute_iter()) == {0: 9, 1: None}
+        assert self.script.is_loaded(self.rc._get_node('{a}:n'))
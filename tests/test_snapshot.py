@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+import redis
+from multinodeexceptions import MultiNodeRedisException
+from multinoderedis import MultiNodeRedis
+from multinodesnapshot import read_snapshot
+
+
+class TestMultiNodeSnapshot(TestCase):
+    def setUp(self):
+        self.rc = MultiNodeRedis(['node1|127.0.0.1:6379',
+                                  'node2|127.0.0.1:6370'])
+        self.keys = ['key%d' % i for i in range(100)]
+        self.rc.mset(dict((key, key.upper()) for key in self.keys))
+        self.rc.hmset('hash', {'f1': 'v1', 'f2': 'v2'})
+        self.rc.zadd('zset', 1, 'a', 2, 'b')
+        self.rc.set('expiring', 'soon')
+        self.rc.expire('expiring', 100)
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for port in [6379, 6370, 6371]:
+            redis.StrictRedis(port=port).flushall()
+        shutil.rmtree(self.tmp)
+
+    def _check(self, rc):
+        assert rc.mget(self.keys) == [key.upper() for key in self.keys]
+        assert rc.hgetall('hash') == {'f1': 'v1', 'f2': 'v2'}
+        assert rc.zrange('zset', 0, -1, withscores=True) == [('a', 1.0),
+                                                              ('b', 2.0)]
+        assert rc.get('expiring') == 'soon'
+        assert 95 < rc.ttl('expiring') <= 100
+
+    def test_export_restore(self):
+        snapshot = self.rc.snapshot(batch_size=30)
+        shards = snapshot.export(self.tmp)
+        assert sorted(shards) == ['node1', 'node2']
+        assert sum(shard['keys'] for shard in shards.values()) == 103
+        assert sorted(os.listdir(self.tmp)) == ['manifest.json',
+                                                'node1.snap', 'node2.snap']
+        self.rc.flushall()
+        result = snapshot.restore(self.tmp)
+        assert result['keys'] == 103
+        assert result['skipped'] == 0
+        self._check(self.rc)
+
+    def test_restore_into_other_nodes(self):
+        self.rc.snapshot().export(self.tmp)
+        self.rc.flushall()
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370',
+                             'node3|127.0.0.1:6371'])
+        assert rc.snapshot().restore(self.tmp)['keys'] == 103
+        self._check(rc)
+        assert redis.StrictRedis(port=6371).dbsize() > 0
+
+    def test_existing_keys(self):
+        snapshot = self.rc.snapshot()
+        snapshot.export(self.tmp)
+        self.rc.set('key1', 'changed')
+        result = snapshot.restore(self.tmp)
+        assert result['keys'] == 0
+        assert result['skipped'] == 103
+        assert self.rc.get('key1') == 'changed'
+        assert snapshot.restore(self.tmp, replace=True)['keys'] == 103
+        assert self.rc.get('key1') == 'KEY1'
+
+    def test_expired_keys(self):
+        self.rc._get_node('expiring').pexpire('expiring', 50)
+        snapshot = self.rc.snapshot()
+        snapshot.export(self.tmp)
+        self.rc.flushall()
+        time.sleep(0.1)
+        result = snapshot.restore(self.tmp)
+        assert result['expired'] == 1
+        assert result['keys'] == 102
+        assert self.rc.get('expiring') is None
+
+    def test_node_name_not_exported(self):
+        node = self.rc._get_all_nodes()[0]
+        node.set('node_name', 'node1')
+        shards = self.rc.snapshot().export(self.tmp)
+        for shard in shards.values():
+            for key, payload, expire_at in read_snapshot(shard['path']):
+                assert key != 'node_name'
+
+    def test_truncated(self):
+        shards = self.rc.snapshot().export(self.tmp)
+        path = shards['node1']['path']
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2] + data[-8:])
+        self.assertRaises(MultiNodeRedisException, list, read_snapshot(path))
+        with open(path, 'wb') as f:
+            f.write('not a snapshot')
+        self.assertRaises(MultiNodeRedisException, list, read_snapshot(path))
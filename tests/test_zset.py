@@ -0,0 +1,170 @@
+import random
+from unittest import TestCase
+from multinodecodec import MultiNodeCodec
+from multinodeexceptions import MultiNodeRedisException
+from multinoderedis import MultiNodeRedis
+import multinodezset
+
+
+def _by_score(member):
+    # redis breaks score ties by member
+    return member[1], member[0]
+
+
+class TestMultiNodeSortedSets(TestCase):
+    def setUp(self):
+        self.rc = MultiNodeRedis(['node1|127.0.0.1:6379',
+                                  'node2|127.0.0.1:6370'])
+        rng = random.Random(42)
+        self.keys = ['board%d' % i for i in range(6)]
+        self.sets = {}
+        for key in self.keys:
+            members = dict(('player%d' % rng.randrange(300),
+                            rng.randrange(-1000, 100000) / 4.0)
+                           for _ in range(200))
+            self.sets[key] = members
+            args = []
+            for member, score in members.iteritems():
+                args.extend([score, member])
+            self.rc.zadd(key, *args)
+
+    def tearDown(self):
+        self.rc.flushall()
+
+    def _merged(self, desc):
+        members = [(member, score) for key in self.keys
+                   for member, score in self.sets[key].iteritems()]
+        return sorted(members, key=_by_score, reverse=desc)
+
+    def _union(self, aggregate):
+        totals = {}
+        for members in self.sets.values():
+            for member, score in members.iteritems():
+                totals.setdefault(member, []).append(score)
+        return dict((member, aggregate(scores))
+                    for member, scores in totals.iteritems())
+
+    def test_sets_spread_over_nodes(self):
+        nodes = set(self.rc._get_node(key) for key in self.keys)
+        assert len(nodes) == 2
+
+    def test_zrange_many(self):
+        expected = self._merged(desc=True)
+        assert self.rc.zrange_many(self.keys, 0, 9, desc=True,
+                                   withscores=True) == expected[:10]
+        assert self.rc.zrange_many(self.keys, 5, 24, desc=True,
+                                   page_size=7) == [
+            member for member, _ in expected[5:25]]
+        expected = self._merged(desc=False)
+        assert self.rc.zrange_many(self.keys, 0, -1, withscores=True,
+                                   page_size=16) == expected
+        assert self.rc.zrange_many(self.keys + ['missing'], 0, 2) == [
+            member for member, _ in expected[:3]]
+        assert self.rc.zrange_many(['missing'], 0, 10) == []
+
+    def test_negative_indexes_rejected(self):
+        for start, end in [(-1, -1), (-5, 9), (0, -2)]:
+            self.assertRaises(MultiNodeRedisException, self.rc.zrange_many,
+                              self.keys, start, end)
+            self.assertRaises(MultiNodeRedisException, self.rc.zunion_range,
+                              self.keys, start, end)
+
+    def test_pages_bounded(self):
+        fetched = []
+        fetch_pages = multinodezset._fetch_pages
+
+        def counting_fetch(manager, keys, offsets, size, desc):
+            pages = fetch_pages(manager, keys, offsets, size, desc)
+            fetched.extend(len(page) for page in pages)
+            return pages
+        multinodezset._fetch_pages = counting_fetch
+        try:
+            self.rc.zrange_many(self.keys, 0, 4, desc=True)
+        finally:
+            multinodezset._fetch_pages = fetch_pages
+        # never more than top 5 from any set
+        assert sum(fetched) <= 5 * len(self.keys) + 5
+
+    def test_zunion_range(self):
+        for aggregate, combine in [('SUM', sum), ('MIN', min),
+                                   ('MAX', max)]:
+            totals = self._union(combine)
+            top = sorted(totals.iteritems(), key=_by_score, reverse=True)
+            result = self.rc.zunion_range(self.keys, 0, 9, desc=True,
+                                          withscores=True,
+                                          aggregate=aggregate, page_size=8)
+            assert [member for member, _ in result] == [
+                member for member, _ in top[:10]]
+            for member, score in result:
+                self.assertAlmostEqual(score, totals[member])
+            bottom = sorted(totals.iteritems(), key=_by_score)
+            result = self.rc.zunion_range(self.keys, 3, 7,
+                                          aggregate=aggregate)
+            assert result == [member for member, _ in bottom[3:8]]
+        self.assertRaises(MultiNodeRedisException, self.rc.zunion_range,
+                          self.keys, 0, 9, aggregate='AVG')
+
+    def test_zunion_range_matches_zunionstore(self):
+        # all on one node, so redis can compute it too
+        rc = self.rc
+        keys = ['{tag}a', '{tag}b', '{tag}c']
+        rc.zadd(keys[0], 1, 'x', 5, 'y', -2, 'z')
+        rc.zadd(keys[1], 3, 'x', -4, 'z', 2, 'w')
+        rc.zadd(keys[2], 7, 'w', 1, 'v')
+        node = rc._get_node(keys[0])
+        node.zunionstore('{tag}union', keys)
+        expected = node.zrevrange('{tag}union', 0, -1, withscores=True)
+        assert rc.zunion_range(keys, 0, -1, desc=True,
+                               withscores=True) == expected
+        assert rc.zunion_range(keys, 0, 1, desc=True, page_size=1) == [
+            member for member, _ in expected[:2]]
+        expected = node.zrange('{tag}union', 0, -1, withscores=True)
+        assert rc.zunion_range(keys, 0, 2, withscores=True,
+                               page_size=1) == expected[:3]
+
+    def test_zunion_range_tied_scores(self):
+        # few distinct scores, so many totals tie with the K-th best
+        rc = self.rc
+        rng = random.Random(7)
+        keys = ['{ties}%d' % i for i in range(3)]
+        for key in keys:
+            args = []
+            for member in rng.sample(range(30), 12):
+                args.extend([rng.randrange(3), 'm%02d' % member])
+            rc.zadd(key, *args)
+        node = rc._get_node(keys[0])
+        for aggregate in ['SUM', 'MIN', 'MAX']:
+            node.zunionstore('{ties}union', keys, aggregate=aggregate)
+            for desc in [True, False]:
+                if desc:
+                    expected = node.zrevrange('{ties}union', 0, -1,
+                                              withscores=True)
+                else:
+                    expected = node.zrange('{ties}union', 0, -1,
+                                           withscores=True)
+                for page_size in [1, 2, 3]:
+                    for start, end in [(0, 0), (0, 4), (3, 9)]:
+                        assert rc.zunion_range(
+                            keys, start, end, desc=desc, withscores=True,
+                            aggregate=aggregate, page_size=page_size) == \
+                            expected[start:end + 1]
+
+    def test_ties_ordered_like_redis(self):
+        self.rc.zadd('tied1', 1, 'b', 1, 'd')
+        self.rc.zadd('tied2', 1, 'a', 1, 'c')
+        assert self.rc.zrange_many(['tied1', 'tied2'], 0, -1) == [
+            'a', 'b', 'c', 'd']
+        assert self.rc.zrange_many(['tied1', 'tied2'], 0, -1,
+                                   desc=True) == ['d', 'c', 'b', 'a']
+
+    def test_codec(self):
+        rc = MultiNodeRedis(['node1|127.0.0.1:6379', 'node2|127.0.0.1:6370'],
+                            codec=MultiNodeCodec())
+        rc.zadd('coded1', 1, {'id': 1}, 3, 'three')
+        rc.zadd('coded2', 2, [2])
+        assert rc.zrange_many(['coded1', 'coded2'], 0, -1,
+                              withscores=True) == [({'id': 1}, 1.0),
+                                                   ([2], 2.0),
+                                                   ('three', 3.0)]
+        assert rc.zunion_range(['coded1', 'coded2'], 0, 0,
+                               desc=True) == ['three']